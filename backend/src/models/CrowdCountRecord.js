@@ -42,7 +42,11 @@ const CrowdCountSchema = new mongoose.Schema({
       type: String,
       enum: ['low', 'medium', 'high']
     },
-    weatherConditions: String
+    weatherConditions: String,
+    inferenceSize: {
+      type: Number,
+      comment: 'YOLO input size chosen for this request'
+    }
   }
 });
 
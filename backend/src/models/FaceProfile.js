@@ -40,6 +40,10 @@ const FaceProfileSchema = new mongoose.Schema({
       type: String,
       default: 'v1.0'
     },
+    // Registration image the embedding was computed from (re-embedding migrations)
+    imageId: {
+      type: mongoose.Schema.Types.ObjectId
+    },
     createdAt: {
       type: Date,
       default: Date.now
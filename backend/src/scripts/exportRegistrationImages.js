@@ -0,0 +1,83 @@
+// Export every registration image from GridFS for a re-embedding migration
+//
+//   node src/scripts/exportRegistrationImages.js /data/registration-export
+//
+// Writes images/<imageId> (the original upload bytes) and manifest.jsonl
+// ({ imageId, userId } per line) for
+// ml-services/individual_auth/migrate_embeddings.py. Images already on disk
+// are not downloaded again, so an interrupted export can be rerun. Do not
+// rerun it into an export that a migration is still reading, because the
+// migration checkpoint refers to positions in the manifest.
+const fs = require('fs');
+const path = require('path');
+const { once } = require('events');
+const { pipeline } = require('stream/promises');
+const dotenv = require('dotenv');
+const mongoose = require('mongoose');
+const { GridFSBucket } = require('mongodb');
+const FaceProfile = require('../models/FaceProfile');
+const logger = require('../utils/logger');
+
+dotenv.config();
+
+async function exportRegistrationImages(outputDir) {
+  const bucket = new GridFSBucket(mongoose.connection.db, { bucketName: 'images' });
+  const imagesDir = path.join(outputDir, 'images');
+  fs.mkdirSync(imagesDir, { recursive: true });
+
+  const manifest = fs.createWriteStream(path.join(outputDir, 'manifest.jsonl'));
+  const stats = { profiles: 0, images: 0, downloaded: 0, missing: 0 };
+
+  const profiles = FaceProfile.find({}, { userId: 1, faceImages: 1 }).lean().cursor();
+  for await (const profile of profiles) {
+    stats.profiles++;
+
+    for (const image of profile.faceImages) {
+      const imageId = image.imageId.toString();
+      const target = path.join(imagesDir, imageId);
+
+      if (!fs.existsSync(target)) {
+        try {
+          await pipeline(bucket.openDownloadStream(image.imageId), fs.createWriteStream(`${target}.tmp`));
+          fs.renameSync(`${target}.tmp`, target);
+          stats.downloaded++;
+        } catch (error) {
+          logger.warn(`Registration image ${imageId} not exported: ${error.message}`);
+          stats.missing++;
+          continue;
+        }
+      }
+
+      if (!manifest.write(`${JSON.stringify({ imageId, userId: profile.userId.toString() })}\n`)) {
+        await once(manifest, 'drain');
+      }
+      stats.images++;
+    }
+  }
+
+  manifest.end();
+  await once(manifest, 'finish');
+  return stats;
+}
+
+if (require.main === module) {
+  const outputDir = process.argv[2];
+  if (!outputDir) {
+    console.error('Usage: node src/scripts/exportRegistrationImages.js <output-dir>');
+    process.exit(1);
+  }
+
+  mongoose.connect(process.env.MONGODB_URI)
+    .then(() => exportRegistrationImages(outputDir))
+    .then((stats) => {
+      logger.info(`Exported ${stats.images} registration images of ${stats.profiles} profiles `
+        + `(${stats.downloaded} downloaded, ${stats.missing} missing) to ${outputDir}`);
+      return mongoose.disconnect();
+    })
+    .catch((error) => {
+      logger.error(`Export failed: ${error.message}`);
+      process.exit(1);
+    });
+}
+
+module.exports = { exportRegistrationImages };
@@ -0,0 +1,91 @@
+// Store re-embedded registration images next to the existing embeddings
+//
+//   node src/scripts/importEmbeddings.js /data/migration-v2/embeddings.jsonl
+//
+// Reads the output of ml-services/individual_auth/migrate_embeddings.py and
+// pushes one encrypted faceEmbeddings entry per line. Each entry is tagged
+// with its modelVersion and imageId. Embeddings of other versions are left
+// in place. An entry whose (imageId, modelVersion) pair is already stored is
+// skipped, so the import can be rerun after an interruption.
+const fs = require('fs');
+const readline = require('readline');
+const dotenv = require('dotenv');
+const mongoose = require('mongoose');
+const FaceProfile = require('../models/FaceProfile');
+const encryptionService = require('../utils/encryption');
+const logger = require('../utils/logger');
+
+dotenv.config();
+
+function toUpdate(record) {
+  const imageId = new mongoose.Types.ObjectId(record.imageId);
+
+  return {
+    updateOne: {
+      filter: {
+        userId: new mongoose.Types.ObjectId(record.userId),
+        faceEmbeddings: { $not: { $elemMatch: { imageId, modelVersion: record.modelVersion } } }
+      },
+      update: {
+        $push: {
+          faceEmbeddings: {
+            vector: encryptionService.encrypt(JSON.stringify(record.embedding)),
+            modelVersion: record.modelVersion,
+            imageId,
+            createdAt: new Date()
+          }
+        }
+      }
+    }
+  };
+}
+
+async function importEmbeddings(file, batchSize = 1000) {
+  const stats = { records: 0, imported: 0 };
+  const lines = readline.createInterface({ input: fs.createReadStream(file), crlfDelay: Infinity });
+  let operations = [];
+
+  const flush = async () => {
+    if (operations.length === 0) return;
+    const result = await FaceProfile.bulkWrite(operations, { ordered: false });
+    stats.imported += result.modifiedCount;
+    operations = [];
+  };
+
+  for await (const line of lines) {
+    if (!line.trim()) continue;
+
+    operations.push(toUpdate(JSON.parse(line)));
+    stats.records++;
+
+    if (operations.length >= batchSize) {
+      await flush();
+      logger.info(`Imported ${stats.imported}/${stats.records} embeddings`);
+    }
+  }
+  await flush();
+
+  return stats;
+}
+
+if (require.main === module) {
+  const file = process.argv[2];
+  if (!file) {
+    console.error('Usage: node src/scripts/importEmbeddings.js <embeddings.jsonl>');
+    process.exit(1);
+  }
+
+  mongoose.connect(process.env.MONGODB_URI)
+    .then(() => importEmbeddings(file))
+    .then((stats) => {
+      logger.info(`Imported ${stats.imported} of ${stats.records} embeddings `
+        + `(${stats.records - stats.imported} already present or without a profile)`);
+      return mongoose.disconnect();
+    })
+    .catch((error) => {
+      logger.error(`Import failed: ${error.message}`);
+      process.exit(1);
+    });
+}
+
+module.exports = { importEmbeddings };
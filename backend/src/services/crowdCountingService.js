@@ -6,6 +6,7 @@ const logger = require('../utils/logger');
 class CrowdCountingService {
   constructor() {
     this.mlServiceUrl = process.env.ML_SERVICE_CROWD_URL || 'http://localhost:5003';
+    this.mlTimeoutMs = 10000;
   }
 
   async countFaces(imageBuffer, location, eventName, metadata = {}) {
@@ -46,7 +47,8 @@ class CrowdCountingService {
         metadata: {
           imageResolution: metadata.imageResolution,
           crowdDensity: countResult.crowd_density || 'medium',
-          weatherConditions: metadata.weatherConditions
+          weatherConditions: metadata.weatherConditions,
+          inferenceSize: countResult.imgsz
         }
       });
 
@@ -104,7 +106,11 @@ class CrowdCountingService {
       const response = await axios.post(
         `${this.mlServiceUrl}/count`,
         { image: base64Image },
-        { timeout: 10000 }
+        {
+          timeout: this.mlTimeoutMs,
+          // Lets the ML service drop the work once we have stopped waiting
+          headers: { 'X-Request-Timeout-Ms': String(this.mlTimeoutMs) }
+        }
       );
 
       return response.data;
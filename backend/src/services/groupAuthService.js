@@ -8,7 +8,9 @@ const logger = require('../utils/logger');
 class GroupAuthService {
   constructor() {
     this.mlServiceUrl = process.env.ML_SERVICE_GROUP_URL || 'http://localhost:5002';
-    this.confidenceThreshold = 0.85;
+    this.mlTimeoutMs = 15000;
+    // Derive from the ROC report of ml-services validate.py (recommended_threshold)
+    this.confidenceThreshold = parseFloat(process.env.GROUP_MATCH_THRESHOLD) || 0.85;
   }
 
   async authenticateGroup(imageBuffer, eventId, eventName, location) {
@@ -155,7 +157,11 @@ class GroupAuthService {
       const response = await axios.post(
         `${this.mlServiceUrl}/detect-and-extract`,
         { image: base64Image },
-        { timeout: 15000 }
+        {
+          timeout: this.mlTimeoutMs,
+          // Lets the ML service drop the work once we have stopped waiting
+          headers: { 'X-Request-Timeout-Ms': String(this.mlTimeoutMs) }
+        }
       );
 
       return response.data;
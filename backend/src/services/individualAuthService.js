@@ -7,7 +7,9 @@ const logger = require('../utils/logger');
 class IndividualAuthService {
   constructor() {
     this.mlServiceUrl = process.env.ML_SERVICE_INDIVIDUAL_URL || 'http://localhost:5001';
-    this.confidenceThreshold = 0.85;
+    this.mlTimeoutMs = 10000;
+    // Derive from the ROC report of ml-services validate.py (recommended_threshold)
+    this.confidenceThreshold = parseFloat(process.env.INDIVIDUAL_MATCH_THRESHOLD) || 0.85;
   }
 
   async registerUser(userId, files, metadata) {
@@ -42,7 +44,9 @@ class IndividualAuthService {
 
         faceEmbeddings.push({
           vector: encryptedEmbedding,
-          modelVersion: 'v1.0',
+          // Version of the ML service model that produced this embedding
+          modelVersion: embedding.model_version || 'v1.0',
+          imageId,
           createdAt: new Date()
         });
       }
@@ -92,9 +96,17 @@ class IndividualAuthService {
 
       let bestMatch = null;
       let highestSimilarity = 0;
+      const modelVersion = result.model_version || 'v1.0';
+      let unmigratedProfiles = 0;
 
       for (const profile of faceProfiles) {
-        for (const storedEmbedding of profile.faceEmbeddings) {
+        const embeddings = this.embeddingsForVersion(profile, modelVersion);
+        if (embeddings.length === 0) {
+          unmigratedProfiles += 1;
+          continue;
+        }
+
+        for (const storedEmbedding of embeddings) {
           // Decrypt stored embedding
           const decryptedEmbedding = JSON.parse(
             encryptionService.decrypt(storedEmbedding.vector)
@@ -110,6 +122,13 @@ class IndividualAuthService {
         }
       }
 
+      if (unmigratedProfiles > 0) {
+        logger.warn(
+          `${unmigratedProfiles} active profile(s) have no ${modelVersion} embeddings and were not matched; ` +
+          'run the re-embedding migration for this model version'
+        );
+      }
+
       const processingTime = Date.now() - startTime;
 
       if (bestMatch && highestSimilarity >= this.confidenceThreshold) {
@@ -172,16 +191,31 @@ class IndividualAuthService {
     }
   }
 
+  // Embeddings of different model versions live in different spaces and
+  // cannot be compared against one threshold: only the query's version is
+  // used, and profiles not yet migrated to it are skipped
+  embeddingsForVersion(profile, modelVersion) {
+    return profile.faceEmbeddings.filter(
+      (embedding) => (embedding.modelVersion || 'v1.0') === modelVersion
+    );
+  }
+
   async getEmbedding(base64Image) {
     try {
       const response = await axios.post(`${this.mlServiceUrl}/predict`, {
         image: base64Image
       }, {
-        timeout: 10000
+        timeout: this.mlTimeoutMs,
+        // Lets the ML service drop the work once we have stopped waiting
+        headers: { 'X-Request-Timeout-Ms': String(this.mlTimeoutMs) }
       });
 
       return response.data;
     } catch (error) {
+      // 422: the face failed the ML service quality gate
+      if (error.response && error.response.status === 422) {
+        throw new Error(error.response.data.error);
+      }
       logger.error(`ML service error: ${error.message}`);
       throw new Error('Face recognition service unavailable');
     }
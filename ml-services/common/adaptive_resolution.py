@@ -0,0 +1,209 @@
+import os
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Inference sizes the controller moves between, smallest first
+# (multiples of 32 for YOLO's stride)
+IMGSZ_LADDER = [int(s) for s in os.environ.get('YOLO_IMGSZ_LADDER', '320,416,512,640,800,960').split(',')]
+
+# Starting size
+IMGSZ_DEFAULT = int(os.environ.get('YOLO_IMGSZ', 640))
+
+# p95 latency of the model call the controller aims for; 33ms is the
+# 30 FPS target of crowd_counting/validate.py
+LATENCY_TARGET_MS = float(os.environ.get('YOLO_P95_TARGET_MS', 33))
+
+# p95 per-frame latency of batched calls (call latency / frames) the
+# controller aims for; the default is 30 FPS of batched throughput, which
+# is how validate.py amortises its FPS target over batches
+BATCH_LATENCY_TARGET_MS = float(os.environ.get('YOLO_BATCH_P95_TARGET_MS_PER_FRAME', LATENCY_TARGET_MS))
+
+# Step up only if the next size is projected to stay under this fraction
+# of the target, so the controller does not oscillate around it
+HEADROOM = float(os.environ.get('YOLO_STEP_UP_HEADROOM', 0.7))
+
+# Requests waiting or running at which the service counts as overloaded
+MAX_QUEUE_DEPTH = int(os.environ.get('YOLO_MAX_QUEUE_DEPTH', 4))
+
+LATENCY_WINDOW = 64
+
+
+class ResolutionController:
+    """
+    Picks the model input size per request to meet a p95 latency target
+    Latencies are kept in a rolling window per ladder size, recorded
+    against the size in use when the call started even if a small image
+    capped it. Single-image calls and batched calls (per frame) have
+    separate windows, each with its own target; the load of a size is the
+    larger of p95 / target over the two. Every adjust_every calls the
+    controller steps one size down if the load is over 1 or too many
+    requests are queued, and one size up if the queue is empty and the
+    next size is projected to stay under the headroom, projecting its load
+    from the current one scaled by the pixel count. After a step the new
+    size's windows start empty, so decisions only use latencies measured
+    under the current load.
+    """
+
+    def __init__(self, sizes=IMGSZ_LADDER, initial=IMGSZ_DEFAULT, target_ms=LATENCY_TARGET_MS,
+                 headroom=HEADROOM, max_queue_depth=MAX_QUEUE_DEPTH, window=LATENCY_WINDOW,
+                 adjust_every=16, queue_depth=None, batch_target_ms=BATCH_LATENCY_TARGET_MS):
+        """
+        Args:
+            sizes: Candidate input sizes
+            initial: Starting size (the nearest candidate is used)
+            target_ms: p95 latency target of one single-image model call
+            headroom: Fraction of the target a step up must stay under
+            max_queue_depth: Queued requests that force a step down
+            window: Latencies kept per size
+            adjust_every: Calls between decisions
+            queue_depth: Optional function -> requests queued elsewhere
+                (e.g. in a batch scheduler), added to the in-flight count
+            batch_target_ms: p95 per-frame latency target of batched calls
+        """
+        self.sizes = sorted(set(sizes))
+        self.level = min(range(len(self.sizes)), key=lambda i: abs(self.sizes[i] - initial))
+        self.target_ms = target_ms
+        self.batch_target_ms = batch_target_ms
+        self._targets = {'single': target_ms, 'batch': batch_target_ms}
+        self.headroom = headroom
+        self.max_queue_depth = max_queue_depth
+        self.adjust_every = adjust_every
+        self.queue_depth = queue_depth
+
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._since_adjust = 0
+        self.in_flight = 0
+        self.steps_up = 0
+        self.steps_down = 0
+        self.last_decision = None
+
+    @property
+    def size(self):
+        return self.sizes[self.level]
+
+    def choose(self, image_shape=None):
+        """
+        Input size for a request
+        Args:
+            image_shape: Optional (height, width, ...) of the image; sizes
+                above its longest side (rounded up to 32) only upscale it
+        """
+        size = self.size
+        if image_shape is not None:
+            longest = -(-max(image_shape[:2]) // 32) * 32
+            size = min(size, max(longest, self.sizes[0]))
+        return size
+
+    def _depth(self):
+        extra = self.queue_depth() if self.queue_depth is not None else 0
+        return self.in_flight + extra
+
+    def _p95(self, size, kind):
+        latencies = self._latencies[(size, kind)]
+        if len(latencies) < 8:
+            return None
+        return float(np.percentile(np.array(latencies), 95))
+
+    def _load(self, size):
+        """
+        Worst p95 / target over the single and batched windows of a size
+        Returns:
+            (load, {kind: p95}) with load None until a window has enough samples
+        """
+        p95s = {kind: self._p95(size, kind) for kind in self._targets}
+        p95s = {kind: p95 for kind, p95 in p95s.items() if p95 is not None}
+        if not p95s:
+            return None, p95s
+        return max(p95 / self._targets[kind] for kind, p95 in p95s.items()), p95s
+
+    @contextmanager
+    def track(self, image_shape=None, frames=None):
+        """
+        Time one model call at the chosen size
+        Args:
+            image_shape: Shape of the image (the largest one for a batch)
+            frames: Number of frames for a batched call, whose latency is
+                kept per frame in its own window; None for a single image
+        Yields:
+            Input size to run the model at
+        """
+        with self._lock:
+            self.in_flight += 1
+            level_size = self.size
+            size = self.choose(image_shape)
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield size
+            ok = True
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.in_flight -= 1
+                if ok:
+                    if frames is None:
+                        self._latencies[(level_size, 'single')].append(latency_ms)
+                    else:
+                        self._latencies[(level_size, 'batch')].append(latency_ms / max(frames, 1))
+                    self._since_adjust += 1
+                    if self._since_adjust >= self.adjust_every:
+                        self._since_adjust = 0
+                        self._adjust()
+
+    def _adjust(self):
+        # Called with self._lock held
+        current = self.size
+        load, p95s = self._load(current)
+        if load is None:
+            return
+        depth = self._depth()
+
+        if (load > 1.0 or depth >= self.max_queue_depth) and self.level > 0:
+            self.level -= 1
+            self.steps_down += 1
+            reason = 'overloaded' if depth >= self.max_queue_depth else 'over_target'
+        elif depth == 0 and self.level < len(self.sizes) - 1:
+            bigger = self.sizes[self.level + 1]
+            if load * (bigger / current) ** 2 > self.headroom:
+                return
+            self.level += 1
+            self.steps_up += 1
+            reason = 'headroom'
+        else:
+            return
+
+        self._latencies[(self.size, 'single')].clear()
+        self._latencies[(self.size, 'batch')].clear()
+        self.last_decision = {
+            'from': current,
+            'to': self.size,
+            'reason': reason,
+            'load': load,
+            'p95_ms': p95s,
+            'queue_depth': depth,
+            'at': time.time()
+        }
+        print(f"Input size {current} -> {self.size} ({reason}, p95 at {load:.0%} of target, queue {depth})")
+
+    def stats(self):
+        """Controller state for /health"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'sizes': self.sizes,
+                'target_p95_ms': self.target_ms,
+                'batch_target_p95_ms_per_frame': self.batch_target_ms,
+                'queue_depth': self._depth(),
+                'p95_ms': {str(size): self._p95(size, 'single') for size in self.sizes
+                           if self._latencies[(size, 'single')]},
+                'batch_p95_ms_per_frame': {str(size): self._p95(size, 'batch') for size in self.sizes
+                                           if self._latencies[(size, 'batch')]},
+                'steps_up': self.steps_up,
+                'steps_down': self.steps_down,
+                'last_decision': self.last_decision
+            }
@@ -0,0 +1,361 @@
+import os
+import math
+import time
+import asyncio
+import base64
+import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from image_decoding import ImageTooLargeError
+from deadlines import DeadlineExceeded, check_deadline, deadline_from_headers, deadline_scope
+
+# Serving mode for the apps' __main__: 'flask' (dev server), 'async', or
+# 'prefork' where supported (see prefork.py)
+SERVING_MODE = os.environ.get('SERVING_MODE', 'flask')
+
+# Inference threads; each runs one request at a time
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', os.cpu_count() or 1))
+
+# Requests waiting or running before new ones are shed (default 4 per worker)
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 4 * INFERENCE_WORKERS))
+
+# Shed new requests when the estimated wait for a worker exceeds this
+MAX_QUEUE_WAIT_MS = float(os.environ.get('MAX_QUEUE_WAIT_MS', 5000))
+
+# Largest accepted request body (base64 JSON of a large photo)
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 64 * 1024 * 1024))
+
+
+class OverloadedError(Exception):
+    """Raised when the inference queue is too deep to accept more work"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class InferenceQueue:
+    """
+    Bounded worker pool for CPU-bound inference
+    Tracks how many requests are waiting or running and an exponentially
+    weighted average of service time, so the wait a new request would see
+    can be estimated before it is accepted. Requests beyond max_depth, or
+    whose estimated wait exceeds max_wait_ms, are rejected immediately.
+    Jobs whose client deadline passes while they wait are dropped when a
+    worker picks them up, without running.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, max_depth=MAX_QUEUE_DEPTH,
+                 max_wait_ms=MAX_QUEUE_WAIT_MS, smoothing=0.2):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_wait_ms = max_wait_ms
+        self.smoothing = smoothing
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.avg_service_ms = None
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def estimated_wait_ms(self, pending=None):
+        """Expected time before a newly queued request starts running"""
+        pending = self.pending if pending is None else pending
+        if self.avg_service_ms is None:
+            return 0.0
+        # Requests ahead of us are served workers at a time
+        return max(0, pending - self.workers + 1) / self.workers * self.avg_service_ms
+
+    def _admit(self):
+        with self._lock:
+            wait_ms = self.estimated_wait_ms()
+            if self.pending >= self.max_depth:
+                reason = f"queue depth {self.pending} at limit {self.max_depth}"
+            elif wait_ms > self.max_wait_ms:
+                reason = f"estimated wait {wait_ms:.0f}ms over {self.max_wait_ms:.0f}ms"
+            else:
+                self.pending += 1
+                return
+            self.rejected += 1
+
+        # Tell clients to come back once the current backlog has drained
+        retry_after = max(1, math.ceil(max(wait_ms, self.avg_service_ms or 0) / 1000))
+        raise OverloadedError(f"Server overloaded: {reason}", retry_after)
+
+    def _run(self, func, deadline):
+        try:
+            check_deadline('queue', deadline)
+        except DeadlineExceeded:
+            with self._lock:
+                self.pending -= 1
+                self.expired += 1
+            raise
+
+        with self._lock:
+            self.running += 1
+        start = time.perf_counter()
+        try:
+            with deadline_scope(deadline):
+                return func()
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.running -= 1
+                self.pending -= 1
+                self.completed += 1
+                if self.avg_service_ms is None:
+                    self.avg_service_ms = elapsed_ms
+                else:
+                    self.avg_service_ms += self.smoothing * (elapsed_ms - self.avg_service_ms)
+
+    async def run(self, func, deadline=None):
+        """
+        Run func on the worker pool
+        Args:
+            func: Zero-argument callable
+            deadline: Client deadline (time.time() seconds); func sees it
+                through check_deadline()
+        Raises:
+            OverloadedError: if the request was shed
+            DeadlineExceeded: if the deadline passed before func started
+        """
+        check_deadline('queue', deadline)
+        self._admit()
+        future = self._executor.submit(self._run, func, deadline)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Client went away: a job that never started gives its slot back
+            # (a running one releases it when it finishes)
+            if future.cancel():
+                with self._lock:
+                    self.pending -= 1
+            raise
+
+    def stats(self):
+        """Queue state for /health"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.pending,
+                'running': self.running,
+                'max_queue_depth': self.max_depth,
+                'estimated_wait_ms': self.estimated_wait_ms(),
+                'max_queue_wait_ms': self.max_wait_ms,
+                'avg_service_ms': self.avg_service_ms,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'accepting': self.pending < self.max_depth and self.estimated_wait_ms() <= self.max_wait_ms
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncRoute:
+    """
+    An image endpoint served by the async front end
+    The JSON body is parsed and the base64 image decoded on the event loop;
+    only infer(image_bytes) runs on the inference pool.
+    """
+
+    def __init__(self, path, namespace, infer, errors=None):
+        """
+        Args:
+            path: URL path (same as the Flask route)
+            namespace: Coalescing key namespace
+            infer: Function image_bytes -> result dict
+            errors: Dict of exception class -> function(e) -> (body, status)
+        """
+        self.path = path
+        self.namespace = namespace
+        self.infer = infer
+        self.errors = errors or {}
+
+
+class BlockingRoute:
+    """
+    A JSON endpoint whose handler blocks, e.g. on a batch scheduler
+    handler(data, deadline) -> (body, status) runs on the inference pool
+    like the image routes, so it is admitted, shed and counted in /health
+    the same way; the scheduler behind it does the batching.
+    """
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+
+
+def _json_error(body, status, headers=None):
+    return web.json_response(body, status=status, headers=headers)
+
+
+def _overloaded(e):
+    return _json_error(
+        {'error': str(e), 'retry_after': e.retry_after}, 503,
+        headers={'Retry-After': str(e.retry_after)}
+    )
+
+
+def _deadline_exceeded(e, metrics):
+    if metrics is not None:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+    return _json_error({'error': str(e), 'stage': e.stage}, 504)
+
+
+def _route_handler(route, queue, coalescer, metrics):
+    async def handler(request):
+        start_time = time.time()
+        response = await _handle(request, start_time)
+        if metrics is not None:
+            metrics.observe(route.path, response.status, (time.time() - start_time) * 1000)
+        return response
+
+    async def _handle(request, start_time):
+        try:
+            data = await request.json()
+            image_data = data.get('image') if isinstance(data, dict) else None
+        except ValueError:
+            return _json_error({'error': 'Invalid JSON body'}, 400)
+
+        if not image_data:
+            return _json_error({'error': 'No image provided'}, 400)
+
+        try:
+            image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
+        except (binascii.Error, ValueError):
+            return _json_error({'error': 'Invalid base64 image'}, 400)
+
+        key = coalescer.content_key(image_bytes, route.namespace)
+        deadline = deadline_from_headers(request.headers, start_time)
+        try:
+            # Duplicates wait here on the event loop; only the leader takes
+            # a queue slot and a worker
+            result, coalesced = await coalescer.run_async(
+                key, lambda: queue.run(lambda: route.infer(image_bytes), deadline), deadline
+            )
+        except OverloadedError as e:
+            return _overloaded(e)
+        except DeadlineExceeded as e:
+            return _deadline_exceeded(e, metrics)
+        except ImageTooLargeError as e:
+            return _json_error({'error': str(e)}, 413)
+        except Exception as e:
+            for error_type, respond in route.errors.items():
+                if isinstance(e, error_type):
+                    body, status = respond(e)
+                    return _json_error(body, status)
+            return _json_error({'error': str(e)}, 500)
+
+        return web.json_response({
+            **result,
+            'processing_time': (time.time() - start_time) * 1000,
+            'coalesced': coalesced
+        })
+
+    return handler
+
+
+def _blocking_handler(route, queue, metrics):
+    async def handler(request):
+        start_time = time.time()
+        response = await _handle(request, start_time)
+        if metrics is not None:
+            metrics.observe(route.path, response.status, (time.time() - start_time) * 1000)
+        return response
+
+    async def _handle(request, start_time):
+        try:
+            data = await request.json()
+        except ValueError:
+            return _json_error({'error': 'Invalid JSON body'}, 400)
+
+        deadline = deadline_from_headers(request.headers, start_time)
+        try:
+            body, status = await queue.run(lambda: route.handler(data, deadline), deadline)
+        except OverloadedError as e:
+            return _overloaded(e)
+        except DeadlineExceeded as e:
+            return _deadline_exceeded(e, metrics)
+        except Exception as e:
+            body, status = {'error': str(e)}, 500
+        if status == 200:
+            body['processing_time'] = (time.time() - start_time) * 1000
+        return web.json_response(body, status=status)
+
+    return handler
+
+
+def _admin_handler(handler):
+    async def admin(request):
+        try:
+            data = await request.json() if request.can_read_body else None
+        except ValueError:
+            return web.json_response({'error': 'Request body is not valid JSON'}, status=400)
+        body, status = handler(data, request.headers)
+        return web.json_response(body, status=status)
+
+    return admin
+
+
+def create_async_app(routes, health, coalescer, metrics=None, queue=None, admin_routes=(),
+                     blocking_routes=()):
+    """
+    Build the aiohttp application
+    Args:
+        routes: List of AsyncRoute
+        health: Function -> dict with the service's /health fields
+        coalescer: RequestCoalescer shared by the routes
+        metrics: Optional ServiceMetrics
+        queue: InferenceQueue (default: one sized from the environment)
+        admin_routes: (method, path, handler(data, headers) -> (body, status)) tuples
+            served on the event loop, e.g. model_admin_routes()
+        blocking_routes: List of BlockingRoute
+    """
+    queue = queue or InferenceQueue()
+    app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    app['queue'] = queue
+
+    for route in routes:
+        app.router.add_post(route.path, _route_handler(route, queue, coalescer, metrics))
+
+    for route in blocking_routes:
+        app.router.add_post(route.path, _blocking_handler(route, queue, metrics))
+
+    for method, path, handler in admin_routes:
+        app.router.add_route(method, path, _admin_handler(handler))
+
+    async def health_handler(request):
+        report = health()
+        report['queue'] = queue.stats()
+        # Busy replicas fail the health check so the load balancer routes around them
+        if not report['queue']['accepting']:
+            report['status'] = 'overloaded'
+            return web.json_response(report, status=503)
+        return web.json_response(report)
+
+    app.router.add_get('/health', health_handler)
+
+    async def close_queue(app):
+        queue.shutdown()
+
+    app.on_cleanup.append(close_queue)
+    return app
+
+
+def serve_async(routes, health, coalescer, port, host='0.0.0.0', metrics=None, queue=None, admin_routes=(),
+                blocking_routes=()):
+    """Run the async front end until interrupted"""
+    app = create_async_app(routes, health, coalescer, metrics=metrics, queue=queue, admin_routes=admin_routes,
+                           blocking_routes=blocking_routes)
+    queue = app['queue']
+    print(f"Async server on port {port}: {queue.workers} inference workers, "
+          f"max queue {queue.max_depth}, max wait {queue.max_wait_ms:.0f}ms")
+    web.run_app(app, host=host, port=port, print=None)
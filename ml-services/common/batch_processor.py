@@ -1,26 +1,91 @@
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import threading
+import traceback
 import time
 
+from deadlines import DeadlineExceeded
+
+class QueueFullError(Exception):
+    """Raised when a non-blocking submission finds the queue full"""
+    pass
+
+class ItemError:
+    """
+    Structured per-item failure returned in place of a result
+    Keeps the item index, the exception and its formatted traceback
+    """
+    
+    def __init__(self, index, error):
+        self.index = index
+        self.error = error
+        self.error_type = type(error).__name__
+        self.traceback = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'error': str(self.error),
+            'error_type': self.error_type
+        }
+    
+    def __repr__(self):
+        return f"ItemError(index={self.index}, error={self.error_type}: {self.error})"
+
 class BatchProcessor:
     """
     Batch processing utility for ML inference
     Improves throughput by processing multiple images together
+    Parallel work runs on one long-lived executor (thread or process pool)
+    behind a bounded submission queue, so large image sets can be streamed
+    through imap without materialising them.
     """
     
-    def __init__(self, batch_size=8, max_workers=4):
+    def __init__(self, batch_size=8, max_workers=4, queue_size=None, executor_type='thread'):
+        """
+        Args:
+            batch_size: Number of images per stacked batch
+            max_workers: Number of pool workers
+            queue_size: Max submitted-but-unfinished items (default 2 * max_workers)
+            executor_type: 'thread' or 'process'
+        """
+        if executor_type not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor type: {executor_type}")
+        
         self.batch_size = batch_size
         self.max_workers = max_workers
+        self.queue_size = queue_size or max_workers * 2
+        self.executor_type = executor_type
+        
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self.expired = 0
     
-    def process_batch(self, images, process_func):
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+    
+    def process_batch(self, images, process_func, deadlines=None):
         """
         Process a batch of images
         Args:
             images: List of images to process
             process_func: Function to apply to each image
+            deadlines: Optional per-image deadlines (time.time() seconds or
+                None); images already past theirs when a batch is formed
+                are left out and the batch is filled with later images
         Returns:
-            List of results
+            List of results, with ItemError for images dropped as expired
         """
+        if deadlines is not None:
+            return self._process_with_deadlines(images, process_func, deadlines)
+        
         results = []
         
         # Process in batches
@@ -31,6 +96,30 @@ class BatchProcessor:
         
         return results
     
+    def _process_with_deadlines(self, images, process_func, deadlines):
+        """Form each batch from the images whose deadline has not passed"""
+        results = [None] * len(images)
+        waiting = deque(range(len(images)))
+        
+        while waiting:
+            now = time.time()
+            batch = []
+            while waiting and len(batch) < self.batch_size:
+                index = waiting.popleft()
+                deadline = deadlines[index]
+                if deadline is not None and deadline <= now:
+                    results[index] = ItemError(index, DeadlineExceeded('batch', (now - deadline) * 1000))
+                    self.expired += 1
+                else:
+                    batch.append(index)
+            
+            if batch:
+                batch_results = self._process_single_batch([images[i] for i in batch], process_func)
+                for index, result in zip(batch, batch_results):
+                    results[index] = result
+        
+        return results
+    
     def _process_single_batch(self, batch, process_func):
         """Process a single batch"""
         # Stack images into batch tensor
@@ -41,34 +130,136 @@ class BatchProcessor:
         
         return results
     
-    def process_parallel(self, items, process_func):
+    def _get_executor(self):
+        """Create the pool on first use and keep it for later calls"""
+        with self._executor_lock:
+            if self._executor is None:
+                if self.executor_type == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+    
+    def _release(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._slots.release()
+    
+    def submit(self, process_func, item, block=True, timeout=None):
         """
-        Process items in parallel using thread pool
+        Submit one item to the shared executor
         Args:
-            items: List of items to process
-            process_func: Function to apply to each item
+            process_func: Function to apply to the item (must be picklable
+                for the process pool)
+            item: Item to process
+            block: Wait for a free queue slot when the queue is full
+            timeout: Max seconds to wait for a slot when blocking
         Returns:
-            List of results
+            concurrent.futures.Future
+        Raises:
+            QueueFullError: if no slot became available
         """
-        results = [None] * len(items)
+        if not self._slots.acquire(blocking=block, timeout=timeout if block else None):
+            raise QueueFullError(f"Submission queue full ({self.queue_size} items)")
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            future_to_index = {
-                executor.submit(process_func, item): i 
-                for i, item in enumerate(items)
-            }
-            
-            # Collect results
-            for future in as_completed(future_to_index):
-                index = future_to_index[future]
-                try:
-                    results[index] = future.result()
-                except Exception as e:
-                    print(f"Error processing item {index}: {e}")
-                    results[index] = None
+        try:
+            future = self._get_executor().submit(process_func, item)
+        except Exception:
+            self._slots.release()
+            raise
         
-        return results
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._release)
+        
+        return future
+    
+    @staticmethod
+    def _collect(index, future):
+        """Turn a finished future into a result or an ItemError"""
+        try:
+            return future.result()
+        except Exception as e:
+            return ItemError(index, e)
+    
+    def imap(self, items, process_func, ordered=True):
+        """
+        Stream items through the executor
+        Args:
+            items: Any iterable of items (consumed lazily)
+            process_func: Function to apply to each item
+            ordered: Yield in input order (True) or in completion order
+        Yields:
+            Results, with ItemError in place of failed items. In unordered
+            mode each value is an (index, result) tuple.
+        Closing the generator early cancels items that have not started.
+        """
+        window = deque()
+        
+        try:
+            for index, item in enumerate(items):
+                window.append((index, self.submit(process_func, item)))
+                
+                if len(window) >= self.queue_size:
+                    if ordered:
+                        index, future = window.popleft()
+                        yield self._collect(index, future)
+                    else:
+                        yield from self._drain_completed(window)
+            
+            if ordered:
+                while window:
+                    index, future = window.popleft()
+                    yield self._collect(index, future)
+            else:
+                while window:
+                    yield from self._drain_completed(window)
+        finally:
+            for _, future in window:
+                future.cancel()
+    
+    def _drain_completed(self, window):
+        """Wait for at least one future and yield every finished one"""
+        done, _ = wait([future for _, future in window], return_when=FIRST_COMPLETED)
+        remaining = deque()
+        finished = []
+        for index, future in window:
+            if future in done:
+                finished.append((index, self._collect(index, future)))
+            else:
+                remaining.append((index, future))
+        window.clear()
+        window.extend(remaining)
+        yield from finished
+    
+    def process_parallel(self, items, process_func):
+        """
+        Process items in parallel on the shared executor
+        Args:
+            items: Iterable of items to process
+            process_func: Function to apply to each item
+        Returns:
+            List of results in input order, with ItemError for failed items
+        """
+        return list(self.imap(items, process_func))
+    
+    def cancel(self):
+        """Cancel every submitted item that has not started yet"""
+        with self._pending_lock:
+            pending = list(self._pending)
+        return sum(1 for future in pending if future.cancel())
+    
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stop the executor
+        Args:
+            wait: Block until running items finish
+            cancel_pending: Cancel queued items instead of running them
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_pending)
 
 class InferenceCache:
     """
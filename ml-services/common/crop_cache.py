@@ -0,0 +1,224 @@
+import os
+import json
+import threading
+import numpy as np
+
+from batch_processor import BatchProcessor, ItemError
+
+INDEX_FILE = 'index.json'
+NO_FACE = -1
+
+
+class CropCache:
+    """
+    Persistent cache of aligned face crops
+    Crops are stored as uint8 arrays in fixed-size memory-mapped chunk files
+    (chunk_00000.npy, ...) with an index.json mapping each image path to
+    (mtime_ns, size, slot). An entry is stale when the file's mtime or size
+    changed; a different detector config or crop shape resets the cache.
+    A re-cropped image overwrites its old slot, and slots of images that no
+    longer have a face are reused, so chunk files only grow with the number
+    of images. Thread-safe, but one process at a time: save() rewrites the
+    whole index, so concurrent writers in several processes lose each
+    other's entries.
+    """
+
+    def __init__(self, cache_dir, detector_config, crop_shape=(160, 160, 3), chunk_size=1024):
+        """
+        Args:
+            cache_dir: Directory holding the index and chunk files
+            detector_config: JSON-serialisable dict describing detection and
+                alignment; crops made with another config are never reused
+            crop_shape: Shape of every stored crop
+            chunk_size: Crops per chunk file
+        """
+        self.cache_dir = cache_dir
+        self.detector_config = detector_config
+        self.crop_shape = tuple(crop_shape)
+        self.chunk_size = chunk_size
+
+        self._lock = threading.Lock()
+        self._chunks = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        header = {
+            'detector_config': self.detector_config,
+            'crop_shape': list(self.crop_shape),
+            'chunk_size': self.chunk_size
+        }
+
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            if all(index.get(key) == value for key, value in header.items()):
+                return index
+            print(f"Crop cache config changed, resetting {self.cache_dir}")
+
+        # New or incompatible cache: drop old chunks
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.startswith('chunk_') and file_name.endswith('.npy'):
+                os.remove(os.path.join(self.cache_dir, file_name))
+
+        return {**header, 'next_slot': 0, 'entries': {}}
+
+    def _chunk(self, chunk_id, create=False):
+        """Open (or create) one chunk memmap"""
+        chunk = self._chunks.get(chunk_id)
+        if chunk is None:
+            path = os.path.join(self.cache_dir, f'chunk_{chunk_id:05d}.npy')
+            if create and not os.path.exists(path):
+                chunk = np.lib.format.open_memmap(
+                    path, mode='w+', dtype=np.uint8, shape=(self.chunk_size,) + self.crop_shape
+                )
+            else:
+                chunk = np.load(path, mmap_mode='r+')
+            self._chunks[chunk_id] = chunk
+        return chunk
+
+    def _read_slot(self, slot):
+        if slot == NO_FACE:
+            return None
+        return self._chunk(slot // self.chunk_size)[slot % self.chunk_size]
+
+    def _store(self, path, stat, crop):
+        """Index a crop (or a no-face marker) in the path's old slot, a freed one or a new one"""
+        entry = self._index['entries'].get(path)
+        old_slot = entry[2] if entry is not None else NO_FACE
+        free_slots = self._index.setdefault('free_slots', [])
+
+        if crop is None:
+            slot = NO_FACE
+            if old_slot != NO_FACE:
+                free_slots.append(old_slot)
+        else:
+            if old_slot != NO_FACE:
+                slot = old_slot
+            elif free_slots:
+                slot = free_slots.pop()
+            else:
+                slot = self._index['next_slot']
+                self._index['next_slot'] += 1
+            self._chunk(slot // self.chunk_size, create=True)[slot % self.chunk_size] = crop
+        self._index['entries'][path] = [stat.st_mtime_ns, stat.st_size, slot]
+        self._dirty = True
+
+    def _lookup(self, path, stat):
+        """Return (found, slot) and update hit statistics"""
+        entry = self._index['entries'].get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            self.hits += 1
+            return True, entry[2]
+        if entry is not None:
+            self.stale += 1
+        else:
+            self.misses += 1
+        return False, None
+
+    def get(self, path, compute_fn):
+        """
+        Get the crop for one image, computing and storing it on a miss
+        Args:
+            path: Image file path
+            compute_fn: Function path -> uint8 crop of crop_shape, or None
+                when no face is found
+        Returns:
+            View of the crop, or None when no face was found; the view
+            changes if the image is edited and cropped again
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        with self._lock:
+            found, slot = self._lookup(path, stat)
+            if found:
+                return self._read_slot(slot)
+
+        crop = compute_fn(path)
+
+        with self._lock:
+            self._store(path, stat, crop)
+        return crop
+
+    def warm(self, paths, compute_fn, max_workers=4):
+        """
+        Make sure every path is cached, computing misses on a thread pool
+        Returns:
+            List of the paths that have a face crop
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        missing = []
+
+        with self._lock:
+            for path in paths:
+                stat = os.stat(path)
+                found, _ = self._lookup(path, stat)
+                if not found:
+                    missing.append((path, stat))
+
+        if missing:
+            with BatchProcessor(max_workers=max_workers) as processor:
+                results = processor.imap([path for path, _ in missing], compute_fn)
+                for (path, stat), crop in zip(missing, results):
+                    if isinstance(crop, ItemError):
+                        print(f"Could not crop {path}: {crop.error}")
+                        continue
+                    with self._lock:
+                        self._store(path, stat, crop)
+            self.save()
+
+        entries = self._index['entries']
+        with_face = [path for path in paths if path in entries and entries[path][2] != NO_FACE]
+
+        stats = self.stats()
+        print(f"Crop cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['stale']} stale (hit rate {stats['hit_rate']:.1%}), "
+              f"{len(paths) - len(with_face)} without a face")
+
+        return with_face
+
+    def read(self, path):
+        """
+        Read an already cached crop (no computation)
+        Raises:
+            KeyError: if the path is not cached or has no face
+        """
+        if isinstance(path, bytes):
+            path = path.decode('utf-8')
+        entry = self._index['entries'][os.path.abspath(path)]
+        if entry[2] == NO_FACE:
+            raise KeyError(f"No face cached for {path}")
+        with self._lock:
+            return self._read_slot(entry[2])
+
+    def save(self):
+        """Flush chunks and write the index atomically"""
+        with self._lock:
+            for chunk in self._chunks.values():
+                chunk.flush()
+            if not self._dirty:
+                return
+            path = os.path.join(self.cache_dir, INDEX_FILE)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._index, f)
+            os.replace(path + '.tmp', path)
+            self._dirty = False
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.misses + self.stale
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._index['entries']),
+            'stored_crops': self._index['next_slot'] - len(self._index.get('free_slots', []))
+        }
@@ -0,0 +1,87 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Clients send either the time they will give up (Unix epoch milliseconds)
+# or how many milliseconds they are still willing to wait. The relative
+# form is immune to clock skew between hosts and is what the backend sends.
+DEADLINE_HEADER = 'X-Request-Deadline'
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before a pipeline stage starts"""
+
+    def __init__(self, stage, overdue_ms=0.0):
+        super().__init__(f"Deadline exceeded before {stage} ({overdue_ms:.0f}ms late)")
+        self.stage = stage
+        self.overdue_ms = overdue_ms
+
+
+def deadline_from_headers(headers, received_at=None):
+    """
+    Absolute deadline (time.time() seconds) from request headers
+    Args:
+        headers: Mapping of request headers
+        received_at: When the request arrived (default now); relative
+            timeouts count from here
+    Returns:
+        Deadline in seconds since the epoch, or None when the client sent none
+    """
+    received_at = time.time() if received_at is None else received_at
+    deadlines = []
+
+    value = headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            deadlines.append(float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = headers.get(TIMEOUT_HEADER)
+    if value:
+        try:
+            deadlines.append(received_at + float(value) / 1000)
+        except ValueError:
+            pass
+
+    return min(deadlines) if deadlines else None
+
+
+def remaining_ms(deadline):
+    """Milliseconds left before a deadline (negative once passed, None if unset)"""
+    if deadline is None:
+        return None
+    return (deadline - time.time()) * 1000
+
+
+def check_deadline(stage, deadline=None):
+    """
+    Raise DeadlineExceeded if the deadline has passed
+    Call at every stage boundary so abandoned work stops early.
+    Args:
+        stage: Name of the stage about to start (reported in metrics)
+        deadline: Explicit deadline (default: the current thread's scope)
+    """
+    deadline = current_deadline() if deadline is None else deadline
+    left = remaining_ms(deadline)
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(stage, -left)
+
+
+def current_deadline():
+    """Deadline of the request this thread is working on, or None"""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Make deadline the current thread's deadline for check_deadline()"""
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+from collections import defaultdict, deque
+
+import cv2
+import numpy as np
+
+from batch_processor import BatchProcessor, ItemError
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+
+def load_rgb(path):
+    """Read an image file as an RGB uint8 array"""
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not read image {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def list_images(directory):
+    """Sorted image files directly inside a directory"""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def load_annotation(image_path):
+    """
+    Load the ground truth stored next to an image (photo.jpg -> photo.json)
+    Returns None when there is no annotation file
+    """
+    annotation_path = os.path.splitext(image_path)[0] + '.json'
+    if not os.path.exists(annotation_path):
+        return None
+    with open(annotation_path) as f:
+        return json.load(f)
+
+
+def identity_samples(root, bucket):
+    """
+    Labelled samples from a class-per-folder directory (root/person/*.jpg)
+    """
+    samples = []
+    if not os.path.isdir(root):
+        return samples
+    for person in sorted(os.listdir(root)):
+        for path in list_images(os.path.join(root, person)):
+            samples.append({'path': path, 'label': person, 'bucket': bucket})
+    return samples
+
+
+def percentiles(values):
+    """Latency percentiles in milliseconds"""
+    if not values:
+        return {f'p{p}': 0.0 for p in LATENCY_PERCENTILES}
+    return {f'p{p}': float(np.percentile(values, p)) for p in LATENCY_PERCENTILES}
+
+
+def nearest_neighbour_accuracy(embeddings, labels):
+    """
+    Leave-one-out top-1 identification accuracy by cosine similarity
+    Args:
+        embeddings: (n, d) array
+        labels: length-n sequence of identities
+    """
+    if len(labels) < 2:
+        return 0.0
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarities = embeddings @ embeddings.T
+    np.fill_diagonal(similarities, -np.inf)
+    labels = np.asarray(labels)
+    return float(np.mean(labels[np.argmax(similarities, axis=1)] == labels))
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of (x, y, w, h) boxes; returns (len(a), len(b))"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax2[:, None], bx2[None]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(ay2[:, None], by2[None]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = inter_w * inter_h
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None] - intersection
+    return intersection / np.maximum(union, 1e-12)
+
+
+def match_detections(predicted, ground_truth, iou_threshold=0.5):
+    """
+    Greedy one-to-one matching of predicted to ground-truth boxes
+    Returns:
+        Tuple of (matched, false positives)
+    """
+    if len(predicted) == 0 or len(ground_truth) == 0:
+        return 0, len(predicted)
+
+    iou = box_iou(predicted, ground_truth)
+    matched = 0
+    while True:
+        index = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[index] < iou_threshold:
+            break
+        matched += 1
+        iou[index[0], :] = 0
+        iou[:, index[1]] = 0
+
+    return matched, len(predicted) - matched
+
+
+class EvaluationResult:
+    """
+    Per-bucket metric sums plus latency samples from one evaluation run
+    """
+
+    def __init__(self):
+        self._sums = defaultdict(lambda: defaultdict(float))
+        self._counts = defaultdict(int)
+        self.batch_latencies_ms = []
+        # Batch latency divided by batch size: throughput cost per image,
+        # not the latency of a single-image call
+        self.amortized_image_latencies_ms = []
+        self.predictions = defaultdict(list)
+        self.errors = []
+        self.total_images = 0
+        self.inference_time_ms = 0.0
+
+    def add(self, bucket, metrics):
+        self._counts[bucket] += 1
+        for name, value in metrics.items():
+            self._sums[bucket][name] += float(value)
+
+    @property
+    def buckets(self):
+        return list(self._counts)
+
+    def bucket_totals(self, bucket):
+        """Summed metrics and sample count for one bucket"""
+        return dict(self._sums[bucket]), self._counts[bucket]
+
+    def bucket_means(self, bucket):
+        """Mean of every metric for one bucket plus its sample count"""
+        count = self._counts[bucket]
+        means = {name: total / count for name, total in self._sums[bucket].items()} if count else {}
+        means['samples'] = count
+        return means
+
+    def latency(self):
+        """
+        Latency percentiles and throughput of the model calls
+        Per-image figures are amortised over each batch (batch latency /
+        batch size); batch_latency_ms is what one model call takes.
+        """
+        fps = self.total_images * 1000 / self.inference_time_ms if self.inference_time_ms > 0 else 0.0
+        amortized = self.amortized_image_latencies_ms
+        return {
+            'batch_latency_ms': percentiles(self.batch_latencies_ms),
+            'amortized_image_latency_ms': percentiles(amortized),
+            'avg_amortized_processing_time_ms': float(np.mean(amortized)) if amortized else 0.0,
+            'fps': fps
+        }
+
+
+class EvaluationEngine:
+    """
+    Streams a labelled dataset through a model in batches
+    Loading (decode, detection, cropping) runs on a BatchProcessor worker
+    pool while the previous batch is in the model; each model call is
+    timed so latency percentiles are reported next to accuracy.
+    Samples are dicts with at least 'path' and 'bucket'; any other keys
+    (labels, annotations) are passed through to the scoring function.
+    """
+
+    def __init__(self, predict_batch, load_fn=load_rgb, batch_size=16, num_workers=4):
+        """
+        Args:
+            predict_batch: Function list of loaded inputs -> list of predictions
+            load_fn: Function path -> model input (runs on the worker pool)
+            batch_size: Inputs per model call
+            num_workers: Loader threads
+        """
+        self.predict_batch = predict_batch
+        self.load_fn = load_fn
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def _load(self, sample):
+        return self.load_fn(sample['path'])
+
+    def _flush(self, batch, result, score_fn, collect):
+        samples = [sample for sample, _ in batch]
+        inputs = [loaded for _, loaded in batch]
+
+        start = time.perf_counter()
+        predictions = self.predict_batch(inputs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        result.batch_latencies_ms.append(elapsed_ms)
+        result.amortized_image_latencies_ms.extend([elapsed_ms / len(batch)] * len(batch))
+        result.inference_time_ms += elapsed_ms
+        result.total_images += len(batch)
+
+        for sample, prediction in zip(samples, predictions):
+            if score_fn is not None:
+                result.add(sample['bucket'], score_fn(prediction, sample))
+            if collect:
+                result.predictions[sample['bucket']].append((sample, prediction))
+
+    def run(self, samples, score_fn=None, collect=False):
+        """
+        Evaluate a stream of samples
+        Args:
+            samples: Iterable of sample dicts (consumed lazily)
+            score_fn: Function (prediction, sample) -> dict of numeric metrics
+            collect: Keep (sample, prediction) pairs per bucket for metrics
+                that need the whole bucket (e.g. identification accuracy)
+        Returns:
+            EvaluationResult
+        """
+        result = EvaluationResult()
+        pending = deque()
+        batch = []
+
+        def tracked():
+            for sample in samples:
+                pending.append(sample)
+                yield sample
+
+        with BatchProcessor(max_workers=self.num_workers, queue_size=self.batch_size * 2) as processor:
+            for loaded in processor.imap(tracked(), self._load):
+                sample = pending.popleft()
+                if isinstance(loaded, ItemError):
+                    result.errors.append({'path': sample['path'], 'error': str(loaded.error)})
+                    continue
+                batch.append((sample, loaded))
+                if len(batch) == self.batch_size:
+                    self._flush(batch, result, score_fn, collect)
+                    batch = []
+
+            if batch:
+                self._flush(batch, result, score_fn, collect)
+
+        for error in result.errors:
+            print(f"Skipped {error['path']}: {error['error']}")
+
+        return result
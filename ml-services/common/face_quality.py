@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import cv2
+
+# FACE_QUALITY_GATE: 'skip' drops low-quality faces before embedding,
+# 'flag' embeds them but marks them, 'off' disables scoring
+QUALITY_GATE_MODE = os.environ.get('FACE_QUALITY_GATE', 'skip')
+
+QUALITY_THRESHOLDS = {
+    'min_sharpness': 60.0,    # Laplacian variance of the 160x160 grey crop
+    'max_yaw': 45.0,          # degrees
+    'max_pitch': 30.0,        # degrees
+    'min_brightness': 40.0,   # mean grey level
+    'max_brightness': 220.0,
+    'min_size': 40            # shorter side of the full-resolution box, pixels
+}
+
+# Side of the grey image every score is computed on, so thresholds do not
+# depend on the face resolution
+QUALITY_SIZE = 160
+
+# Nose height between the eye line and the mouth line on a frontal face
+_FRONTAL_NOSE_RATIO = 0.55
+
+
+class LowQualityFaceError(ValueError):
+    """Raised when the only face in a request fails the quality gate"""
+
+    def __init__(self, quality):
+        super().__init__(f"Face quality too low: {', '.join(quality['reasons'])}")
+        self.quality = quality
+
+
+def _grey_stack(crops):
+    """Stack RGB crops as (n, QUALITY_SIZE, QUALITY_SIZE) float32 grey images"""
+    grey = np.empty((len(crops), QUALITY_SIZE, QUALITY_SIZE), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        crop = np.asarray(crop)
+        if crop.shape[:2] != (QUALITY_SIZE, QUALITY_SIZE):
+            crop = cv2.resize(crop, (QUALITY_SIZE, QUALITY_SIZE), interpolation=cv2.INTER_AREA)
+        grey[i] = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    return grey
+
+
+def sharpness(grey):
+    """Variance of the 4-neighbour Laplacian of each image in a (n, h, w) stack"""
+    laplacian = (
+        4 * grey[:, 1:-1, 1:-1]
+        - grey[:, :-2, 1:-1] - grey[:, 2:, 1:-1]
+        - grey[:, 1:-1, :-2] - grey[:, 1:-1, 2:]
+    )
+    return laplacian.reshape(len(grey), -1).var(axis=1)
+
+
+def landmark_pose(landmarks):
+    """
+    Approximate head pose from five-point landmarks
+    Args:
+        landmarks: (n, 5, 2) array ordered left eye, right eye, nose,
+            left mouth corner, right mouth corner (MTCNN order)
+    Returns:
+        Tuple of (yaw, pitch, roll) arrays in degrees
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+    left_eye, right_eye, nose = landmarks[:, 0], landmarks[:, 1], landmarks[:, 2]
+    mouth = (landmarks[:, 3] + landmarks[:, 4]) / 2
+    eyes = (left_eye + right_eye) / 2
+
+    eye_vector = right_eye - left_eye
+    eye_distance = np.maximum(np.linalg.norm(eye_vector, axis=1), 1e-6)
+    roll = np.degrees(np.arctan2(eye_vector[:, 1], eye_vector[:, 0]))
+
+    # Undo roll so yaw and pitch are measured along the face axes
+    cos, sin = eye_vector[:, 0] / eye_distance, eye_vector[:, 1] / eye_distance
+    offset = nose - eyes
+    horizontal = offset[:, 0] * cos + offset[:, 1] * sin
+    face_height = np.maximum(
+        (mouth - eyes)[:, 1] * cos - (mouth - eyes)[:, 0] * sin, 1e-6
+    )
+    vertical = offset[:, 1] * cos - offset[:, 0] * sin
+
+    # Nose shifts sideways by up to half the eye distance at 90 degrees yaw
+    yaw = np.degrees(np.arcsin(np.clip(2 * horizontal / eye_distance, -1, 1)))
+    pitch = np.degrees(np.arcsin(np.clip(2 * (vertical / face_height - _FRONTAL_NOSE_RATIO), -1, 1)))
+
+    return yaw, pitch, roll
+
+
+def score_faces(crops, boxes, landmarks=None, thresholds=None):
+    """
+    Score a batch of face crops for embedding quality
+    Args:
+        crops: List of RGB uint8 face crops
+        boxes: (n, 4) full-resolution (x1, y1, x2, y2) boxes
+        landmarks: Optional (n, 5, 2) landmarks; pose is not checked without them
+        thresholds: Overrides for QUALITY_THRESHOLDS
+    Returns:
+        List of per-face dicts with the raw measurements, a 0-1 'score',
+        'passed' and the failed checks in 'reasons'
+    """
+    if len(crops) == 0:
+        return []
+    thresholds = {**QUALITY_THRESHOLDS, **(thresholds or {})}
+
+    grey = _grey_stack(crops)
+    blur = sharpness(grey)
+    brightness = grey.reshape(len(grey), -1).mean(axis=1)
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    size = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+
+    checks = {
+        'blurry': blur < thresholds['min_sharpness'],
+        'too_dark': brightness < thresholds['min_brightness'],
+        'too_bright': brightness > thresholds['max_brightness'],
+        'too_small': size < thresholds['min_size']
+    }
+
+    # Each factor is 1 for a comfortably good face and falls towards 0
+    score = (
+        np.clip(blur / (2 * thresholds['min_sharpness']), 0, 1)
+        * np.clip(1 - np.abs(brightness - 128) / 128, 0, 1) ** 0.5
+        * np.clip(size / (2 * thresholds['min_size']), 0, 1)
+    )
+
+    if landmarks is not None:
+        yaw, pitch, roll = landmark_pose(landmarks)
+        checks['extreme_yaw'] = np.abs(yaw) > thresholds['max_yaw']
+        checks['extreme_pitch'] = np.abs(pitch) > thresholds['max_pitch']
+        score = score * np.cos(np.radians(np.clip(yaw, -90, 90))) * np.cos(np.radians(np.clip(pitch, -90, 90)))
+    else:
+        yaw = pitch = roll = None
+
+    failed = np.stack(list(checks.values()), axis=1)
+    names = list(checks)
+
+    results = []
+    for i in range(len(crops)):
+        quality = {
+            'score': round(float(score[i]), 4),
+            'sharpness': round(float(blur[i]), 2),
+            'brightness': round(float(brightness[i]), 2),
+            'size': int(size[i]),
+            'passed': not failed[i].any(),
+            'reasons': [name for name, bad in zip(names, failed[i]) if bad]
+        }
+        if yaw is not None:
+            quality['pose'] = {
+                'yaw': round(float(yaw[i]), 1),
+                'pitch': round(float(pitch[i]), 1),
+                'roll': round(float(roll[i]), 1)
+            }
+        results.append(quality)
+
+    return results
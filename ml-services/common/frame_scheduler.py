@@ -0,0 +1,283 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from deadlines import DeadlineExceeded
+
+# Frames per second each camera is guaranteed; busier cameras only get
+# capacity the others leave unused
+CAMERA_FPS_BUDGET = float(os.environ.get('CAMERA_FPS_BUDGET', 5))
+
+# Frames queued per camera; a newer frame replaces the oldest beyond this
+CAMERA_MAX_QUEUED = int(os.environ.get('CAMERA_MAX_QUEUED', 2))
+
+# Frames per model call and how long to wait for a batch to fill
+FRAME_BATCH_SIZE = int(os.environ.get('FRAME_BATCH_SIZE', 8))
+FRAME_BATCH_WAIT_MS = float(os.environ.get('FRAME_BATCH_WAIT_MS', 10))
+
+LATENCY_WINDOW = 256
+
+
+class FrameDropped(Exception):
+    """Raised for a frame replaced by a newer frame of the same camera"""
+
+    def __init__(self, camera_id, reason='superseded'):
+        super().__init__(f"Frame from camera {camera_id} dropped: {reason}")
+        self.camera_id = camera_id
+        self.reason = reason
+
+
+class _Frame:
+    __slots__ = ('camera_id', 'item', 'deadline', 'enqueued', 'future')
+
+    def __init__(self, camera_id, item, deadline):
+        self.camera_id = camera_id
+        self.item = item
+        self.deadline = deadline
+        self.enqueued = time.perf_counter()
+        self.future = Future()
+
+
+class _Camera:
+    """Queue, token bucket and counters of one camera"""
+
+    def __init__(self, fps_budget):
+        self.queue = deque()
+        self.fps_budget = fps_budget
+        self.burst = max(1.0, fps_budget)
+        self.tokens = self.burst
+        self.refilled = time.perf_counter()
+        self.submitted = 0
+        self.processed = 0
+        self.superseded = 0
+        self.expired = 0
+        self.over_budget = 0
+        self.queue_ms = deque(maxlen=LATENCY_WINDOW)
+        self.latency_ms = deque(maxlen=LATENCY_WINDOW)
+
+    def has_token(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.fps_budget)
+        self.refilled = now
+        return self.tokens >= 1.0
+
+    def stats(self):
+        def percentiles(values):
+            if not values:
+                return {}
+            values = np.array(values)
+            return {f'p{p}': float(np.percentile(values, p)) for p in (50, 95)}
+
+        return {
+            'queued': len(self.queue),
+            'submitted': self.submitted,
+            'processed': self.processed,
+            'dropped_superseded': self.superseded,
+            'dropped_expired': self.expired,
+            'over_budget': self.over_budget,
+            'queue_ms': percentiles(self.queue_ms),
+            'latency_ms': percentiles(self.latency_ms)
+        }
+
+
+class FairFrameScheduler:
+    """
+    Packs frames from many cameras into shared batched model calls
+    Every camera has its own short queue: when it is full the oldest frame
+    is dropped (the caller gets FrameDropped) so a camera is always served
+    its freshest frame. Batches are filled round-robin, one frame per
+    camera per round, first from cameras within their frames-per-second
+    budget and then, with any room left, from cameras over it. A camera
+    flooding the endpoint therefore cannot crowd out the others. Frames
+    whose deadline has passed are left out of the batch.
+    """
+
+    def __init__(self, process_batch, batch_size=FRAME_BATCH_SIZE, max_wait_ms=FRAME_BATCH_WAIT_MS,
+                 fps_budget=CAMERA_FPS_BUDGET, max_queued=CAMERA_MAX_QUEUED):
+        """
+        Args:
+            process_batch: Function list of items -> list of results (same order)
+            batch_size: Max frames per process_batch call
+            max_wait_ms: How long a partial batch waits for more frames
+            fps_budget: Guaranteed frames per second per camera
+            max_queued: Frames queued per camera before drop-oldest
+        """
+        self.process_batch = process_batch
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.fps_budget = fps_budget
+        self.max_queued = max_queued
+
+        self._cond = threading.Condition()
+        self._cameras = {}
+        # Round-robin order; cameras move to the back once served
+        self._order = OrderedDict()
+        self._queued = 0
+        self._closed = False
+        self.batches = 0
+        self.batched_frames = 0
+
+        self._thread = threading.Thread(target=self._run, name='frame-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, camera_id, item, deadline=None):
+        """
+        Queue a frame
+        Args:
+            camera_id: Stream the frame belongs to
+            item: Input for process_batch (e.g. a decoded image)
+            deadline: Optional time.time() deadline
+        Returns:
+            concurrent.futures.Future with the frame's result
+        """
+        frame = _Frame(camera_id, item, deadline)
+        dropped = None
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Frame scheduler is closed")
+            camera = self._cameras.get(camera_id)
+            if camera is None:
+                camera = self._cameras[camera_id] = _Camera(self.fps_budget)
+                self._order[camera_id] = None
+
+            camera.submitted += 1
+            if len(camera.queue) >= self.max_queued:
+                dropped = camera.queue.popleft()
+                camera.superseded += 1
+                self._queued -= 1
+            camera.queue.append(frame)
+            self._queued += 1
+            self._cond.notify()
+
+        if dropped is not None:
+            dropped.future.set_exception(FrameDropped(camera_id))
+        return frame.future
+
+    def _take(self, camera, wall_now, expired):
+        """Pop the camera's oldest live frame, collecting expired ones"""
+        while camera.queue:
+            frame = camera.queue.popleft()
+            self._queued -= 1
+            if frame.deadline is not None and frame.deadline <= wall_now:
+                camera.expired += 1
+                expired.append(frame)
+                continue
+            return frame
+        return None
+
+    def _pack(self):
+        """Fill one batch round-robin; called with the lock held"""
+        now = time.perf_counter()
+        wall_now = time.time()
+        batch = []
+        expired = []
+
+        for within_budget in (True, False):
+            progress = True
+            while progress and len(batch) < self.batch_size:
+                progress = False
+                for camera_id in list(self._order):
+                    if len(batch) >= self.batch_size:
+                        break
+                    camera = self._cameras[camera_id]
+                    if not camera.queue:
+                        continue
+
+                    has_token = camera.has_token(now)
+                    if within_budget and not has_token:
+                        continue
+
+                    frame = self._take(camera, wall_now, expired)
+                    if frame is None:
+                        continue
+                    if has_token:
+                        camera.tokens -= 1.0
+                    else:
+                        camera.over_budget += 1
+
+                    batch.append(frame)
+                    self._order.move_to_end(camera_id)
+                    progress = True
+
+        return batch, expired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and self._queued == 0:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Give other cameras a moment to fill the batch
+                fill_deadline = time.perf_counter() + self.max_wait_ms / 1000
+                while not self._closed and self._queued < self.batch_size:
+                    remaining = fill_deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, expired = self._pack()
+
+            for frame in expired:
+                frame.future.set_exception(DeadlineExceeded('batch', (time.time() - frame.deadline) * 1000))
+
+            if batch:
+                self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.process_batch([frame.item for frame in batch])
+        except Exception as e:
+            for frame in batch:
+                frame.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        with self._cond:
+            self.batches += 1
+            self.batched_frames += len(batch)
+            for frame in batch:
+                camera = self._cameras[frame.camera_id]
+                camera.processed += 1
+                camera.queue_ms.append((started - frame.enqueued) * 1000)
+                camera.latency_ms.append((finished - frame.enqueued) * 1000)
+
+        for frame, result in zip(batch, results):
+            frame.future.set_result({
+                'result': result,
+                'batch_size': len(batch),
+                'queue_ms': (started - frame.enqueued) * 1000,
+                'latency_ms': (finished - frame.enqueued) * 1000
+            })
+
+    def stats(self, camera_ids=None):
+        """
+        Per-camera counters and latency percentiles
+        Args:
+            camera_ids: Only these cameras (default: all)
+        """
+        with self._cond:
+            ids = self._cameras.keys() if camera_ids is None else [c for c in camera_ids if c in self._cameras]
+            return {camera_id: self._cameras[camera_id].stats() for camera_id in ids}
+
+    def summary(self):
+        """Scheduler-wide state for /health"""
+        with self._cond:
+            return {
+                'cameras': len(self._cameras),
+                'queued': self._queued,
+                'batches': self.batches,
+                'avg_batch_size': self.batched_frames / self.batches if self.batches else 0.0,
+                'batch_size': self.batch_size,
+                'fps_budget': self.fps_budget,
+                'max_queued_per_camera': self.max_queued
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,174 @@
+import os
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Decompression-bomb guard: refuse images above this many pixels before decoding
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_IMAGE_PIXELS"""
+    pass
+
+
+class DecodedImage:
+    """
+    An uploaded image decoded for detection
+    detection is an RGB uint8 array whose longest side is at most the
+    requested max_side; full is the RGB array crops are taken from when it
+    was kept (full resolution, or reduced to full_max_side). scale maps
+    detection coordinates to full's, full_scale maps full's coordinates to
+    the original image's.
+    """
+
+    def __init__(self, detection, full, full_size, decode_time_ms):
+        self.detection = detection
+        self.full = full
+        self.full_size = full_size
+        self.decode_time_ms = decode_time_ms
+
+        full_width, full_height = full_size
+        kept_width = full.shape[1] if full is not None else full_width
+        self.scale = kept_width / detection.shape[1]
+        self.full_scale = full_width / kept_width
+
+    def to_full_resolution(self, coords):
+        """
+        Map detection-space coordinates (boxes, landmarks) to the original image
+        Args:
+            coords: array-like of x/y values (any shape)
+        Returns:
+            float numpy array of the same shape
+        """
+        return np.asarray(coords, dtype=np.float32) * (self.scale * self.full_scale)
+
+    def crop(self, box):
+        """
+        Crop a detection-space (x1, y1, x2, y2) box from the best image kept
+        Returns:
+            Tuple of (crop, integer box clipped to the image); the box is in
+            original-image coordinates when full was kept, else detection's
+        """
+        source = self.full if self.full is not None else self.detection
+        scale = self.scale if self.full is not None else 1.0
+        height, width = source.shape[:2]
+
+        x1, y1, x2, y2 = [int(round(v * scale)) for v in box]
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(width, x2), min(height, y2)
+        crop = source[y1:y2, x1:x2]
+
+        if self.full is not None and self.full_scale != 1.0:
+            x1, y1, x2, y2 = [int(round(v * self.full_scale)) for v in (x1, y1, x2, y2)]
+        return crop, (x1, y1, x2, y2)
+
+
+def _check_pixels(width, height, max_pixels):
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image of {width}x{height} exceeds the {max_pixels} pixel limit"
+        )
+
+
+def _downscale(image, max_side):
+    """Resize an RGB array so its longest side is at most max_side"""
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if max_side is None or longest <= max_side:
+        return image
+
+    ratio = max_side / longest
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _draft(image, full_size, max_side):
+    """Let JPEG decoding skip resolution beyond max_side (PIL draft mode)"""
+    if max_side is not None and max(full_size) > max_side:
+        ratio = max_side / max(full_size)
+        # draft picks the largest JPEG DCT scale (1/2, 1/4, 1/8) that still
+        # covers the requested size; other formats ignore it
+        image.draft('RGB', (int(full_size[0] * ratio), int(full_size[1] * ratio)))
+
+
+def decode_image(image_bytes, max_side=None, keep_full=True, max_pixels=None, full_max_side=None):
+    """
+    Decode an uploaded image for detection
+    Args:
+        image_bytes: Encoded image bytes
+        max_side: Longest side of the detection image (None = full size)
+        keep_full: Keep a higher-resolution array for high-quality crops.
+            When False, JPEGs are decoded directly at a reduced scale
+            (PIL draft mode), so full resolution is never materialised.
+        max_pixels: Pixel limit (default MAX_IMAGE_PIXELS)
+        full_max_side: With keep_full, the longest side crops need; JPEGs
+            are decoded at the smallest DCT scale covering it (None = full)
+    Returns:
+        DecodedImage
+    Raises:
+        ImageTooLargeError: if the image exceeds the pixel limit
+    """
+    start_time = time.time()
+    max_pixels = max_pixels or MAX_IMAGE_PIXELS
+
+    try:
+        image = Image.open(BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        # PIL's own guard (twice Image.MAX_IMAGE_PIXELS) fired before ours
+        raise ImageTooLargeError(str(e)) from e
+    full_size = image.size
+    _check_pixels(*full_size, max_pixels)
+
+    _draft(image, full_size, full_max_side if keep_full else max_side)
+    image_np = np.asarray(image.convert('RGB'))
+
+    if keep_full:
+        full = image_np
+        detection = _downscale(full, max_side)
+    else:
+        full = None
+        detection = _downscale(image_np, max_side)
+
+    decode_time_ms = (time.time() - start_time) * 1000
+
+    return DecodedImage(detection, full, full_size, decode_time_ms)
+
+
+def benchmark_decode(image_bytes, max_side=640, num_runs=10):
+    """
+    Compare full-resolution decode against the reduced decode paths
+    Returns dict of mode -> (average ms, resident bytes of decoded arrays)
+    """
+    def measure(**kwargs):
+        times = []
+        for _ in range(num_runs):
+            decoded = decode_image(image_bytes, **kwargs)
+            times.append(decoded.decode_time_ms)
+        nbytes = decoded.detection.nbytes
+        if decoded.full is not None and decoded.full is not decoded.detection:
+            nbytes += decoded.full.nbytes
+        return float(np.mean(times)), nbytes
+
+    results = {
+        'full': measure(max_side=None),
+        'full+downscale': measure(max_side=max_side),
+        'reduced crops': measure(max_side=max_side, full_max_side=2 * max_side),
+        'reduced': measure(max_side=max_side, keep_full=False)
+    }
+
+    for mode, (ms, nbytes) in results.items():
+        print(f"{mode}: {ms:.1f}ms, {nbytes / 1e6:.1f} MB decoded")
+
+    return results
+
+
+if __name__ == '__main__':
+    # Synthetic 12 MP phone photo
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8), (15, 15), 0)
+    jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    benchmark_decode(jpeg)
@@ -0,0 +1,399 @@
+import os
+import re
+import hmac
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Versions live in <MODEL_REGISTRY_DIR>/<service>/<version>/
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models')
+
+# Fraction of requests re-run on the shadow version while one is loaded
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', 1.0))
+
+# Shadow agreement statistics cover the most recent comparisons only
+SHADOW_COMPARISON_WINDOW = int(os.environ.get('SHADOW_COMPARISON_WINDOW', 1000))
+
+# Bearer token for the load/promote/drop-shadow endpoints; unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or None
+
+_VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+class ModelVersionError(ValueError):
+    """Raised for an unknown or invalid model version"""
+    pass
+
+
+def cosine_agreement(primary, shadow):
+    """Mean cosine similarity between matching embeddings of two outputs"""
+    a = np.atleast_2d(np.asarray(primary, dtype=np.float64))
+    b = np.atleast_2d(np.asarray(shadow, dtype=np.float64))
+    if a.shape != b.shape or a.size == 0:
+        return None
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    valid = norms > 0
+    if not valid.any():
+        return None
+    return float(np.mean(np.sum(a * b, axis=1)[valid] / norms[valid]))
+
+
+class LoadedModel:
+    """One resident model version and the requests currently using it"""
+
+    def __init__(self, version, model, path=None, load_ms=0.0, warmup_ms=0.0):
+        self.version = version
+        self.model = model
+        self.path = path
+        self.load_ms = load_ms
+        self.warmup_ms = warmup_ms
+        self.loaded_at = time.time()
+        self.in_flight = 0
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'load_ms': self.load_ms,
+            'warmup_ms': self.warmup_ms,
+            'in_flight': self.in_flight
+        }
+
+
+class ModelRegistry:
+    """
+    Versioned models with hot reload and shadow comparison
+    A version is loaded and warmed up off the request path, then swapped
+    in under a lock. Requests pin the version they started with (see
+    use()), so in-flight work finishes on the old weights while new work
+    gets the new ones; the old version is released once it drains.
+
+    A second version can be kept resident as the shadow. A sample of
+    requests is re-run on it in the background and its output compared
+    with the active version's, before it is promoted.
+    """
+
+    def __init__(self, name, loader, warmup=None, compare=cosine_agreement,
+                 root=MODEL_REGISTRY_DIR, sample_rate=SHADOW_SAMPLE_RATE):
+        """
+        Args:
+            name: Service name; versions are read from root/name/<version>
+            loader: Function version_dir -> model
+            warmup: Optional function model -> None run before a swap
+            compare: Function (active output, shadow output) -> float
+            root: Registry root directory
+            sample_rate: Fraction of requests compared against the shadow
+        """
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.compare = compare
+        self.directory = os.path.join(root, name)
+        self.sample_rate = sample_rate
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.active = None
+        self.shadow = None
+        self._draining = []
+        self.swaps = 0
+        self.last_error = None
+        # Set when the models are shared by forked workers (see prefork.py);
+        # a version loaded in one worker would only reach that worker
+        self.frozen = False
+
+        # One comparison at a time; busy samples are skipped, not queued
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}-shadow')
+        self._shadow_busy = threading.Lock()
+        self._rng = np.random.default_rng()
+        self._comparisons = deque(maxlen=SHADOW_COMPARISON_WINDOW)
+        self.shadow_skipped = 0
+        self.shadow_errors = 0
+
+    @property
+    def active_version(self):
+        active = self.active
+        return active.version if active is not None else None
+
+    def available_versions(self):
+        """Version directories under the registry, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        versions = [
+            entry for entry in os.listdir(self.directory)
+            if _VERSION_PATTERN.match(entry) and os.path.isdir(os.path.join(self.directory, entry))
+        ]
+        return sorted(versions, key=lambda v: os.path.getmtime(os.path.join(self.directory, v)))
+
+    def version_path(self, version):
+        if not version or not _VERSION_PATTERN.match(version):
+            raise ModelVersionError(f"Invalid model version: {version!r}")
+        path = os.path.join(self.directory, version)
+        if not os.path.isdir(path):
+            raise ModelVersionError(f"Model version {version} not found in {self.directory}")
+        return path
+
+    def load(self, version, role='active'):
+        """
+        Load, warm up and install a version from the registry directory
+        Args:
+            version: Version directory name
+            role: 'active' (swap in for new requests) or 'shadow'
+        Returns:
+            LoadedModel
+        """
+        path = self.version_path(version)
+        # Loads are serialised; requests keep running on the current version
+        with self._load_lock:
+            start = time.perf_counter()
+            model = self.loader(path)
+            load_ms = (time.perf_counter() - start) * 1000
+            return self._install(version, model, path, load_ms, role)
+
+    def install(self, version, model, role='active'):
+        """Warm up and install an already-built model (e.g. bundled pretrained weights)"""
+        with self._load_lock:
+            return self._install(version, model, None, 0.0, role)
+
+    def _install(self, version, model, path, load_ms, role):
+        if role not in ('active', 'shadow'):
+            raise ValueError(f"Unknown model role: {role}")
+
+        start = time.perf_counter()
+        if self.warmup is not None:
+            self.warmup(model)
+        loaded = LoadedModel(version, model, path, load_ms, (time.perf_counter() - start) * 1000)
+
+        with self._lock:
+            if role == 'active':
+                self._retire(self.active)
+                self.active = loaded
+                self.swaps += 1
+            else:
+                self._retire(self.shadow)
+                self.shadow = loaded
+                self._comparisons.clear()
+
+        print(f"{self.name}: model {version} {role} "
+              f"(load {loaded.load_ms:.0f}ms, warmup {loaded.warmup_ms:.0f}ms)")
+        return loaded
+
+    def _retire(self, loaded):
+        # Called with self._lock held; versions still serving requests are
+        # kept until their last request finishes
+        if loaded is not None and loaded.in_flight > 0:
+            self._draining.append(loaded)
+
+    def load_in_background(self, version, role='active'):
+        """
+        Load a version on a background thread
+        Raises:
+            ModelVersionError: if the version does not exist
+        """
+        self.version_path(version)
+
+        def run():
+            try:
+                self.load(version, role)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+                print(f"{self.name}: failed to load model {version}: {e}")
+
+        thread = threading.Thread(target=run, name=f'{self.name}-load-{version}', daemon=True)
+        thread.start()
+        return thread
+
+    def load_initial(self, version=None):
+        """
+        Load the startup version: version, else <NAME>_MODEL_VERSION, else the newest
+        Returns:
+            LoadedModel, or None if the registry has no versions
+        """
+        version = version or os.environ.get(f'{self.name.upper()}_MODEL_VERSION')
+        if version is None:
+            versions = self.available_versions()
+            if not versions:
+                return None
+            version = versions[-1]
+        return self.load(version)
+
+    def promote(self):
+        """Make the shadow version active"""
+        with self._lock:
+            if self.shadow is None:
+                raise ModelVersionError("No shadow model loaded")
+            self._retire(self.active)
+            self.active, self.shadow = self.shadow, None
+            self._comparisons.clear()
+            self.swaps += 1
+            return self.active
+
+    def drop_shadow(self):
+        with self._lock:
+            self._retire(self.shadow)
+            self.shadow = None
+            self._comparisons.clear()
+
+    @contextmanager
+    def use(self):
+        """
+        Pin the active version for one request
+        Yields:
+            LoadedModel, or None when no version is loaded
+        """
+        with self._lock:
+            loaded = self.active
+            if loaded is not None:
+                loaded.in_flight += 1
+        try:
+            yield loaded
+        finally:
+            if loaded is not None:
+                with self._lock:
+                    loaded.in_flight -= 1
+                    if loaded.in_flight == 0 and loaded in self._draining:
+                        self._draining.remove(loaded)
+
+    def shadow_compare(self, infer, primary_output):
+        """
+        Re-run a request on the shadow version in the background
+        Args:
+            infer: Function model -> output, with the request's inputs bound
+            primary_output: The active version's output for the request
+        """
+        shadow = self.shadow
+        if shadow is None or self._rng.random() >= self.sample_rate:
+            return
+        if not self._shadow_busy.acquire(blocking=False):
+            self.shadow_skipped += 1
+            return
+
+        def run():
+            try:
+                agreement = self.compare(primary_output, infer(shadow.model))
+                if agreement is not None:
+                    with self._lock:
+                        if self.shadow is shadow:
+                            self._comparisons.append(agreement)
+            except Exception:
+                self.shadow_errors += 1
+            finally:
+                self._shadow_busy.release()
+
+        self._shadow_executor.submit(run)
+
+    def stats(self):
+        """Registry state for /health"""
+        with self._lock:
+            comparisons = np.array(self._comparisons)
+            return {
+                'active': self.active.describe() if self.active is not None else None,
+                'shadow': self.shadow.describe() if self.shadow is not None else None,
+                'draining': [loaded.describe() for loaded in self._draining],
+                'available': self.available_versions(),
+                'swaps': self.swaps,
+                'frozen': self.frozen,
+                'last_error': self.last_error,
+                'shadow_comparison': {
+                    'count': len(comparisons),
+                    'mean': float(comparisons.mean()) if len(comparisons) else None,
+                    'min': float(comparisons.min()) if len(comparisons) else None,
+                    'p05': float(np.percentile(comparisons, 5)) if len(comparisons) else None,
+                    'skipped': self.shadow_skipped,
+                    'errors': self.shadow_errors
+                }
+            }
+
+
+def admin_authorized(headers, admin_token=ADMIN_TOKEN):
+    """True when the request carries 'Authorization: Bearer <admin_token>'"""
+    if admin_token is None:
+        return False
+    scheme, _, token = (headers.get('Authorization') or '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode(), admin_token.encode())
+
+
+def model_admin_routes(registry, admin_token=ADMIN_TOKEN):
+    """
+    Admin endpoints for a registry as (method, path, handler) tuples
+    handler(data, headers) -> (body, status) takes the parsed JSON body (or
+    None) and the request headers. Paths carry the registry name so services
+    hosted together don't clash. The status endpoint is open; the others
+    need admin_token as a bearer token and are refused when it is not set.
+    """
+    base = f'/models/{registry.name}'
+    frozen_error = {'error': f"Model versions are fixed while workers share them; restart with "
+                             f"{registry.name.upper()}_MODEL_VERSION set"}
+
+    def requires_admin(handler):
+        def guarded(data, headers):
+            if admin_token is None:
+                return {'error': "Model admin endpoints are disabled; set ADMIN_TOKEN to enable them"}, 403
+            if not admin_authorized(headers, admin_token):
+                return {'error': "Invalid or missing admin token"}, 401
+            return handler(data)
+        guarded.__name__ = handler.__name__
+        return guarded
+
+    def status(data, headers):
+        return registry.stats(), 200
+
+    @requires_admin
+    def load(data):
+        if registry.frozen:
+            return frozen_error, 409
+        data = data or {}
+        role = data.get('role', 'active')
+        if role not in ('active', 'shadow'):
+            return {'error': f"Unknown role: {role}"}, 400
+        try:
+            registry.load_in_background(data.get('version'), role)
+        except ModelVersionError as e:
+            return {'error': str(e)}, 404
+        return {'status': 'loading', 'version': data.get('version'), 'role': role}, 202
+
+    @requires_admin
+    def promote(data):
+        if registry.frozen:
+            return frozen_error, 409
+        try:
+            loaded = registry.promote()
+        except ModelVersionError as e:
+            return {'error': str(e)}, 409
+        return {'status': 'promoted', 'version': loaded.version}, 200
+
+    @requires_admin
+    def drop_shadow(data):
+        if registry.frozen:
+            return frozen_error, 409
+        registry.drop_shadow()
+        return {'status': 'ok'}, 200
+
+    return [
+        ('GET', base, status),
+        ('POST', f'{base}/load', load),
+        ('POST', f'{base}/promote', promote),
+        ('POST', f'{base}/drop-shadow', drop_shadow)
+    ]
+
+
+def install_model_routes(app, registry, admin_token=ADMIN_TOKEN):
+    """Register a registry's admin endpoints on a Flask app"""
+    from flask import request, jsonify
+
+    for method, path, handler in model_admin_routes(registry, admin_token):
+        def view(handler=handler):
+            if request.data and request.get_json(silent=True) is None:
+                return jsonify({'error': 'Request body is not valid JSON'}), 400
+            body, status = handler(request.get_json(silent=True), request.headers)
+            return jsonify(body), status
+
+        app.add_url_rule(path, endpoint=f'models_{registry.name}_{handler.__name__}',
+                         view_func=view, methods=[method])
+    return app
@@ -0,0 +1,139 @@
+import os
+import gc
+import sys
+import socket
+import signal
+
+from werkzeug.serving import make_server
+
+# Worker processes forked from the master (default: one per core)
+PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', os.cpu_count() or 1))
+
+# Intra-op threads per worker; workers x threads should not exceed the cores
+PREFORK_THREADS_PER_WORKER = int(os.environ.get(
+    'PREFORK_THREADS_PER_WORKER', max(1, (os.cpu_count() or 1) // PREFORK_WORKERS)
+))
+
+# Set in each worker after the fork; None in the master and in other modes
+_worker = None
+
+
+def set_inference_threads(num_threads):
+    """Size the OpenCV and torch intra-op thread pools of this process"""
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+
+    import cv2
+    cv2.setNumThreads(num_threads)
+
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+
+
+def freeze_torch_model(model):
+    """
+    Make a torch model read-only and move its weights to shared memory
+    Workers forked afterwards map the same pages instead of copying them
+    on first touch.
+    """
+    from batch_processor import optimize_model_for_inference
+
+    optimize_model_for_inference(model)
+    model.share_memory()
+    return model
+
+
+def worker_info():
+    """Index, pid and thread count of this pre-fork worker, or None"""
+    return dict(_worker) if _worker is not None else None
+
+
+def _bind(host, port, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve_worker(app, sock, index, workers, threads):
+    global _worker
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker = {'index': index, 'pid': os.getpid(), 'workers': workers, 'threads': threads}
+    set_inference_threads(threads)
+
+    # One request at a time per worker: concurrency comes from the workers,
+    # each using its own share of the cores
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=False, fd=sock.fileno())
+    print(f"Worker {index} (pid {os.getpid()}) serving with {threads} thread(s)")
+    server.serve_forever()
+
+
+def serve_prefork(app, load, freeze=None, host='0.0.0.0', port=5000,
+                  workers=PREFORK_WORKERS, threads_per_worker=PREFORK_THREADS_PER_WORKER):
+    """
+    Load models once, then fork worker processes that share them
+    The master loads and warms up the models single-threaded (thread
+    pools do not survive a fork), freezes them, moves every live Python
+    object out of the garbage collector's reach so workers do not dirty
+    their pages, binds the socket and forks. Each worker serves the
+    Flask app on the shared socket. Workers that die are replaced.
+    Args:
+        app: Flask app
+        load: Function loading the models (e.g. load_models)
+        freeze: Optional function run after load, before forking
+        workers: Number of worker processes
+        threads_per_worker: Intra-op threads in each worker
+    """
+    set_inference_threads(1)
+    load()
+    if freeze is not None:
+        freeze()
+
+    sock = _bind(host, port)
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_worker(app, sock, index, workers, threads_per_worker)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Pre-fork master (pid {os.getpid()}) on {host}:{port}: "
+          f"{workers} worker(s) x {threads_per_worker} thread(s)")
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            spawn(index)
+
+    sock.close()
@@ -0,0 +1,394 @@
+import os
+import queue
+import threading
+import numpy as np
+import cv2
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from collections import deque
+import time
+
+from batch_processor import ItemError
+
+# Longest wait for one worker result before the pool is considered stuck
+RESULT_TIMEOUT_S = float(os.environ.get('PREPROCESS_RESULT_TIMEOUT_S', 60))
+
+# Worker processes of the services' preprocessing pools; 0 runs the same
+# steps in the request thread
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', 0))
+
+# Message kinds written next to each input slot
+_KIND_FRAME = 0
+_KIND_ENCODED = 1
+
+
+class SharedRing:
+    """
+    Fixed number of equally sized slots in one shared memory block
+    Slot i of the input ring and slot i of the output ring belong to the
+    same in-flight item, so only slot indices and shapes cross the queues.
+    """
+
+    def __init__(self, num_slots, slot_bytes, name=None):
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_bytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def view(self, slot, shape, dtype):
+        """Numpy view onto a slot (no copy)"""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes > self.slot_bytes:
+            raise ValueError(f"{nbytes} bytes do not fit in a {self.slot_bytes} byte slot")
+        offset = slot * self.slot_bytes
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def decode_rgb(encoded):
+    """Decode image bytes (a uint8 buffer) to an RGB uint8 array"""
+    frame = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def _worker_loop(preprocess_func, decode_func, in_name, out_name, num_slots, in_slot_bytes,
+                 out_slot_bytes, output_dtype, tasks, results):
+    """Worker process: read slot, preprocess, write result slot"""
+    in_ring = SharedRing(num_slots, in_slot_bytes, name=in_name)
+    out_ring = SharedRing(num_slots, out_slot_bytes, name=out_name)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            slot, kind, shape = task
+            try:
+                if kind == _KIND_ENCODED:
+                    frame = decode_func(in_ring.view(slot, shape, np.uint8))
+                else:
+                    frame = in_ring.view(slot, shape, np.uint8)
+
+                result = np.asarray(preprocess_func(frame))
+                out_ring.view(slot, result.shape, output_dtype)[...] = result
+                results.put((slot, None, result.shape))
+            except Exception as e:
+                results.put((slot, f"{type(e).__name__}: {e}", None))
+    finally:
+        in_ring.close()
+        out_ring.close()
+
+
+class PreprocessPool:
+    """
+    Process pool for CPU-heavy preprocessing (decode, detection, resize,
+    normalisation) that moves pixels through shared memory ring buffers
+    Frames (uint8 HxWx3) or encoded image bytes are copied once into an
+    input slot; workers write the result into the matching output slot.
+    Nothing but slot indices and shapes is pickled. One imap/map call runs
+    at a time; concurrent callers wait for the ring.
+    """
+
+    def __init__(self, preprocess_func, output_shape=(160, 160, 3), output_dtype=np.float32,
+                 num_workers=4, max_frame_shape=(2048, 2048, 3), num_slots=None,
+                 result_timeout=RESULT_TIMEOUT_S, decode_func=decode_rgb):
+        """
+        Args:
+            preprocess_func: Picklable (module-level) function mapping an RGB
+                uint8 frame to an array of output_shape
+            output_shape: Shape of each preprocessed result, or the largest
+                one when results vary in shape (e.g. decoded frames)
+            output_dtype: dtype of each preprocessed result
+            num_workers: Number of worker processes
+            max_frame_shape: Largest frame accepted; sizes the input slots
+            num_slots: Ring size (default 2 * num_workers)
+            result_timeout: Seconds to wait for one result before raising
+            decode_func: Picklable function mapping encoded bytes (a uint8
+                array) to an RGB uint8 frame
+        """
+        self.output_shape = tuple(output_shape)
+        self.output_dtype = np.dtype(output_dtype)
+        self.num_workers = num_workers
+        self.num_slots = num_slots or num_workers * 2
+        self.result_timeout = result_timeout
+
+        in_slot_bytes = int(np.prod(max_frame_shape))
+        out_slot_bytes = int(np.prod(self.output_shape)) * self.output_dtype.itemsize
+        self._in_ring = SharedRing(self.num_slots, in_slot_bytes)
+        self._out_ring = SharedRing(self.num_slots, out_slot_bytes)
+
+        self._tasks = mp.Queue()
+        self._results = mp.Queue()
+        self._free_slots = deque(range(self.num_slots))
+        # Slots and the results queue belong to one imap call at a time
+        self._lock = threading.Lock()
+        self._workers = [
+            mp.Process(
+                target=_worker_loop,
+                args=(preprocess_func, decode_func, self._in_ring.name, self._out_ring.name,
+                      self.num_slots, in_slot_bytes, out_slot_bytes, self.output_dtype,
+                      self._tasks, self._results),
+                daemon=True
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _put(self, slot, item):
+        """Copy one frame or encoded image into an input slot and queue it"""
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(item, dtype=np.uint8)
+            kind = _KIND_ENCODED
+        else:
+            data = np.ascontiguousarray(item, dtype=np.uint8)
+            kind = _KIND_FRAME
+
+        self._in_ring.view(slot, data.shape, np.uint8)[...] = data
+        self._tasks.put((slot, kind, data.shape))
+
+    def _wait_result(self):
+        """Next (slot, error, shape) from the workers"""
+        try:
+            return self._results.get(timeout=self.result_timeout)
+        except queue.Empty:
+            alive = sum(worker.is_alive() for worker in self._workers)
+            raise TimeoutError(f"No preprocessing result within {self.result_timeout}s "
+                               f"({alive}/{len(self._workers)} workers alive)") from None
+
+    def imap(self, items):
+        """
+        Preprocess items in input order
+        Args:
+            items: Iterable of RGB uint8 frames or encoded image bytes
+        Yields:
+            (index, slot_view) pairs. slot_view is only valid until the next
+            iteration; copy it if it must outlive the loop. Failed items
+            yield an ItemError instead of a view.
+        Raises:
+            TimeoutError: if a worker result takes longer than result_timeout
+        Another thread's call blocks until this generator is exhausted or
+        closed, so do not leave one suspended.
+        """
+        queued = deque()
+        done = {}
+        index_of_slot = {}
+        to_release = None
+
+        def wait_one():
+            slot, error, shape = self._wait_result()
+            done[index_of_slot[slot]] = (slot, error, shape)
+
+        items = iter(items)
+        exhausted = False
+        next_index = 0
+
+        self._lock.acquire()
+        try:
+            while True:
+                if to_release is not None:
+                    self._free_slots.append(to_release)
+                    to_release = None
+
+                # Fill every free slot before waiting on results
+                while not exhausted and self._free_slots:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    slot = self._free_slots.popleft()
+                    index_of_slot[slot] = next_index
+                    queued.append(next_index)
+                    try:
+                        self._put(slot, item)
+                    except Exception as e:
+                        done[next_index] = (slot, e, None)
+                    next_index += 1
+
+                if not queued:
+                    return
+
+                head = queued[0]
+                while head not in done:
+                    wait_one()
+                queued.popleft()
+                slot, error, shape = done.pop(head)
+                del index_of_slot[slot]
+                to_release = slot
+
+                if error is None:
+                    yield head, self._out_ring.view(slot, shape, self.output_dtype)
+                else:
+                    if isinstance(error, str):
+                        error = RuntimeError(error)
+                    yield head, ItemError(head, error)
+        finally:
+            # Stopped early (break, consumer exception, timeout): wait for the
+            # items still in the workers so their results cannot be mistaken
+            # for a later call's, then return every slot
+            if to_release is not None:
+                self._free_slots.append(to_release)
+            try:
+                while len(done) < len(queued):
+                    wait_one()
+            except TimeoutError:
+                # Slots of a stuck worker stay out of the ring rather than
+                # being handed to a later call while it may still write them
+                pass
+            for slot, _, _ in done.values():
+                self._free_slots.append(slot)
+            self._lock.release()
+
+    def map(self, items, out=None):
+        """
+        Preprocess a list of items into one batch array (fixed output shape)
+        Args:
+            items: List of RGB uint8 frames or encoded image bytes
+            out: Optional preallocated (N, *output_shape) array to fill
+        Returns:
+            Tuple of (batch, errors); rows of failed items are zeroed
+        """
+        if out is None:
+            out = np.empty((len(items),) + self.output_shape, dtype=self.output_dtype)
+
+        errors = []
+        for index, result in self.imap(items):
+            if isinstance(result, ItemError):
+                out[index] = 0
+                errors.append(result)
+            else:
+                out[index] = result
+
+        return out, errors
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._in_ring.close()
+        self._out_ring.close()
+
+
+class ServicePool:
+    """
+    A PreprocessPool the services start on first use, once per process
+    Safe to create at import time and before a pre-fork: each process that
+    uses it starts its own workers. With PREPROCESS_WORKERS=0 (the default)
+    items are processed in the calling thread by the same functions.
+    """
+
+    def __init__(self, preprocess_func, num_workers=PREPROCESS_WORKERS, decode_func=decode_rgb,
+                 **pool_kwargs):
+        self.preprocess_func = preprocess_func
+        self.decode_func = decode_func
+        self.num_workers = num_workers
+        self.pool_kwargs = pool_kwargs
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = PreprocessPool(self.preprocess_func, num_workers=self.num_workers,
+                                            decode_func=self.decode_func, **self.pool_kwargs)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run_local(self, item):
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            item = self.decode_func(np.frombuffer(item, dtype=np.uint8))
+        return np.asarray(self.preprocess_func(item))
+
+    def run(self, items):
+        """
+        Preprocess items, in the pool's processes when there are several
+        Returns:
+            List with a result array (a copy) or the exception for each item
+        """
+        items = list(items)
+        if self.num_workers <= 0 or len(items) < 2:
+            results = []
+            for item in items:
+                try:
+                    results.append(self._run_local(item))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        results = [None] * len(items)
+        failed = []
+        for index, result in self._get().imap(items):
+            if isinstance(result, ItemError):
+                failed.append(index)
+            else:
+                results[index] = result.copy()
+
+        # Items too large for a slot, or that failed in a worker, are retried
+        # here so callers see the same result or exception type as in-process
+        for index in failed:
+            try:
+                results[index] = self._run_local(items[index])
+            except Exception as e:
+                results[index] = e
+        return results
+
+
+def benchmark_preprocess_pool(preprocess_func, items, worker_counts=(1, 2, 4, 8), **pool_kwargs):
+    """
+    Benchmark preprocessing throughput in-process and at several pool sizes
+    Returns dict mapping worker count (0 = in-process baseline) to images/second
+    """
+    results = {}
+    cpus = os.cpu_count() or 1
+    if cpus < max(worker_counts):
+        print(f"Only {cpus} CPU(s): pool sizes above {cpus} cannot scale, "
+              "so their numbers only show the pool's overhead")
+
+    start = time.time()
+    for item in items:
+        if isinstance(item, (bytes, bytearray)):
+            item = decode_rgb(item)
+        preprocess_func(item)
+    results[0] = len(items) / (time.time() - start)
+    print(f"in-process: {results[0]:.1f} images/second")
+
+    for workers in worker_counts:
+        with PreprocessPool(preprocess_func, num_workers=workers, **pool_kwargs) as pool:
+            # Warmup so process start-up is not measured
+            pool.map(items[:workers])
+
+            start = time.time()
+            pool.map(items)
+            results[workers] = len(items) / (time.time() - start)
+        print(f"{workers} workers: {results[workers]:.1f} images/second")
+
+    return results
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import threading
+
+from deadlines import DeadlineExceeded, current_deadline, remaining_ms
+
+
+class _InFlightCall:
+    """Result slot shared by the leader request and its duplicates"""
+
+    def __init__(self, event):
+        self.event = event
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """
+    Singleflight request coalescing for identical concurrent inputs
+    The first request for a key runs the work; concurrent duplicates wait
+    for its result instead of repeating detection and embedding.
+    Only in-flight calls are shared - nothing is kept once the leader
+    finishes (use InferenceCache for longer-lived results).
+    Each duplicate waits only until its own deadline. If the leader fails
+    because its deadline passed, the duplicates that still have time run
+    the work again instead of inheriting that failure.
+    run() serves threads; run_async() serves coroutines on one event loop,
+    where duplicates wait without holding a thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        # Touched only from the event loop, so it needs no lock
+        self._async_in_flight = {}
+        self.total_requests = 0
+        self.coalesced_requests = 0
+        self.deadline_retries = 0
+
+    @staticmethod
+    def content_key(data, namespace=''):
+        """
+        Build a coalescing key from the raw uploaded bytes
+        Args:
+            data: bytes of the uploaded image
+            namespace: prefix separating endpoints that share a coalescer
+        Returns:
+            Hex digest key
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{namespace}:{digest}" if namespace else digest
+
+    def run(self, key, func, deadline=None):
+        """
+        Run func once per concurrent key
+        Args:
+            key: coalescing key (see content_key)
+            func: zero-argument callable producing the result
+            deadline: This caller's deadline (default: the thread's
+                deadline_scope); bounds how long a duplicate waits
+        Returns:
+            Tuple of (result, coalesced) where coalesced is True when the
+            result was produced by another in-flight request
+        Raises:
+            DeadlineExceeded: if the deadline passes while waiting on another request
+        """
+        deadline = current_deadline() if deadline is None else deadline
+        first_attempt = True
+        
+        while True:
+            with self._lock:
+                if first_attempt:
+                    self.total_requests += 1
+                call = self._in_flight.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    if first_attempt:
+                        self.coalesced_requests += 1
+                    leader = False
+                else:
+                    call = _InFlightCall(threading.Event())
+                    self._in_flight[key] = call
+                    leader = True
+            first_attempt = False
+            
+            if leader:
+                break
+            
+            left = remaining_ms(deadline)
+            finished = call.event.wait(None if left is None else max(0.0, left / 1000))
+            with self._lock:
+                call.waiters -= 1
+            if not finished:
+                raise DeadlineExceeded('coalesced_wait', -(remaining_ms(deadline) or 0.0))
+            
+            if isinstance(call.error, DeadlineExceeded):
+                # The leader ran out of time, not this request: try again
+                with self._lock:
+                    self.deadline_retries += 1
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.event.set()
+
+        return call.result, False
+
+    def _join_async(self, key, first_attempt):
+        """Count a request and return (call, leader) for an event-loop key"""
+        with self._lock:
+            if first_attempt:
+                self.total_requests += 1
+            call = self._async_in_flight.get(key)
+            if call is not None:
+                call.waiters += 1
+                if first_attempt:
+                    self.coalesced_requests += 1
+                return call, False
+        call = _InFlightCall(asyncio.Event())
+        self._async_in_flight[key] = call
+        return call, True
+
+    async def run_async(self, key, func, deadline=None):
+        """
+        Await func() once per concurrent key on the running event loop
+        Args:
+            key: coalescing key (see content_key)
+            func: zero-argument coroutine function producing the result
+            deadline: This caller's deadline (time.time() seconds)
+        Returns:
+            Tuple of (result, coalesced), as run()
+        Raises:
+            DeadlineExceeded: if the deadline passes while waiting on another request
+        """
+        first_attempt = True
+
+        while True:
+            call, leader = self._join_async(key, first_attempt)
+            first_attempt = False
+            if leader:
+                break
+
+            left = remaining_ms(deadline)
+            try:
+                await asyncio.wait_for(call.event.wait(), None if left is None else max(0.0, left / 1000))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded('coalesced_wait', -(remaining_ms(deadline) or 0.0)) from None
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+
+            if isinstance(call.error, (DeadlineExceeded, asyncio.CancelledError)):
+                # The leader ran out of time or its client went away: try again
+                with self._lock:
+                    self.deadline_retries += 1
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = await func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            del self._async_in_flight[key]
+            call.event.set()
+
+        return call.result, False
+
+    def stats(self):
+        """Get coalescing counters"""
+        with self._lock:
+            return {
+                'total_requests': self.total_requests,
+                'coalesced_requests': self.coalesced_requests,
+                'deadline_retries': self.deadline_retries,
+                'in_flight': len(self._in_flight) + len(self._async_in_flight),
+                # Duplicates currently waiting on a leader
+                'waiting': sum(call.waiters for call in self._in_flight.values())
+                + sum(call.waiters for call in self._async_in_flight.values())
+            }
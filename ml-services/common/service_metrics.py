@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from collections import defaultdict, deque
+
+import numpy as np
+from flask import g, request
+
+LATENCY_WINDOW = 1024
+
+
+def process_rss_mb(pid=None):
+    """Resident set size of a process in MB (Linux /proc), or None"""
+    path = f"/proc/{pid or 'self'}/status"
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_memory_mb(pid=None):
+    """
+    RSS, PSS and USS of a process in MB (Linux /proc/<pid>/smaps_rollup)
+    USS counts only pages no other process maps: what the process would
+    free on exit. Pages shared copy-on-write with a parent are excluded.
+    Returns:
+        Dict with rss, pss and uss, or None
+    """
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    fields = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[key] = int(value.split()[0])
+    except OSError:
+        return None
+    return {
+        'rss': fields.get('Rss', 0) / 1024,
+        'pss': fields.get('Pss', 0) / 1024,
+        'uss': (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024
+    }
+
+
+class ServiceMetrics:
+    """
+    Request counters and latency percentiles per route
+    Latencies are kept in a sliding window of the last LATENCY_WINDOW
+    requests per route. Services add their own counters with increment().
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._requests = defaultdict(int)
+        self._statuses = defaultdict(lambda: defaultdict(int))
+        self._latencies = defaultdict(lambda: deque(maxlen=self._window))
+        self._counters = defaultdict(int)
+        self.started_at = time.time()
+
+    def observe(self, route, status, latency_ms):
+        with self._lock:
+            self._requests[route] += 1
+            self._statuses[route][status] += 1
+            self._latencies[route].append(latency_ms)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def install(self, app):
+        """Time every request of a Flask app"""
+        @app.before_request
+        def _start_timer():
+            g.request_start = time.perf_counter()
+
+        @app.after_request
+        def _record(response):
+            start = g.pop('request_start', None)
+            if start is not None and request.url_rule is not None:
+                self.observe(request.url_rule.rule, response.status_code,
+                             (time.perf_counter() - start) * 1000)
+            return response
+
+        return app
+
+    def snapshot(self):
+        """JSON-serialisable view for /health"""
+        with self._lock:
+            routes = {}
+            for route, count in self._requests.items():
+                latencies = np.array(self._latencies[route])
+                routes[route] = {
+                    'requests': count,
+                    'statuses': {str(k): v for k, v in self._statuses[route].items()},
+                    'latency_ms': {
+                        f'p{p}': float(np.percentile(latencies, p)) for p in (50, 95, 99)
+                    } if len(latencies) else {}
+                }
+            counters = dict(self._counters)
+
+        return {
+            'uptime_s': time.time() - self.started_at,
+            'rss_mb': process_rss_mb(),
+            'memory_mb': process_memory_mb(),
+            'pid': os.getpid(),
+            'routes': routes,
+            'counters': counters
+        }
@@ -2,31 +2,100 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import base64
 import numpy as np
-from io import BytesIO
-from PIL import Image
 import cv2
 import time
 from ultralytics import YOLO
+import os
+import sys
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from request_coalescer import RequestCoalescer
+from service_metrics import ServiceMetrics
+from async_server import AsyncRoute, BlockingRoute, SERVING_MODE, serve_async
+from image_decoding import decode_image, ImageTooLargeError
+from deadlines import DeadlineExceeded, check_deadline, deadline_from_headers, deadline_scope
+from model_registry import ModelRegistry, install_model_routes, model_admin_routes
+from frame_scheduler import FairFrameScheduler, FrameDropped
+from adaptive_resolution import ResolutionController
+from preprocess_pool import ServicePool
 
 app = Flask(__name__)
 CORS(app)
 
-# Models
-yolo_model = None
+# Concurrent identical uploads share one inference
+coalescer = RequestCoalescer()
+
+# Per-route request counts and latency percentiles, reported by /health
+metrics = ServiceMetrics()
+metrics.install(app)
+
+# Counting never needs full resolution: JPEGs are decoded at reduced scale
+DETECTION_MAX_SIDE = 1280
+
 # MCNN would be implemented separately for high-density crowds
 
+# Bundled weights used when the registry has no version of its own
+PRETRAINED_YOLO_VERSION = 'yolov8n'
+
+def load_yolo(path):
+    """Load YOLO weights (the .pt file) from a version directory"""
+    weights = sorted(f for f in os.listdir(path) if f.endswith('.pt'))
+    if not weights:
+        raise FileNotFoundError(f"No .pt weights in {path}")
+    return YOLO(os.path.join(path, weights[0]))
+
+def warmup_yolo(model):
+    """Fuse layers and build the predictor before the model takes traffic"""
+    model(np.zeros((DETECTION_MAX_SIDE // 2, DETECTION_MAX_SIDE // 2, 3), dtype=np.uint8), verbose=False)
+
+def count_agreement(primary, shadow):
+    """1 minus the relative difference between two people counts"""
+    return 1.0 - abs(primary - shadow) / max(primary, shadow, 1)
+
+# YOLO versions from models/crowd_counting/<version>/*.pt
+yolo_registry = ModelRegistry('crowd_counting', load_yolo, warmup=warmup_yolo, compare=count_agreement)
+install_model_routes(app, yolo_registry)
+
 def load_models():
     """Load YOLO model for face detection"""
-    global yolo_model
-    
     try:
-        # Load YOLOv8 model (can be trained specifically for faces)
-        # For now, using general object detection
-        yolo_model = YOLO('yolov8n.pt')  # Nano model for speed
+        # CROWD_COUNTING_MODEL_VERSION, else the newest registry version,
+        # else YOLOv8 nano general object detection (can be trained
+        # specifically for faces)
+        if yolo_registry.load_initial() is None:
+            yolo_registry.install(PRETRAINED_YOLO_VERSION, YOLO('yolov8n.pt'))
         print("YOLO model loaded successfully")
     except Exception as e:
         print(f"Error loading YOLO model: {e}")
 
+def detect_people_batch(model, images, imgsz=None):
+    """Person boxes [x, y, w, h] for each image, from one batched YOLO call"""
+    options = {'imgsz': imgsz} if imgsz is not None else {}
+    results = model(list(images), conf=0.25, verbose=False, **options)
+    
+    # Count persons (class 0 in COCO dataset)
+    # In production, use a face-specific YOLO model
+    all_detections = []
+    for result in results:
+        detections = []
+        for box in result.boxes:
+            cls = int(box.cls[0])
+            if cls == 0:  # Person class
+                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+                detections.append([int(x1), int(y1), int(x2-x1), int(y2-y1)])
+        all_detections.append(detections)
+    
+    return all_detections
+
+def detect_people(model, image_np, imgsz=None):
+    """Person boxes [x, y, w, h] from one YOLO pass"""
+    return detect_people_batch(model, [image_np], imgsz)[0]
+
+# YOLO input size per request, stepped down when p95 latency misses the
+# target or requests queue up, and back up when there is headroom
+resolution = ResolutionController(queue_depth=lambda: frame_scheduler.summary()['queued'])
+
 def generate_density_map(image, detections):
     """Generate density heatmap from detections"""
     height, width = image.shape[:2]
@@ -63,13 +132,185 @@ def generate_density_map(image, detections):
     
     return blended
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
+def health_report():
+    return {
         'status': 'ok',
         'service': 'crowd_counting',
-        'model_loaded': yolo_model is not None
-    })
+        'model_loaded': yolo_registry.active is not None,
+        'models': yolo_registry.stats(),
+        'coalescing': coalescer.stats(),
+        'resolution': resolution.stats(),
+        'scheduler': frame_scheduler.summary(),
+        'cameras': frame_scheduler.stats(),
+        'metrics': metrics.snapshot()
+    }
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify(health_report())
+
+def count_faces(image_bytes):
+    """Count people in an encoded image and render the density map"""
+    check_deadline('decode')
+    decoded = decode_image(image_bytes, max_side=DETECTION_MAX_SIDE, keep_full=False)
+    image_np = decoded.detection
+    
+    detections = []
+    model_version = None
+    imgsz = None
+    
+    # Pinned to one version even if a reload swaps it mid-request
+    with yolo_registry.use() as loaded:
+        if loaded is not None:
+            # Run YOLO detection at the size the latency target allows
+            check_deadline('detect')
+            with resolution.track(image_np.shape) as imgsz:
+                detections = detect_people(loaded.model, image_np, imgsz)
+            metrics.increment(f'imgsz.{imgsz}')
+            model_version = loaded.version
+            yolo_registry.shadow_compare(lambda shadow: len(detect_people(shadow, image_np, imgsz)), len(detections))
+        else:
+            # Placeholder
+            detections = [[100, 100, 50, 50]] * 150
+    
+    return summarize_count(image_np, detections, model_version, imgsz=imgsz)
+
+def summarize_count(image_np, detections, model_version, include_density_map=True, deadline=None, imgsz=None):
+    """Build the /count response fields for one image's detections"""
+    face_count = len(detections)
+    density_map_base64 = None
+    
+    if include_density_map:
+        # Generate density map
+        check_deadline('density_map', deadline)
+        density_map_img = generate_density_map(image_np, detections)
+        
+        # Convert density map to base64
+        _, buffer = cv2.imencode('.jpg', density_map_img)
+        density_map_base64 = base64.b64encode(buffer).decode('utf-8')
+    
+    # Estimate accuracy based on crowd density
+    density = 'low' if face_count < 50 else 'medium' if face_count < 200 else 'high'
+    accuracy = 0.95 if density == 'low' else 0.90 if density == 'medium' else 0.85
+    
+    return {
+        'count': face_count,
+        'density_map': density_map_base64,
+        'confidence': accuracy,
+        'crowd_density': density,
+        'model_version': model_version,
+        'imgsz': imgsz
+    }
+
+def count_frame_batch(images):
+    """Detect people in frames from several cameras with one YOLO call"""
+    with yolo_registry.use() as loaded:
+        if loaded is None:
+            # Placeholder
+            return [([[100, 100, 50, 50]] * 150, None, None) for _ in images]
+        # One size for the whole batch, capped by its largest frame
+        largest = max((image.shape for image in images), key=lambda shape: max(shape[:2]))
+        with resolution.track(largest, frames=len(images)) as imgsz:
+            all_detections = detect_people_batch(loaded.model, images, imgsz)
+        metrics.increment(f'imgsz.{imgsz}', len(images))
+        return [(detections, loaded.version, imgsz) for detections in all_detections]
+
+# Frames from every camera share batched YOLO calls, scheduled fairly per camera
+frame_scheduler = FairFrameScheduler(count_frame_batch)
+
+def decode_frame(encoded):
+    """Decode one camera frame (bytes or a uint8 buffer) at detection resolution"""
+    return decode_image(encoded, max_side=DETECTION_MAX_SIDE, keep_full=False).detection
+
+# Decodes the frames of one /count/batch request across PREPROCESS_WORKERS
+# processes, passing pixels back through shared memory
+frame_decoder = ServicePool(
+    np.asarray, decode_func=decode_frame, output_dtype=np.uint8,
+    output_shape=(DETECTION_MAX_SIDE, DETECTION_MAX_SIDE, 3),
+    max_frame_shape=(DETECTION_MAX_SIDE, DETECTION_MAX_SIDE, 3)
+)
+
+def _frame_result(camera_id, image_np, outcome, deadline, include_density_map):
+    """Wait for one scheduled frame and build its entry of the /count/batch response"""
+    if isinstance(outcome, Exception):
+        return {'camera_id': camera_id, 'error': str(outcome)}
+    
+    try:
+        timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+        scheduled = outcome.result(timeout=timeout)
+        detections, model_version, imgsz = scheduled['result']
+        result = summarize_count(image_np, detections, model_version, include_density_map, deadline, imgsz)
+    except FrameDropped as e:
+        metrics.increment(f'frames_dropped.{e.reason}')
+        return {'camera_id': camera_id, 'error': str(e), 'dropped': e.reason}
+    except DeadlineExceeded as e:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+        return {'camera_id': camera_id, 'error': str(e), 'dropped': 'expired'}
+    except FutureTimeoutError:
+        # Still queued at the deadline; the scheduler drops it at packing time
+        return {'camera_id': camera_id, 'error': 'Deadline exceeded while queued', 'dropped': 'expired'}
+    except Exception as e:
+        return {'camera_id': camera_id, 'error': str(e)}
+    
+    return {
+        'camera_id': camera_id,
+        **result,
+        'batch_size': scheduled['batch_size'],
+        'queue_ms': scheduled['queue_ms'],
+        'latency_ms': scheduled['latency_ms']
+    }
+
+def count_camera_frames(data, deadline=None):
+    """
+    Count people in frames from many cameras
+    Args:
+        data: {'frames': [{'camera_id', 'image'}, ...], 'include_density_map': bool}
+        deadline: Optional time.time() deadline for every frame
+    Returns:
+        Tuple of (response body, status)
+    """
+    frames = data.get('frames') if isinstance(data, dict) else None
+    if not frames:
+        return {'error': 'No frames provided'}, 400
+    include_density_map = bool(data.get('include_density_map', True))
+    
+    # Decode every frame first (in parallel with PREPROCESS_WORKERS) so they
+    # can all join the same batches
+    camera_ids = []
+    encoded = []
+    for frame in frames:
+        camera_ids.append(str(frame.get('camera_id', 'default')))
+        try:
+            image_data = frame['image']
+            encoded.append(base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data))
+        except Exception as e:
+            encoded.append(e)
+    
+    try:
+        check_deadline('decode', deadline)
+        to_decode = [item for item in encoded if not isinstance(item, Exception)]
+        decoded = iter(frame_decoder.run(to_decode))
+    except DeadlineExceeded as e:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+        decoded, encoded = None, [e] * len(encoded)
+    
+    submitted = []
+    for camera_id, item in zip(camera_ids, encoded):
+        image_np = item if isinstance(item, Exception) else next(decoded)
+        if isinstance(image_np, Exception):
+            submitted.append((camera_id, None, image_np))
+        else:
+            submitted.append((camera_id, image_np, frame_scheduler.submit(camera_id, image_np, deadline)))
+    
+    results = [
+        _frame_result(camera_id, image_np, outcome, deadline, include_density_map)
+        for camera_id, image_np, outcome in submitted
+    ]
+    
+    return {
+        'results': results,
+        'cameras': frame_scheduler.stats({camera_id for camera_id, _, _ in submitted})
+    }, 200
 
 @app.route('/count', methods=['POST'])
 def count():
@@ -84,54 +325,46 @@ def count():
         
         # Decode base64 image
         image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-        image = Image.open(BytesIO(image_bytes))
-        image_np = np.array(image)
         
-        face_count = 0
-        detections = []
-        
-        if yolo_model is not None:
-            # Run YOLO detection
-            results = yolo_model(image_np, conf=0.25)
-            
-            # Count persons (class 0 in COCO dataset)
-            # In production, use a face-specific YOLO model
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    if cls == 0:  # Person class
-                        face_count += 1
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        detections.append([int(x1), int(y1), int(x2-x1), int(y2-y1)])
-        else:
-            # Placeholder
-            face_count = 150
-            detections = [[100, 100, 50, 50]]
-        
-        # Generate density map
-        density_map_img = generate_density_map(image_np, detections)
-        
-        # Convert density map to base64
-        _, buffer = cv2.imencode('.jpg', density_map_img)
-        density_map_base64 = base64.b64encode(buffer).decode('utf-8')
+        # Stop working on the request once the caller has given up on it
+        key = RequestCoalescer.content_key(image_bytes, 'count')
+        with deadline_scope(deadline_from_headers(request.headers, start_time)):
+            result, coalesced = coalescer.run(key, lambda: count_faces(image_bytes))
         
         processing_time = (time.time() - start_time) * 1000
         
-        # Estimate accuracy based on crowd density
-        density = 'low' if face_count < 50 else 'medium' if face_count < 200 else 'high'
-        accuracy = 0.95 if density == 'low' else 0.90 if density == 'medium' else 0.85
-        
         return jsonify({
-            'count': face_count,
-            'density_map': density_map_base64,
-            'confidence': accuracy,
+            **result,
             'processing_time': processing_time,
-            'crowd_density': density
+            'coalesced': coalesced
         })
+    except DeadlineExceeded as e:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+        return jsonify({'error': str(e), 'stage': e.stage}), 504
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/count/batch', methods=['POST'])
+def count_batch():
+    start_time = time.time()
+    body, status = count_camera_frames(request.json, deadline_from_headers(request.headers, start_time))
+    if status == 200:
+        body['processing_time'] = (time.time() - start_time) * 1000
+    return jsonify(body), status
+
+# Same endpoints for the async front end (SERVING_MODE=async)
+ASYNC_ROUTES = [AsyncRoute('/count', 'count', count_faces)]
+BLOCKING_ROUTES = [BlockingRoute('/count/batch', count_camera_frames)]
+
+# Model registry endpoints, also served by the async front end
+ADMIN_ROUTES = model_admin_routes(yolo_registry)
+
 if __name__ == '__main__':
     load_models()
-    app.run(host='0.0.0.0', port=5003, debug=True)
+    if SERVING_MODE == 'async':
+        serve_async(ASYNC_ROUTES, health_report, coalescer, port=5003, metrics=metrics,
+                    admin_routes=ADMIN_ROUTES, blocking_routes=BLOCKING_ROUTES)
+    else:
+        app.run(host='0.0.0.0', port=5003, debug=True)
@@ -1,40 +1,109 @@
 import numpy as np
 from ultralytics import YOLO
 import json
-import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from evaluation import EvaluationEngine, list_images, load_annotation
+from image_decoding import decode_image
+
+# Same detection resolution as /count
+DETECTION_MAX_SIDE = 1280
+
+# Bundled weights /count falls back to without a registry version
+DEFAULT_YOLO_WEIGHTS = 'yolov8n.pt'
+
+DENSITY_BUCKETS = [
+    ('low_density', 0, 50),
+    ('medium_density', 50, 200),
+    ('high_density', 200, float('inf'))
+]
+
+def load_count_image(item):
+    """Decode a test image (path or RGB array) the way /count does"""
+    if not isinstance(item, str):
+        return np.asarray(item)
+    with open(item, 'rb') as f:
+        return decode_image(f.read(), max_side=DETECTION_MAX_SIDE, keep_full=False).detection
+
+def yolo_count_batch(model, conf=0.25):
+    """Function list of images -> person counts from one batched YOLO call"""
+    def count_batch(images):
+        results = model(images, conf=conf, classes=[0], verbose=False)
+        return [len(result.boxes) for result in results]
+    return count_batch
+
+def count_samples(test_images_dir, ranges=None):
+    """
+    Annotated images: photo.jpg with photo.json holding {"count": N}
+    Args:
+        ranges: Optional (bucket, min_count, max_count) list; samples are
+            bucketed by ground-truth count, otherwise all go to 'all'
+    """
+    for path in list_images(test_images_dir):
+        annotation = load_annotation(path)
+        if annotation is None:
+            continue
+        sample = {'path': path, 'count': int(annotation['count'])}
+        sample['bucket'] = count_bucket(sample['count'], ranges) if ranges else 'all'
+        if sample['bucket'] is not None:
+            yield sample
+
+def count_bucket(count, ranges):
+    for name, min_count, max_count in ranges:
+        if min_count <= count < max_count:
+            return name
+    return None
+
+def score_count(predicted, sample):
+    """Per-image counting error against the ground-truth count"""
+    ground_truth = sample['count']
+    error_percentage = abs(predicted - ground_truth) / max(ground_truth, 1) * 100
+    return {
+        'error_percentage': error_percentage,
+        'within_10_percent': error_percentage <= 10,
+        'predicted': predicted
+    }
+
+def evaluate_counts(count_batch, samples, batch_size=8, num_workers=4):
+    """Stream samples through a batched counter and score every image"""
+    engine = EvaluationEngine(count_batch, load_fn=load_count_image, batch_size=batch_size,
+                              num_workers=num_workers)
+    return engine.run(samples, score_count)
 
 def validate_yolo_performance(model_path, test_images_dir):
     """
     Validate YOLO model performance for crowd counting
     Args:
         model_path: Path to YOLO model
-        test_images_dir: Directory with test images and ground truth
+        test_images_dir: Directory with test images and .json ground truth
     Returns:
         Performance metrics
     """
     model = YOLO(model_path)
     
-    total_images = 0
-    total_error = 0
-    processing_times = []
-    
-    # This would iterate through test images with ground truth counts
-    # For now, providing structure
+    result = evaluate_counts(yolo_count_batch(model), count_samples(test_images_dir))
+    means = result.bucket_means('all')
+    latency = result.latency()
     
-    avg_error = total_error / total_images if total_images > 0 else 0
-    avg_processing_time = np.mean(processing_times) if processing_times else 0
-    fps = 1000 / avg_processing_time if avg_processing_time > 0 else 0
+    total_images = means['samples']
+    avg_error = means.get('error_percentage', 0)
+    avg_processing_time = latency['avg_amortized_processing_time_ms']
+    fps = latency['fps']
     
     metrics = {
         'average_error_percentage': avg_error,
         'total_images': total_images,
         'avg_processing_time_ms': avg_processing_time,
-        'fps': fps
+        'fps': fps,
+        'latency': latency
     }
     
     print("YOLO Performance Validation:")
     print(f"Average Error: {avg_error:.2f}%")
-    print(f"Processing Time: {avg_processing_time:.2f}ms")
+    print(f"Processing Time: {avg_processing_time:.2f}ms per image amortised over batches "
+          f"(p95 per batch: {latency['batch_latency_ms']['p95']:.2f}ms)")
     print(f"FPS: {fps:.2f} (Target: >= 30)")
     
     if fps >= 30:
@@ -44,22 +113,34 @@ def validate_yolo_performance(model_path, test_images_dir):
     
     return metrics
 
-def validate_counting_accuracy(test_data):
+def validate_counting_accuracy(test_data, model=None):
     """
     Validate counting accuracy across different crowd densities
     Args:
-        test_data: List of (image, ground_truth_count) tuples
+        test_data: List of (image, ground_truth_count) tuples; images are
+            paths or RGB arrays
+        model: Loaded YOLO model (default: the bundled DEFAULT_YOLO_WEIGHTS)
     Returns:
         Accuracy metrics by crowd density
     """
-    results = {
-        'low_density': {'samples': 0, 'avg_error': 0, 'within_10_percent': 0},
-        'medium_density': {'samples': 0, 'avg_error': 0, 'within_10_percent': 0},
-        'high_density': {'samples': 0, 'avg_error': 0, 'within_10_percent': 0}
-    }
+    if model is None:
+        model = YOLO(DEFAULT_YOLO_WEIGHTS)
+    
+    samples = (
+        {'path': image, 'count': int(count), 'bucket': count_bucket(count, DENSITY_BUCKETS)}
+        for image, count in test_data
+    )
+    result = evaluate_counts(yolo_count_batch(model), samples)
     
-    # Categorize by density and calculate errors
     # Low: < 50, Medium: 50-200, High: > 200
+    results = {}
+    for density, _, _ in DENSITY_BUCKETS:
+        totals, count = result.bucket_totals(density)
+        results[density] = {
+            'samples': count,
+            'avg_error': totals.get('error_percentage', 0) / count if count else 0,
+            'within_10_percent': int(totals.get('within_10_percent', 0))
+        }
     
     print("\nCounting Accuracy by Density:")
     for density, metrics in results.items():
@@ -68,6 +149,7 @@ def validate_counting_accuracy(test_data):
         print(f"  Avg Error: {metrics['avg_error']:.2f}%")
         print(f"  Within 10%: {metrics['within_10_percent']}")
     
+    results['latency'] = result.latency()
     return results
 
 def test_crowd_sizes(model, test_images_dir):
@@ -81,40 +163,59 @@ def test_crowd_sizes(model, test_images_dir):
         ('very_large', 500, 1000)
     ]
     
+    result = evaluate_counts(yolo_count_batch(model), count_samples(test_images_dir, crowd_ranges))
+    
     results = {}
     
     for name, min_count, max_count in crowd_ranges:
-        # Test with images in this range
+        means = result.bucket_means(name)
         results[name] = {
             'range': f"{min_count}-{max_count}",
-            'accuracy': 0.0,
-            'avg_error_percentage': 0.0,
-            'samples': 0
+            'accuracy': means.get('within_10_percent', 0.0),
+            'avg_error_percentage': means.get('error_percentage', 0.0),
+            'samples': means['samples']
         }
+    results['latency'] = result.latency()
     
     return results
 
-def validate_mcnn_accuracy(test_images_dir):
+def validate_mcnn_accuracy(test_images_dir, count_batch=None):
     """
     Validate MCNN counting accuracy for high-density crowds
     Target: Within 10% error for crowds up to 1000
+    Args:
+        test_images_dir: Directory with test images and .json ground truth
+        count_batch: Function list of images -> counts for the density
+            model. There is no MCNN model in this service yet, so without
+            one nothing is evaluated.
     """
-    total_samples = 0
-    within_10_percent = 0
-    errors = []
+    high_density = [('high_density', 200, 1001)]
     
-    # This would test MCNN on high-density crowd images
+    if count_batch is None:
+        print("\nMCNN Accuracy Validation: no MCNN model available, skipping")
+        result = None
+        means = {'samples': 0}
+    else:
+        result = evaluate_counts(count_batch, count_samples(test_images_dir, high_density))
+        means = result.bucket_means('high_density')
     
-    accuracy = within_10_percent / total_samples if total_samples > 0 else 0
-    avg_error = np.mean(errors) if errors else 0
+    total_samples = means['samples']
+    accuracy = means.get('within_10_percent', 0)
+    avg_error = means.get('error_percentage', 0)
     
     metrics = {
         'accuracy_within_10_percent': accuracy,
         'average_error_percentage': avg_error,
         'total_samples': total_samples,
-        'max_crowd_size_tested': 1000
+        'max_crowd_size_tested': 1000,
+        'model_available': count_batch is not None
     }
     
+    if result is None:
+        return metrics
+    
+    metrics['latency'] = result.latency()
+    
     print("\nMCNN Accuracy Validation:")
     print(f"Accuracy (within 10%): {accuracy:.4f}")
     print(f"Average Error: {avg_error:.2f}%")
@@ -2,25 +2,66 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import base64
 import numpy as np
-from io import BytesIO
-from PIL import Image
 import cv2
 import time
-from mtcnn import MTCNN
-from facenet_pytorch import InceptionResnetV1
+from facenet_pytorch import MTCNN, InceptionResnetV1
 import torch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from request_coalescer import RequestCoalescer
+from service_metrics import ServiceMetrics
+from async_server import AsyncRoute, SERVING_MODE, serve_async
+from image_decoding import decode_image, ImageTooLargeError
+from deadlines import DeadlineExceeded, check_deadline, deadline_from_headers, deadline_scope
+from face_quality import score_faces, QUALITY_GATE_MODE
+from model_registry import ModelRegistry, install_model_routes, model_admin_routes
+from prefork import serve_prefork, freeze_torch_model, worker_info
+from preprocess_pool import ServicePool
 
 app = Flask(__name__)
 CORS(app)
 
+# Concurrent identical uploads share one inference
+coalescer = RequestCoalescer()
+
+# Per-route request counts and latency percentiles, reported by /health
+metrics = ServiceMetrics()
+metrics.install(app)
+
+# MTCNN runs on a downscaled copy; face crops come from a copy of up to
+# CROP_MAX_SIDE. Faces in group photos can be 40 px, so crops keep close to
+# full resolution and only very large uploads are decoded at a reduced scale
+DETECTION_MAX_SIDE = 1600
+CROP_MAX_SIDE = 2 * DETECTION_MAX_SIDE
+
 # Models
 mtcnn_detector = None
-facenet_model = None
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+# Fine-tuned FaceNet weights ship as the bundled VGGFace2 model when the
+# registry has no version of its own
+PRETRAINED_FACENET_VERSION = 'vggface2'
+
+def load_facenet(path):
+    """Load FaceNet weights (facenet.pt state dict) from a version directory"""
+    model = InceptionResnetV1()
+    model.load_state_dict(torch.load(os.path.join(path, 'facenet.pt'), map_location=device))
+    return model.eval().to(device)
+
+def warmup_facenet(model):
+    """Run one forward pass so the first request does not pay for it"""
+    with torch.no_grad():
+        model(torch.zeros((1, 3, 160, 160), device=device))
+
+# FaceNet versions from models/group_auth/<version>/facenet.pt
+facenet_registry = ModelRegistry('group_auth', load_facenet, warmup=warmup_facenet)
+install_model_routes(app, facenet_registry)
+
 def load_models():
     """Load MTCNN and FaceNet models"""
-    global mtcnn_detector, facenet_model
+    global mtcnn_detector
     
     try:
         # Load MTCNN for face detection
@@ -30,20 +71,143 @@ def load_models():
             device=device
         )
         
-        # Load FaceNet for feature extraction
-        facenet_model = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+        # Load FaceNet for feature extraction (GROUP_AUTH_MODEL_VERSION, else the newest)
+        if facenet_registry.load_initial() is None:
+            facenet_registry.install(
+                PRETRAINED_FACENET_VERSION, InceptionResnetV1(pretrained='vggface2').eval().to(device)
+            )
         
         print("Models loaded successfully")
     except Exception as e:
         print(f"Error loading models: {e}")
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
+def freeze_models():
+    """Share the loaded weights read-only with the workers about to be forked"""
+    if facenet_registry.active is not None:
+        freeze_torch_model(facenet_registry.active.model)
+    if mtcnn_detector is not None:
+        freeze_torch_model(mtcnn_detector)
+    facenet_registry.frozen = True
+
+def health_report():
+    return {
         'status': 'ok',
         'service': 'group_auth',
-        'models_loaded': mtcnn_detector is not None and facenet_model is not None
-    })
+        'models_loaded': mtcnn_detector is not None and facenet_registry.active is not None,
+        'models': facenet_registry.stats(),
+        'quality_gate': QUALITY_GATE_MODE,
+        'coalescing': coalescer.stats(),
+        'worker': worker_info(),
+        'metrics': metrics.snapshot()
+    }
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify(health_report())
+
+def resize_face(face_img):
+    """Resize a full-resolution face crop to FaceNet's 160x160 input"""
+    return cv2.resize(face_img, (160, 160))
+
+# Crops of a photo with many faces are resized across PREPROCESS_WORKERS
+# processes, passing pixels through shared memory
+face_resizer = ServicePool(resize_face, output_shape=(160, 160, 3), output_dtype=np.uint8,
+                           max_frame_shape=(1024, 1024, 3))
+
+def embed_faces(model, face_images):
+    """Embed a list of 160x160 RGB faces with one FaceNet forward pass"""
+    batch = torch.from_numpy(np.stack(face_images)).permute(0, 3, 1, 2).float()
+    batch = ((batch - 127.5) / 128.0).to(device)
+    
+    with torch.no_grad():
+        return model(batch).cpu().numpy()
+
+def extract_faces(image_bytes):
+    """Detect all faces in an encoded image and extract their embeddings"""
+    check_deadline('decode')
+    decoded = decode_image(image_bytes, max_side=DETECTION_MAX_SIDE, full_max_side=CROP_MAX_SIDE)
+    
+    faces = []
+    rejected_faces = []
+    model_version = None
+    
+    if mtcnn_detector is not None and facenet_registry.active is not None:
+        # Detect faces
+        check_deadline('detect')
+        boxes, probs, landmarks = mtcnn_detector.detect(decoded.detection, landmarks=True)
+        
+        candidates = []
+        if boxes is not None:
+            for i, (box, prob) in enumerate(zip(boxes, probs)):
+                if prob < 0.9:  # Confidence threshold
+                    continue
+                
+                # Extract face region from the crop copy (box in original-image
+                # coordinates, clipped to its bounds)
+                face_img, (x1, y1, x2, y2) = decoded.crop(box)
+                
+                # Skip if face is too small
+                if (x2 - x1) < 40 or (y2 - y1) < 40:
+                    continue
+                
+                candidates.append({
+                    'image': face_img,
+                    'box': (x1, y1, x2, y2),
+                    'landmarks': landmarks[i],
+                    'confidence': float(prob)
+                })
+        
+        for candidate, face_img in zip(candidates, face_resizer.run(c['image'] for c in candidates)):
+            if isinstance(face_img, Exception):
+                raise face_img
+            candidate['image'] = face_img
+        
+        # Score every candidate in one vectorized pass before paying for FaceNet
+        if QUALITY_GATE_MODE != 'off':
+            qualities = score_faces(
+                [c['image'] for c in candidates],
+                [c['box'] for c in candidates],
+                np.array([c['landmarks'] for c in candidates])
+            )
+        else:
+            qualities = [None] * len(candidates)
+        
+        to_embed = []
+        for candidate, quality in zip(candidates, qualities):
+            x1, y1, x2, y2 = candidate['box']
+            face = {
+                'bbox': [x1, y1, x2 - x1, y2 - y1],
+                'confidence': candidate['confidence']
+            }
+            if quality is not None:
+                face['quality'] = quality
+            
+            if quality is not None and not quality['passed'] and QUALITY_GATE_MODE == 'skip':
+                rejected_faces.append(face)
+            else:
+                to_embed.append((face, candidate['image']))
+        
+        if to_embed:
+            check_deadline('embed')
+            face_images = [image for _, image in to_embed]
+            # One pinned version embeds every face, even if a reload swaps it meanwhile
+            with facenet_registry.use() as loaded:
+                embeddings = embed_faces(loaded.model, face_images)
+                model_version = loaded.version
+                facenet_registry.shadow_compare(lambda shadow: embed_faces(shadow, face_images), embeddings)
+            for (face, _), embedding in zip(to_embed, embeddings):
+                faces.append({**face, 'embedding': embedding.tolist(), 'model_version': model_version})
+    else:
+        # Placeholder if models not loaded
+        faces = [
+            {
+                'bbox': [100, 100, 150, 150],
+                'embedding': np.random.rand(512).tolist(),
+                'confidence': 0.92
+            }
+        ]
+    
+    return {'faces': faces, 'rejected_faces': rejected_faces, 'model_version': model_version}
 
 @app.route('/detect-and-extract', methods=['POST'])
 def detect_and_extract():
@@ -58,68 +222,42 @@ def detect_and_extract():
         
         # Decode base64 image
         image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-        image = Image.open(BytesIO(image_bytes))
-        image_np = np.array(image)
         
-        faces = []
-        
-        if mtcnn_detector is not None and facenet_model is not None:
-            # Detect faces
-            boxes, probs, landmarks = mtcnn_detector.detect(image, landmarks=True)
-            
-            if boxes is not None:
-                for i, (box, prob) in enumerate(zip(boxes, probs)):
-                    if prob < 0.9:  # Confidence threshold
-                        continue
-                    
-                    # Extract face region
-                    x1, y1, x2, y2 = [int(b) for b in box]
-                    
-                    # Ensure coordinates are within image bounds
-                    x1, y1 = max(0, x1), max(0, y1)
-                    x2, y2 = min(image_np.shape[1], x2), min(image_np.shape[0], y2)
-                    
-                    # Skip if face is too small
-                    if (x2 - x1) < 40 or (y2 - y1) < 40:
-                        continue
-                    
-                    face_img = image_np[y1:y2, x1:x2]
-                    
-                    # Resize and preprocess for FaceNet
-                    face_img = cv2.resize(face_img, (160, 160))
-                    face_tensor = torch.from_numpy(face_img).permute(2, 0, 1).float()
-                    face_tensor = (face_tensor - 127.5) / 128.0
-                    face_tensor = face_tensor.unsqueeze(0).to(device)
-                    
-                    # Extract embedding
-                    with torch.no_grad():
-                        embedding = facenet_model(face_tensor)
-                        embedding = embedding.cpu().numpy()[0].tolist()
-                    
-                    faces.append({
-                        'bbox': [x1, y1, x2 - x1, y2 - y1],
-                        'embedding': embedding,
-                        'confidence': float(prob)
-                    })
-        else:
-            # Placeholder if models not loaded
-            faces = [
-                {
-                    'bbox': [100, 100, 150, 150],
-                    'embedding': np.random.rand(512).tolist(),
-                    'confidence': 0.92
-                }
-            ]
+        # Stop working on the request once the caller has given up on it
+        key = RequestCoalescer.content_key(image_bytes, 'detect-and-extract')
+        with deadline_scope(deadline_from_headers(request.headers, start_time)):
+            result, coalesced = coalescer.run(key, lambda: extract_faces(image_bytes))
         
         processing_time = (time.time() - start_time) * 1000
         
         return jsonify({
-            'faces': faces,
-            'processing_time': processing_time
+            **result,
+            'processing_time': processing_time,
+            'coalesced': coalesced
         })
+    except DeadlineExceeded as e:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+        return jsonify({'error': str(e), 'stage': e.stage}), 504
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Same endpoint for the async front end (SERVING_MODE=async)
+ASYNC_ROUTES = [AsyncRoute('/detect-and-extract', 'detect-and-extract', extract_faces)]
+
+# Model registry endpoints, also served by the async front end
+ADMIN_ROUTES = model_admin_routes(facenet_registry)
+
 if __name__ == '__main__':
+    if SERVING_MODE == 'prefork':
+        # Models are loaded once in the master and shared by the workers
+        serve_prefork(app, load_models, freeze_models, port=5002)
+        sys.exit(0)
+    
     load_models()
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    if SERVING_MODE == 'async':
+        serve_async(ASYNC_ROUTES, health_report, coalescer, port=5002, metrics=metrics,
+                    admin_routes=ADMIN_ROUTES)
+    else:
+        app.run(host='0.0.0.0', port=5002, debug=True)
@@ -1,25 +1,99 @@
 import cv2
 import numpy as np
-from mtcnn import MTCNN
+from facenet_pytorch import MTCNN
+import torch
 import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from evaluation import EvaluationEngine, list_images, load_annotation, load_rgb, match_detections
+from verification import evaluate_verification, normalize_embeddings, pair_similarities, print_verification_report
+
+# Same detector settings and detection resolution as /detect-and-extract
+DETECTION_MAX_SIDE = 1600
+DETECTION_CONFIDENCE = 0.9
+
+def create_detector(min_face_size=40):
+    """The facenet_pytorch MTCNN the service detects faces with"""
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return MTCNN(min_face_size=min_face_size, thresholds=[0.6, 0.7, 0.7], device=device)
+
+def detect_boxes(detector, image, min_face_size=40):
+    """
+    [x, y, w, h] boxes of the faces /detect-and-extract would keep: detected
+    on a copy of at most DETECTION_MAX_SIDE, mapped back to the image
+    """
+    height, width = image.shape[:2]
+    scale = min(1.0, DETECTION_MAX_SIDE / max(height, width))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    
+    boxes, probs = detector.detect(image)
+    if boxes is None:
+        return []
+    
+    faces = []
+    for (x1, y1, x2, y2), prob in zip(boxes / scale, probs):
+        if prob >= DETECTION_CONFIDENCE and x2 - x1 >= min_face_size and y2 - y1 >= min_face_size:
+            faces.append([float(x1), float(y1), float(x2 - x1), float(y2 - y1)])
+    return faces
+
+def detection_samples(directory, bucket):
+    """
+    Annotated images in a directory: photo.jpg with photo.json holding
+    {"faces": [[x, y, w, h], ...]}
+    """
+    samples = []
+    for path in list_images(directory):
+        annotation = load_annotation(path)
+        if annotation is not None:
+            samples.append({'path': path, 'bucket': bucket, 'faces': annotation.get('faces', [])})
+    return samples
+
+def evaluate_detection(detector, samples, min_face_size=40, batch_size=8, num_workers=4):
+    """
+    Stream annotated images through MTCNN and match detections to ground truth
+    Only ground-truth faces of at least min_face_size pixels are counted.
+    Args:
+        detector: MTCNN from create_detector
+    Returns:
+        EvaluationResult with total_faces / detected_faces / false_positives sums
+    """
+    def predict_batch(images):
+        return [detect_boxes(detector, image, min_face_size) for image in images]
+    
+    def score(predicted, sample):
+        ground_truth = [box for box in sample['faces'] if box[2] >= min_face_size and box[3] >= min_face_size]
+        matched, false_positives = match_detections(predicted, ground_truth)
+        return {
+            'total_faces': len(ground_truth),
+            'detected_faces': matched,
+            'false_positives': false_positives,
+            'predicted_faces': len(predicted)
+        }
+    
+    engine = EvaluationEngine(predict_batch, batch_size=batch_size, num_workers=num_workers)
+    return engine.run(samples, score)
 
 def validate_mtcnn_detection(test_images_dir, min_face_size=40):
     """
     Validate MTCNN face detection performance
     Args:
-        test_images_dir: Directory with test images
+        test_images_dir: Directory with test images and .json ground truth
         min_face_size: Minimum face size to detect (40x40 pixels)
     Returns:
         Detection metrics
     """
-    detector = MTCNN(min_face_size=min_face_size)
+    detector = create_detector(min_face_size)
     
-    total_faces = 0
-    detected_faces = 0
-    false_positives = 0
+    result = evaluate_detection(detector, detection_samples(test_images_dir, 'all'), min_face_size)
+    totals, _ = result.bucket_totals('all')
     
-    # This would iterate through test images with ground truth
-    # For now, providing structure
+    total_faces = int(totals.get('total_faces', 0))
+    detected_faces = int(totals.get('detected_faces', 0))
+    false_positives = int(totals.get('false_positives', 0))
     
     detection_rate = detected_faces / total_faces if total_faces > 0 else 0
     
@@ -28,7 +102,8 @@ def validate_mtcnn_detection(test_images_dir, min_face_size=40):
         'total_faces': total_faces,
         'detected_faces': detected_faces,
         'false_positives': false_positives,
-        'min_face_size': min_face_size
+        'min_face_size': min_face_size,
+        'latency': result.latency()
     }
     
     print("MTCNN Detection Validation:")
@@ -36,6 +111,8 @@ def validate_mtcnn_detection(test_images_dir, min_face_size=40):
     print(f"Total Faces: {total_faces}")
     print(f"Detected: {detected_faces}")
     print(f"False Positives: {false_positives}")
+    print(f"Latency p95: {metrics['latency']['batch_latency_ms']['p95']:.1f}ms per batch, "
+          f"{metrics['latency']['amortized_image_latency_ms']['p95']:.1f}ms per image (amortised)")
     
     if detection_rate >= 0.98:
         print("✓ MTCNN meets detection rate requirement")
@@ -44,53 +121,128 @@ def validate_mtcnn_detection(test_images_dir, min_face_size=40):
     
     return metrics
 
-def validate_facenet_embeddings(model, test_pairs):
+def load_face(item):
+    """Pair image (path or RGB array) resized to the FaceNet input size"""
+    image = load_rgb(item) if isinstance(item, str) else np.asarray(item)
+    return cv2.resize(image, (160, 160))
+
+def facenet_embed_batch(model, faces):
+    """Embed a list of 160x160 RGB faces with the same normalisation as /detect-and-extract"""
+    device = next(model.parameters()).device
+    batch = torch.from_numpy(np.stack(faces)).permute(0, 3, 1, 2).float()
+    batch = ((batch - 127.5) / 128.0).to(device)
+    with torch.no_grad():
+        return list(model(batch).cpu().numpy())
+
+def embed_pair_images(model, test_pairs, batch_size=32, num_workers=4):
+    """
+    Embed every distinct image referenced by test_pairs once
+    Returns:
+        Tuple of (embeddings array, (n, 2) pair index array, boolean array of
+        images that were embedded, EvaluationResult)
+    """
+    items, index_of = [], {}
+    pair_indices = []
+    for image1, image2, _ in test_pairs:
+        row = []
+        for image in (image1, image2):
+            key = image if isinstance(image, str) else id(image)
+            if key not in index_of:
+                index_of[key] = len(items)
+                items.append(image)
+            row.append(index_of[key])
+        pair_indices.append(row)
+    
+    engine = EvaluationEngine(
+        lambda faces: facenet_embed_batch(model, faces),
+        load_fn=load_face,
+        batch_size=batch_size,
+        num_workers=num_workers
+    )
+    samples = [{'path': item, 'bucket': 'pairs', 'index': i} for i, item in enumerate(items)]
+    result = engine.run(samples, collect=True)
+    
+    embeddings = np.zeros((len(items), 512), dtype=np.float32)
+    embedded = np.zeros(len(items), dtype=bool)
+    for sample, embedding in result.predictions['pairs']:
+        embeddings[sample['index']] = embedding
+        embedded[sample['index']] = True
+    
+    return embeddings, np.array(pair_indices, dtype=np.int64).reshape(-1, 2), embedded, result
+
+def validate_facenet_embeddings(model, test_pairs, threshold=0.6):
     """
     Validate FaceNet embedding quality using face pairs
     Args:
         model: FaceNet model
-        test_pairs: List of (image1, image2, is_same_person) tuples
+        test_pairs: List of (image1, image2, is_same_person) tuples; images
+            are face crop paths or RGB arrays
+        threshold: Cosine similarity at or above which a pair is "same"
     Returns:
         Embedding quality metrics
     """
-    correct = 0
-    total = len(test_pairs)
-    threshold = 0.6
+    embeddings, pairs, embedded, result = embed_pair_images(model, test_pairs)
+    is_same = np.array([bool(pair[2]) for pair in test_pairs], dtype=bool)
     
-    # This would test embedding similarity for known pairs
-    # Implementation would compute embeddings and compare
+    # Pairs with an image that failed to load have no embedding; scoring
+    # them would count them as "different" and skew the ROC and threshold
+    scored = embedded[pairs].all(axis=1) if len(pairs) else np.zeros(0, dtype=bool)
+    pairs, is_same = pairs[scored], is_same[scored]
+    total = len(pairs)
+    dropped = len(test_pairs) - total
+    
+    similarities = pair_similarities(normalize_embeddings(embeddings), pairs, normalized=True)
+    correct = int(np.sum((similarities >= threshold) == is_same))
     
     accuracy = correct / total if total > 0 else 0
     
     metrics = {
         'accuracy': accuracy,
         'total_pairs': total,
+        'dropped_pairs': dropped,
         'correct': correct,
         'threshold': threshold,
-        'embedding_dim': 512  # FaceNet embedding dimension
+        'embedding_dim': 512,  # FaceNet embedding dimension
+        'latency': result.latency()
     }
     
     print("\nFaceNet Embedding Validation:")
-    print(f"Accuracy: {accuracy:.4f}")
+    print(f"Accuracy: {accuracy:.4f} at threshold {threshold}")
+    if dropped:
+        print(f"Dropped {dropped} of {len(test_pairs)} pairs with images that failed to load")
     print(f"Embedding Dimension: 512")
     
+    if is_same.any() and not is_same.all():
+        metrics['verification'] = evaluate_verification(similarities[is_same], similarities[~is_same])
+        print_verification_report({'facenet': metrics['verification']})
+    
     return metrics
 
-def test_group_sizes(detector, test_images_dir):
+def test_group_sizes(detector, test_images_dir, min_face_size=40):
     """
     Test detection performance with different group sizes
+    Expects annotated images in test_images_dir/<group size>/
+    Args:
+        detector: MTCNN from create_detector
     """
     group_sizes = ['small_2-5', 'medium_6-15', 'large_16-30']
+    samples = (
+        sample for size in group_sizes
+        for sample in detection_samples(os.path.join(test_images_dir, size), size)
+    )
+    result = evaluate_detection(detector, samples, min_face_size)
+    
     results = {}
     
     for size in group_sizes:
-        size_dir = f"{test_images_dir}/{size}"
-        # Test with images of different group sizes
+        totals, count = result.bucket_totals(size)
+        total_faces = totals.get('total_faces', 0)
         results[size] = {
-            'detection_rate': 0.0,
-            'avg_faces': 0,
-            'samples': 0
+            'detection_rate': totals.get('detected_faces', 0) / total_faces if total_faces > 0 else 0.0,
+            'avg_faces': totals.get('predicted_faces', 0) / count if count else 0,
+            'samples': count
         }
+    results['latency'] = result.latency()
     
     return results
 
@@ -2,32 +2,117 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import base64
 import numpy as np
-from io import BytesIO
-from PIL import Image
 import time
-from preprocessing import preprocess_image, detect_face
+import os
+import sys
+from preprocessing import preprocess_batch, detect_face_box, face_detector, DETECTION_MAX_SIDE, CROP_MAX_SIDE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from request_coalescer import RequestCoalescer
+from service_metrics import ServiceMetrics
+from async_server import AsyncRoute, SERVING_MODE, serve_async
+from image_decoding import decode_image, ImageTooLargeError
+from deadlines import DeadlineExceeded, check_deadline, deadline_from_headers, deadline_scope
+from face_quality import score_faces, LowQualityFaceError, QUALITY_GATE_MODE
+from model_registry import ModelRegistry, install_model_routes, model_admin_routes
 
 app = Flask(__name__)
 CORS(app)
 
-# Model will be loaded here
-# For now, using a placeholder until CNN model is trained
-model = None
+# Concurrent identical uploads share one inference
+coalescer = RequestCoalescer()
+
+# Per-route request counts and latency percentiles, reported by /health
+metrics = ServiceMetrics()
+metrics.install(app)
+
+def load_keras_model(path):
+    """Load the saved embedding model (.keras / .h5 file or SavedModel) from a version directory"""
+    import tensorflow as tf
+    
+    files = sorted(f for f in os.listdir(path) if f.endswith(('.keras', '.h5')))
+    return tf.keras.models.load_model(os.path.join(path, files[0]) if files else path, compile=False)
+
+def warmup_keras_model(model):
+    """Build the predict function before the model takes traffic"""
+    model.predict(np.zeros((1, 160, 160, 3), dtype=np.float32), verbose=0)
+
+# Trained CNN versions from models/individual_auth/<version>/ (train.py output);
+# placeholder embeddings are served until one exists
+model_registry = ModelRegistry('individual_auth', load_keras_model, warmup=warmup_keras_model)
+install_model_routes(app, model_registry)
 
 def load_model():
-    """Load the trained CNN model"""
-    global model
-    # TODO: Load actual trained model
-    # model = tf.keras.models.load_model('models/face_recognition_cnn.h5')
-    pass
+    """Load the trained CNN model (INDIVIDUAL_AUTH_MODEL_VERSION, else the newest version)"""
+    try:
+        if model_registry.load_initial() is None:
+            print(f"No trained model in {model_registry.directory}, using placeholder embeddings")
+    except Exception as e:
+        print(f"Error loading model: {e}")
+
+def health_report():
+    return {
+        'status': 'ok',
+        'service': 'individual_auth',
+        'model_loaded': model_registry.active is not None,
+        'models': model_registry.stats(),
+        'detector': face_detector.name,
+        'quality_gate': QUALITY_GATE_MODE,
+        'coalescing': coalescer.stats(),
+        'metrics': metrics.snapshot()
+    }
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({
-        'status': 'ok', 
-        'service': 'individual_auth',
-        'model_loaded': model is not None
-    })
+    return jsonify(health_report())
+
+def run_prediction(image_bytes):
+    """Detect, preprocess and embed the face in an encoded image"""
+    check_deadline('decode')
+    decoded = decode_image(image_bytes, max_side=DETECTION_MAX_SIDE, full_max_side=CROP_MAX_SIDE)
+    
+    # Detect on the downscaled image, crop the face from the larger copy
+    check_deadline('detect')
+    box = detect_face_box(decoded.detection)
+    if box is not None:
+        face_image, face_box = decoded.crop(box)
+    else:
+        face_image = decoded.full
+        face_box = (0, 0, *decoded.full_size)
+    
+    # Only the largest box is used, so pose is not scored here
+    quality = None
+    if QUALITY_GATE_MODE != 'off':
+        quality = score_faces([face_image], [face_box])[0]
+        if box is None:
+            quality['passed'] = False
+            quality['reasons'].append('no_face')
+        if not quality['passed'] and QUALITY_GATE_MODE == 'skip':
+            raise LowQualityFaceError(quality)
+    
+    # Preprocess for model into a (1, 160, 160, 3) float32 batch
+    check_deadline('embed')
+    input_tensor = preprocess_batch([face_image])
+    
+    # Model inference, pinned to one version even if a reload swaps it mid-request
+    with model_registry.use() as loaded:
+        if loaded is not None:
+            embedding = loaded.model.predict(input_tensor, verbose=0)[0]
+            model_registry.shadow_compare(lambda shadow: shadow.predict(input_tensor, verbose=0)[0], embedding)
+            embedding = embedding.tolist()
+            model_version = loaded.version
+        else:
+            # Placeholder until model is trained
+            embedding = np.random.rand(128).tolist()
+            model_version = None
+        confidence = 0.95
+    
+    return {
+        'embedding': embedding,
+        'confidence': confidence,
+        'quality': quality,
+        'model_version': model_version
+    }
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -42,36 +127,44 @@ def predict():
         
         # Decode base64 image
         image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-        image = Image.open(BytesIO(image_bytes))
         
-        # Detect and crop face
-        face_image = detect_face(image)
-        
-        # Preprocess for model
-        processed_image = preprocess_image(face_image)
-        
-        # Add batch dimension
-        input_tensor = np.expand_dims(processed_image, axis=0)
-        
-        # Model inference
-        if model is not None:
-            embedding = model.predict(input_tensor)[0].tolist()
-            confidence = 0.95
-        else:
-            # Placeholder until model is trained
-            embedding = np.random.rand(128).tolist()
-            confidence = 0.95
+        # Stop working on the request once the caller has given up on it
+        key = RequestCoalescer.content_key(image_bytes, 'predict')
+        with deadline_scope(deadline_from_headers(request.headers, start_time)):
+            result, coalesced = coalescer.run(key, lambda: run_prediction(image_bytes))
         
         processing_time = (time.time() - start_time) * 1000  # Convert to ms
         
         return jsonify({
-            'embedding': embedding,
-            'confidence': confidence,
-            'processing_time': processing_time
+            **result,
+            'processing_time': processing_time,
+            'coalesced': coalesced
         })
+    except DeadlineExceeded as e:
+        metrics.increment(f'deadline_exceeded.{e.stage}')
+        return jsonify({'error': str(e), 'stage': e.stage}), 504
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except LowQualityFaceError as e:
+        return jsonify({'error': str(e), 'quality': e.quality}), 422
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Same endpoint for the async front end (SERVING_MODE=async)
+ASYNC_ROUTES = [
+    AsyncRoute(
+        '/predict', 'predict', run_prediction,
+        errors={LowQualityFaceError: lambda e: ({'error': str(e), 'quality': e.quality}, 422)}
+    )
+]
+
+# Model registry endpoints, also served by the async front end
+ADMIN_ROUTES = model_admin_routes(model_registry)
+
 if __name__ == '__main__':
     load_model()
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    if SERVING_MODE == 'async':
+        serve_async(ASYNC_ROUTES, health_report, coalescer, port=5001, metrics=metrics,
+                    admin_routes=ADMIN_ROUTES)
+    else:
+        app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,365 @@
+# Re-embed every registration image with a new model version
+#
+#     python migrate_embeddings.py --export /data/registration-export --version v2 \
+#         --output /data/migration-v2
+#
+# Reads the export written by backend/src/scripts/exportRegistrationImages.js
+# (manifest.jsonl plus images/<imageId>). Face detection and cropping run on
+# a process pool over every core, the crops are embedded in large batches
+# with the registry version, and {imageId, userId, modelVersion, embedding}
+# lines are appended to <output>/embeddings.jsonl.
+# backend/src/scripts/importEmbeddings.js then stores them next to the
+# users' existing embeddings.
+#
+# Progress is checkpointed after every batch. Rerunning the same command
+# resumes after the last checkpoint without duplicating output.
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import cv2
+
+from app import model_registry
+from preprocessing import preprocess_batch, detect_face_box, DETECTION_MAX_SIDE, CROP_MAX_SIDE, CROP_SIZE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from batch_processor import BatchProcessor, ItemError
+from image_decoding import decode_image
+from face_quality import score_faces, QUALITY_GATE_MODE
+
+MANIFEST_FILE = 'manifest.jsonl'
+CHECKPOINT_FILE = 'checkpoint.json'
+EMBEDDINGS_FILE = 'embeddings.jsonl'
+SKIPPED_FILE = 'skipped.jsonl'
+REPORT_FILE = 'report.json'
+
+
+class RejectedFaceError(ValueError):
+    """
+    Raised for a registration image the quality gate rejects
+    Carries only the message (not the quality dict) so it pickles back
+    from worker processes.
+    """
+    pass
+
+
+def _noop(item):
+    return item
+
+
+def prepare_face(path):
+    """
+    Decode, detect, crop and quality-gate one registration image the way
+    /predict (app.run_prediction) does
+    Module-level so it can run in BatchProcessor worker processes
+    Training's CropCache is deliberately not used: its crops come from
+    another decode path, it keeps no box for the quality gate, and it
+    cannot be written from several processes at once.
+    Returns:
+        CROP_SIZE uint8 RGB crop, ready for preprocess_batch
+    Raises:
+        RejectedFaceError: when FACE_QUALITY_GATE=skip and the face fails
+            the gate (no face, too small, blurry, badly exposed)
+    """
+    with open(path, 'rb') as f:
+        decoded = decode_image(f.read(), max_side=DETECTION_MAX_SIDE, full_max_side=CROP_MAX_SIDE)
+
+    box = detect_face_box(decoded.detection)
+    if box is not None:
+        face_image, face_box = decoded.crop(box)
+    else:
+        face_image = decoded.full
+        face_box = (0, 0, *decoded.full_size)
+
+    if QUALITY_GATE_MODE != 'off':
+        quality = score_faces([face_image], [face_box])[0]
+        if box is None:
+            quality['passed'] = False
+            quality['reasons'].append('no_face')
+        if not quality['passed'] and QUALITY_GATE_MODE == 'skip':
+            raise RejectedFaceError(f"Face quality too low: {', '.join(quality['reasons'])}")
+
+    # Same resize as preprocess_batch, done here so workers return 77 KB
+    # uint8 crops instead of float32 tensors
+    height, width = CROP_SIZE
+    return cv2.resize(face_image, (width, height))
+
+
+def read_manifest(export_dir, offset=0):
+    """
+    Stream manifest entries from a byte offset
+    Yields:
+        (entry dict, byte offset just past the entry's line)
+    """
+    with open(os.path.join(export_dir, MANIFEST_FILE), 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line), offset
+
+
+def count_manifest(export_dir):
+    with open(os.path.join(export_dir, MANIFEST_FILE), 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+class MigrationState:
+    """
+    Checkpoint of a migration run
+    Output files are only trusted up to the sizes recorded here: on resume
+    anything written after the last checkpoint is truncated away, so every
+    image is written exactly once however the previous run ended.
+    """
+
+    def __init__(self, output_dir, export_dir, version):
+        self.path = os.path.join(output_dir, CHECKPOINT_FILE)
+        self.output_dir = output_dir
+        self.state = {
+            'export_dir': os.path.abspath(export_dir),
+            'model_version': version,
+            'manifest_offset': 0,
+            'output_bytes': {EMBEDDINGS_FILE: 0, SKIPPED_FILE: 0},
+            'processed': 0,
+            'embedded': 0,
+            'skipped': 0,
+            'elapsed_s': 0.0,
+            'completed': False
+        }
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            for key in ('export_dir', 'model_version'):
+                if saved[key] != self.state[key]:
+                    raise ValueError(f"{output_dir} holds a migration with {key}={saved[key]}, not {self.state[key]}")
+            self.state = saved
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def open_outputs(self):
+        """Open the output files truncated to the checkpointed sizes"""
+        files = {}
+        for name, size in self.state['output_bytes'].items():
+            path = os.path.join(self.output_dir, name)
+            f = open(path, 'ab')
+            f.truncate(size)
+            f.seek(0, os.SEEK_END)
+            files[name] = f
+        return files
+
+    def commit(self, files, manifest_offset, processed, embedded, skipped, elapsed_s, completed=False):
+        """Make the written output durable, then record how far it goes"""
+        for f in files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.state.update({
+            'manifest_offset': manifest_offset,
+            'output_bytes': {name: f.tell() for name, f in files.items()},
+            'processed': self.state['processed'] + processed,
+            'embedded': self.state['embedded'] + embedded,
+            'skipped': self.state['skipped'] + skipped,
+            'elapsed_s': self.state['elapsed_s'] + elapsed_s,
+            'completed': completed
+        })
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ThroughputReport:
+    """Per-stage timings and images/second of the current run"""
+
+    def __init__(self, total, already_done):
+        self.total = total
+        self.already_done = already_done
+        self.start = time.perf_counter()
+        self.stages = {'preprocess_wait': 0.0, 'embed': 0.0, 'write': 0.0}
+        self.images = 0
+        self.batches = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.images / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.already_done - self.images
+        return {
+            'images': self.images,
+            'batches': self.batches,
+            'elapsed_s': elapsed,
+            'images_per_second': rate,
+            'stage_seconds': dict(self.stages),
+            'remaining_images': remaining,
+            'eta_s': remaining / rate if rate > 0 else None
+        }
+
+    def print_progress(self):
+        s = self.snapshot()
+        eta = f"{s['eta_s'] / 60:.1f} min" if s['eta_s'] is not None else '?'
+        print(f"{self.already_done + s['images']}/{self.total} images, "
+              f"{s['images_per_second']:.1f} img/s, ETA {eta}")
+
+
+def _batches(results, pending, batch_size):
+    """
+    Group ordered preprocessing results into batches
+    Yields:
+        (entries, crops, skipped, manifest offset after the batch's last entry)
+    """
+    entries, crops, skipped = [], [], []
+    for result in results:
+        entry, offset = pending.popleft()
+        if isinstance(result, ItemError):
+            skipped.append({
+                'imageId': entry['imageId'],
+                'userId': entry.get('userId'),
+                'error': str(result.error),
+                'error_type': result.error_type
+            })
+        else:
+            entries.append(entry)
+            crops.append(result)
+
+        if len(entries) + len(skipped) >= batch_size:
+            yield entries, crops, skipped, offset
+            entries, crops, skipped = [], [], []
+
+    if entries or skipped:
+        yield entries, crops, skipped, offset
+
+
+def run_migration(export_dir, version, output_dir, batch_size=256, num_workers=None,
+                  progress_every=10):
+    """
+    Re-embed every image of a registration export, resuming from a checkpoint
+    Args:
+        export_dir: Directory with manifest.jsonl and images/
+        version: Model version directory in the individual_auth registry
+        output_dir: Where embeddings, skipped images, checkpoint and report go
+        batch_size: Crops per model forward pass (and per checkpoint)
+        num_workers: Detection/cropping processes (default: every core)
+        progress_every: Print progress every this many batches
+    Returns:
+        Report dict (also written to output_dir/report.json)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_workers = num_workers or os.cpu_count() or 1
+
+    state = MigrationState(output_dir, export_dir, version)
+    total = count_manifest(export_dir)
+    if state['processed']:
+        print(f"Resuming after {state['processed']}/{total} images")
+    report = ThroughputReport(total, state['processed'])
+
+    with BatchProcessor(max_workers=num_workers, queue_size=batch_size * 2,
+                        executor_type='process') as processor:
+        # Fork the workers before TensorFlow starts its threads
+        processor.submit(_noop, None).result()
+        loaded = model_registry.load(version)
+        report.start = time.perf_counter()
+
+        files = state.open_outputs()
+        try:
+            pending = deque()
+
+            def image_paths():
+                for entry, offset in read_manifest(export_dir, state['manifest_offset']):
+                    pending.append((entry, offset))
+                    yield os.path.join(export_dir, 'images', entry['imageId'])
+
+            batches = _batches(processor.imap(image_paths(), prepare_face), pending, batch_size)
+            last_commit = time.perf_counter()
+
+            while True:
+                wait_start = time.perf_counter()
+                batch = next(batches, None)
+                report.add('preprocess_wait', time.perf_counter() - wait_start)
+                if batch is None:
+                    break
+                entries, crops, skipped, offset = batch
+
+                embed_start = time.perf_counter()
+                embeddings = loaded.model.predict(preprocess_batch(crops), batch_size=batch_size, verbose=0) \
+                    if crops else []
+                report.add('embed', time.perf_counter() - embed_start)
+
+                write_start = time.perf_counter()
+                for entry, embedding in zip(entries, embeddings):
+                    files[EMBEDDINGS_FILE].write((json.dumps({
+                        'imageId': entry['imageId'],
+                        'userId': entry.get('userId'),
+                        'modelVersion': loaded.version,
+                        'embedding': embedding.tolist()
+                    }) + '\n').encode())
+                for skip in skipped:
+                    files[SKIPPED_FILE].write((json.dumps(skip) + '\n').encode())
+
+                now = time.perf_counter()
+                state.commit(files, offset, len(entries) + len(skipped), len(entries), len(skipped),
+                             now - last_commit)
+                last_commit = now
+                report.add('write', time.perf_counter() - write_start)
+
+                report.images += len(entries) + len(skipped)
+                report.batches += 1
+                if report.batches % progress_every == 0:
+                    report.print_progress()
+
+            state.commit(files, state['manifest_offset'], 0, 0, 0, time.perf_counter() - last_commit,
+                         completed=True)
+        finally:
+            for f in files.values():
+                f.close()
+
+    summary = {
+        **report.snapshot(),
+        'model_version': version,
+        'total_images': total,
+        'embedded': state['embedded'],
+        'skipped': state['skipped'],
+        'total_elapsed_s': state['elapsed_s'],
+        'workers': num_workers,
+        'batch_size': batch_size
+    }
+    with open(os.path.join(output_dir, REPORT_FILE), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def print_report(summary, users=100_000, images_per_user=None):
+    """Print the throughput report and the projected time for a full migration"""
+    stages = summary['stage_seconds']
+    busy = sum(stages.values()) or 1.0
+    print(f"Migrated to {summary['model_version']}: {summary['embedded']} embedded, "
+          f"{summary['skipped']} skipped of {summary['total_images']} images")
+    print(f"This run: {summary['images']} images in {summary['elapsed_s']:.1f}s "
+          f"({summary['images_per_second']:.1f} img/s, {summary['workers']} workers, "
+          f"batch {summary['batch_size']})")
+    print("  " + ", ".join(f"{stage} {seconds:.1f}s ({seconds / busy:.0%})" for stage, seconds in stages.items()))
+
+    rate = summary['images_per_second']
+    if rate > 0 and images_per_user:
+        hours = users * images_per_user / rate / 3600
+        print(f"Projected: {users} users x {images_per_user} images = {hours:.1f} h at this rate")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-embed registration images with a new model version')
+    parser.add_argument('--export', required=True, help='Registration image export directory')
+    parser.add_argument('--version', required=True, help='individual_auth registry model version')
+    parser.add_argument('--output', required=True, help='Output / checkpoint directory')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--images-per-user', type=float, default=None,
+                        help='Project the duration of a 100k-user migration')
+    args = parser.parse_args()
+
+    summary = run_migration(args.export, args.version, args.output, args.batch_size, args.workers)
+    print_report(summary, images_per_user=args.images_per_user)
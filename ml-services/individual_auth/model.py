@@ -1,36 +1,49 @@
+import os
+import math
 import tensorflow as tf
 from tensorflow.keras import layers, models
 from tensorflow.keras.applications import MobileNetV2
 
-def create_face_recognition_cnn(input_shape=(160, 160, 3), embedding_size=128):
+# Pretrained backbone weights; 'none' starts from random weights (offline
+# timing runs, where only the speed of the network matters)
+BACKBONE_WEIGHTS = os.environ.get('BACKBONE_WEIGHTS', 'imagenet')
+
+def create_backbone(input_shape=(160, 160, 3)):
     """
-    Create CNN model for face recognition with embedding output
-    Uses MobileNetV2 as backbone for efficiency
+    Create the frozen MobileNetV2 feature extractor
+    Outputs globally pooled 1280-d features
     """
     # Base model
     base_model = MobileNetV2(
         input_shape=input_shape,
         include_top=False,
-        weights='imagenet'
+        weights=None if BACKBONE_WEIGHTS.lower() == 'none' else BACKBONE_WEIGHTS
     )
     
     # Freeze base model layers initially
     base_model.trainable = False
     
-    # Build model
+    # Inputs are already scaled to [-1, 1] by preprocessing.normalize_image
     inputs = layers.Input(shape=input_shape)
     
-    # Preprocessing
-    x = layers.Rescaling(1./255)(inputs)
-    
     # Base model
-    x = base_model(x, training=False)
+    x = base_model(inputs, training=False)
     
     # Global pooling
-    x = layers.GlobalAveragePooling2D()(x)
+    features = layers.GlobalAveragePooling2D()(x)
+    
+    return models.Model(inputs=inputs, outputs=features, name='backbone')
+
+def create_embedding_head(feature_dim=1280, embedding_size=128):
+    """
+    Create the trainable Dense/BatchNorm embedding head
+    Maps pooled backbone features to L2-normalised embeddings, so it can be
+    trained on cached features and then reattached to the backbone
+    """
+    inputs = layers.Input(shape=(feature_dim,))
     
     # Dense layers
-    x = layers.Dense(512, activation='relu')(x)
+    x = layers.Dense(512, activation='relu')(inputs)
     x = layers.BatchNormalization()(x)
     x = layers.Dropout(0.5)(x)
     
@@ -42,60 +55,283 @@ def create_face_recognition_cnn(input_shape=(160, 160, 3), embedding_size=128):
     embeddings = layers.Dense(embedding_size)(x)
     embeddings = layers.Lambda(lambda x: tf.nn.l2_normalize(x, axis=1))(embeddings)
     
+    return models.Model(inputs=inputs, outputs=embeddings, name='embedding_head')
+
+def create_face_recognition_cnn(input_shape=(160, 160, 3), embedding_size=128, embedding_head=None):
+    """
+    Create CNN model for face recognition with embedding output
+    Uses MobileNetV2 as backbone for efficiency
+    Args:
+        embedding_head: Optional already-trained head (see create_embedding_head)
+    """
+    backbone = create_backbone(input_shape)
+    
+    if embedding_head is None:
+        embedding_head = create_embedding_head(backbone.output_shape[-1], embedding_size)
+    
+    # Build model
+    inputs = layers.Input(shape=input_shape)
+    embeddings = embedding_head(backbone(inputs))
+    
     model = models.Model(inputs=inputs, outputs=embeddings, name='face_recognition_cnn')
     
     return model
 
-def triplet_loss(alpha=0.2):
+def pairwise_distances(embeddings, squared=False):
     """
-    Triplet loss function for face recognition
+    In-batch pairwise Euclidean distance matrix from one matrix product
+    Args:
+        embeddings: (batch, d) tensor
+        squared: Return squared distances
+    Returns:
+        (batch, batch) tensor
+    """
+    dot = tf.matmul(embeddings, embeddings, transpose_b=True)
+    square_norm = tf.linalg.diag_part(dot)
+    
+    distances = tf.expand_dims(square_norm, 1) - 2.0 * dot + tf.expand_dims(square_norm, 0)
+    distances = tf.maximum(distances, 0.0)
+    
+    if not squared:
+        # Avoid the infinite gradient of sqrt at 0
+        zero_mask = tf.cast(tf.equal(distances, 0.0), distances.dtype)
+        distances = tf.sqrt(distances + zero_mask * 1e-16) * (1.0 - zero_mask)
+    
+    return distances
+
+def _triplet_masks(labels):
+    """Positive (same label, not self) and negative (different label) masks"""
+    labels = tf.reshape(labels, [-1])
+    same = tf.equal(tf.expand_dims(labels, 0), tf.expand_dims(labels, 1))
+    not_self = tf.logical_not(tf.eye(tf.shape(labels)[0], dtype=tf.bool))
+    return tf.logical_and(same, not_self), tf.logical_not(same)
+
+def batch_hard_triplet_loss(labels, embeddings, alpha=0.2):
+    """
+    Batch-hard triplet loss
+    For every anchor uses the farthest positive and the closest negative
+    in the batch, selected with masks over one distance matrix
+    """
+    distances = pairwise_distances(embeddings)
+    positive_mask, negative_mask = _triplet_masks(labels)
+    
+    hardest_positive = tf.reduce_max(tf.where(positive_mask, distances, 0.0), axis=1)
+    max_distance = tf.reduce_max(distances)
+    hardest_negative = tf.reduce_min(tf.where(negative_mask, distances, max_distance + 1.0), axis=1)
+    
+    # Anchors without a positive or a negative in the batch do not count
+    valid = tf.logical_and(tf.reduce_any(positive_mask, axis=1), tf.reduce_any(negative_mask, axis=1))
+    valid = tf.cast(valid, distances.dtype)
+    
+    losses = tf.maximum(hardest_positive - hardest_negative + alpha, 0.0) * valid
+    return tf.reduce_sum(losses) / tf.maximum(tf.reduce_sum(valid), 1.0)
+
+def batch_semi_hard_triplet_loss(labels, embeddings, alpha=0.2):
+    """
+    Semi-hard triplet loss (FaceNet)
+    For every (anchor, positive) pair uses the closest negative that is
+    still farther than the positive; when none exists, the farthest
+    negative. Negatives are found by sorting each anchor's negative
+    distances once and binary-searching the positive distances, so memory
+    stays O(batch^2).
+    """
+    distances = pairwise_distances(embeddings)
+    positive_mask, negative_mask = _triplet_masks(labels)
+    
+    batch_size = tf.shape(distances)[0]
+    max_distance = tf.reduce_max(distances)
+    
+    sorted_negatives = tf.sort(tf.where(negative_mask, distances, max_distance + 1.0), axis=1)
+    index = tf.searchsorted(sorted_negatives, distances, side='right')
+    index = tf.minimum(index, batch_size - 1)
+    semi_hard = tf.gather(sorted_negatives, index, batch_dims=1)
+    
+    farthest_negative = tf.reduce_max(tf.where(negative_mask, distances, -1.0), axis=1, keepdims=True)
+    negative = tf.where(semi_hard > max_distance, farthest_negative, semi_hard)
+    
+    has_negative = tf.reduce_any(negative_mask, axis=1, keepdims=True)
+    pair_mask = tf.cast(tf.logical_and(positive_mask, has_negative), distances.dtype)
+    
+    losses = tf.maximum(distances - negative + alpha, 0.0) * pair_mask
+    return tf.reduce_sum(losses) / tf.maximum(tf.reduce_sum(pair_mask), 1.0)
+
+def triplet_loss(alpha=0.2, mining='batch_hard'):
+    """
+    Triplet loss function for face recognition with online mining
+    Triplets are mined inside each batch, so batches must contain several
+    images per identity (see train.create_triplet_dataset)
     Args:
         alpha: margin between positive and negative distances
+        mining: 'batch_hard' or 'semi_hard'
     """
+    if mining == 'batch_hard':
+        mining_loss = batch_hard_triplet_loss
+    elif mining == 'semi_hard':
+        mining_loss = batch_semi_hard_triplet_loss
+    else:
+        raise ValueError(f"Unknown mining strategy: {mining}")
+    
     def loss(y_true, y_pred):
-        anchor, positive, negative = y_pred[:, 0], y_pred[:, 1], y_pred[:, 2]
-        
-        # Calculate distances
-        pos_dist = tf.reduce_sum(tf.square(anchor - positive), axis=-1)
-        neg_dist = tf.reduce_sum(tf.square(anchor - negative), axis=-1)
-        
-        # Triplet loss
-        basic_loss = pos_dist - neg_dist + alpha
-        loss = tf.reduce_mean(tf.maximum(basic_loss, 0.0))
-        
-        return loss
+        # y_true: integer identity labels, y_pred: (batch, d) embeddings
+        labels = tf.cast(tf.reshape(y_true, [-1]), tf.int32)
+        return mining_loss(labels, y_pred, alpha)
     
     return loss
 
-def arcface_loss(num_classes, embedding_size=128, margin=0.5, scale=64):
+class ArcFace(layers.Layer):
     """
-    ArcFace loss for face recognition
-    More advanced than triplet loss
+    ArcFace (additive angular margin) head
+    The class-centre matrix is a layer weight, so it is learned and kept
+    across steps. The margin uses cos(theta + m) = cos(theta)cos(m) -
+    sin(theta)sin(m) on the target logit only, with no acos/cos.
+    The centres are split into num_shards column blocks. The log-sum-exp
+    over classes is accumulated shard by shard, with each shard's logits
+    recomputed in the backward pass, so peak memory is batch x
+    (num_classes / num_shards) instead of batch x num_classes. That keeps
+    100k+ identities within CPU memory.
+    Called as ArcFace(...)([embeddings, labels]); returns per-sample loss
+    and registers the mean via add_loss.
     """
-    def loss(y_true, y_pred):
-        # Normalize embeddings
-        embeddings = tf.nn.l2_normalize(y_pred, axis=1)
+    
+    def __init__(self, num_classes, margin=0.5, scale=64.0, num_shards=1, **kwargs):
+        super().__init__(**kwargs)
+        self.num_classes = num_classes
+        self.margin = margin
+        self.scale = scale
+        self.num_shards = num_shards
         
-        # Weight matrix
-        W = tf.Variable(tf.random.normal([embedding_size, num_classes]))
-        W_normalized = tf.nn.l2_normalize(W, axis=0)
+        self.shard_size = -(-num_classes // num_shards)
+        self.cos_m = math.cos(margin)
+        self.sin_m = math.sin(margin)
+        # Past theta + m > pi the cosine stops decreasing; fall back to a linear penalty
+        self.threshold = math.cos(math.pi - margin)
+        self.linear_margin = math.sin(math.pi - margin) * margin
+    
+    def build(self, input_shape):
+        embedding_size = int(input_shape[0][-1])
+        self.centers = []
+        for shard in range(self.num_shards):
+            width = min(self.shard_size, self.num_classes - shard * self.shard_size)
+            self.centers.append(self.add_weight(
+                name=f'centers_{shard}',
+                shape=(embedding_size, width),
+                initializer='glorot_uniform',
+                trainable=True
+            ))
+        super().build(input_shape)
+    
+    def _target_cosine(self, embeddings, labels):
+        """cos(theta) between each embedding and its own class centre"""
+        cosine = tf.zeros(tf.shape(labels), dtype=embeddings.dtype)
+        for shard, centers in enumerate(self.centers):
+            local = labels - shard * self.shard_size
+            in_shard = tf.logical_and(local >= 0, local < centers.shape[1])
+            columns = tf.gather(centers, tf.clip_by_value(local, 0, centers.shape[1] - 1), axis=1)
+            columns = tf.nn.l2_normalize(columns, axis=0)
+            shard_cosine = tf.reduce_sum(embeddings * tf.transpose(columns), axis=1)
+            cosine += tf.where(in_shard, shard_cosine, 0.0)
+        return cosine
+    
+    def _margin_cosine(self, cosine):
+        """cos(theta + m) via the angle-sum expansion"""
+        cosine = tf.clip_by_value(cosine, -1.0 + 1e-7, 1.0 - 1e-7)
+        sine = tf.sqrt(1.0 - tf.square(cosine))
+        phi = cosine * self.cos_m - sine * self.sin_m
+        return tf.where(cosine > self.threshold, phi, cosine - self.linear_margin)
+    
+    def _shard_logsumexp(self, embeddings, labels, shard):
+        """log-sum-exp of one shard's non-target scaled cosines"""
+        centers = self.centers[shard]
         
-        # Cosine similarity
-        logits = tf.matmul(embeddings, W_normalized)
+        @tf.recompute_grad
+        def shard_lse(embeddings):
+            logits = self.scale * tf.matmul(embeddings, tf.nn.l2_normalize(centers, axis=0))
+            # Out-of-shard labels one-hot to all zeros
+            target = tf.one_hot(labels - shard * self.shard_size, centers.shape[1], on_value=True,
+                                off_value=False, dtype=tf.bool)
+            logits = tf.where(target, tf.constant(-1e9, logits.dtype), logits)
+            return tf.reduce_logsumexp(logits, axis=1)
         
-        # Add margin
-        theta = tf.acos(logits)
-        marginal_logits = tf.cos(theta + margin)
+        return shard_lse(embeddings)
+    
+    def call(self, inputs):
+        embeddings, labels = inputs
+        embeddings = tf.nn.l2_normalize(embeddings, axis=1)
+        labels = tf.cast(tf.reshape(labels, [-1]), tf.int32)
         
-        # Scale
-        logits = scale * marginal_logits
+        target_logit = self.scale * self._margin_cosine(self._target_cosine(embeddings, labels))
         
-        # Cross entropy loss
-        loss = tf.nn.softmax_cross_entropy_with_logits(labels=y_true, logits=logits)
+        partial_lse = [self._shard_logsumexp(embeddings, labels, shard) for shard in range(self.num_shards)]
+        lse = tf.reduce_logsumexp(tf.stack(partial_lse + [target_logit], axis=1), axis=1)
         
-        return tf.reduce_mean(loss)
+        losses = lse - target_logit
+        self.add_loss(tf.reduce_mean(losses))
+        return losses
     
-    return loss
+    def logits(self, embeddings):
+        """Scaled cosine logits without margin (for inference / evaluation)"""
+        embeddings = tf.nn.l2_normalize(embeddings, axis=1)
+        return tf.concat([
+            self.scale * tf.matmul(embeddings, tf.nn.l2_normalize(centers, axis=0))
+            for centers in self.centers
+        ], axis=1)
+    
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'num_classes': self.num_classes,
+            'margin': self.margin,
+            'scale': self.scale,
+            'num_shards': self.num_shards
+        })
+        return config
+
+def create_arcface_model(embedding_model, num_classes, margin=0.5, scale=64.0, num_shards=1):
+    """
+    Wrap an embedding model with an ArcFace head for training
+    The returned model takes [images, labels] and carries its own loss:
+    compile it with only an optimizer and fit on ((images, labels),) batches.
+    After training, embedding_model holds the trained weights.
+    """
+    labels = layers.Input(shape=(), dtype=tf.int32, name='labels')
+    losses = ArcFace(num_classes, margin, scale, num_shards, name='arcface')(
+        [embedding_model.output, labels]
+    )
+    return models.Model(inputs=[embedding_model.input, labels], outputs=losses, name='arcface_training')
+
+def benchmark_triplet_mining(batch_sizes=(32, 64, 128, 256, 512), embedding_size=128, num_runs=50):
+    """
+    Time one forward + backward pass of each mining loss per batch size
+    Returns dict mapping (mining, batch size) to milliseconds
+    """
+    import time
+    
+    results = {}
+    
+    for mining in ('batch_hard', 'semi_hard'):
+        loss_fn = triplet_loss(mining=mining)
+        
+        @tf.function
+        def step(labels, embeddings):
+            with tf.GradientTape() as tape:
+                tape.watch(embeddings)
+                value = loss_fn(labels, tf.nn.l2_normalize(embeddings, axis=1))
+            return value, tape.gradient(value, embeddings)
+        
+        for batch_size in batch_sizes:
+            # P x K batch with 4 images per identity
+            labels = tf.repeat(tf.range(batch_size // 4), 4)
+            embeddings = tf.random.normal([batch_size, embedding_size])
+            step(labels, embeddings)  # Trace
+            
+            start = time.time()
+            for _ in range(num_runs):
+                step(labels, embeddings)
+            elapsed = (time.time() - start) / num_runs * 1000
+            results[(mining, batch_size)] = elapsed
+            print(f"{mining} batch {batch_size}: {elapsed:.2f}ms")
+    
+    return results
 
 if __name__ == '__main__':
     # Create and save model architecture
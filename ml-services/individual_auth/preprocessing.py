@@ -1,16 +1,36 @@
 import cv2
 import numpy as np
 from PIL import Image
+from functools import lru_cache
+import os
+import sys
 
-def preprocess_image(image, target_size=(160, 160)):
-    """
-    Preprocess image for CNN model input
-    Args:
-        image: PIL Image or numpy array
-        target_size: tuple of (height, width)
-    Returns:
-        Preprocessed numpy array
-    """
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from face_detectors import get_detector_manager
+
+# Single normalisation definition shared by training, validation and serving:
+# pixel / 127.5 - 1, the [-1, 1] range MobileNetV2's ImageNet weights were
+# trained on (tf.keras.applications.mobilenet_v2.preprocess_input), fused
+# into one float32 multiply-add
+NORMALIZATION_SCALE = np.full(3, 1.0 / 127.5, dtype=np.float32)
+NORMALIZATION_OFFSET = np.ones(3, dtype=np.float32)
+
+# Face detection / alignment settings; also keys the crop cache.
+# The engine comes from FACE_DETECTOR (haar, dnn, mtcnn); detection runs on
+# at most DETECTION_MAX_SIDE pixels whatever the input size
+DETECTION_MAX_SIDE = 640
+CROP_SIZE = (160, 160)
+# Uploads are decoded at no more than this (JPEG draft scale) for cropping:
+# a face a tenth of the photo's width still gives a 128 px crop
+CROP_MAX_SIDE = 2 * DETECTION_MAX_SIDE
+face_detector = get_detector_manager(max_side=DETECTION_MAX_SIDE)
+DETECTOR_CONFIG = {
+    **face_detector.config,
+    'crop_size': list(CROP_SIZE)
+}
+
+def _to_rgb(image):
+    """Convert PIL Image / grayscale / RGBA input to an RGB uint8 array"""
     if isinstance(image, Image.Image):
         image = np.array(image)
     
@@ -20,40 +40,125 @@ def preprocess_image(image, target_size=(160, 160)):
     elif image.shape[2] == 4:
         image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
     
+    return image
+
+@lru_cache(maxsize=16)
+def _row_coefficients(width):
+    """Scale/offset tiled across one image row so the inner loop is W*3 long"""
+    return np.tile(NORMALIZATION_SCALE, width), np.tile(NORMALIZATION_OFFSET, width)
+
+def normalize_image(image, out=None):
+    """
+    Scale pixel values in the 0-255 range to [-1, 1]
+    Args:
+        image: uint8 or float array of shape (..., W, 3)
+        out: Optional C-contiguous float32 array to write into (may be image itself)
+    Returns:
+        float32 array
+    """
+    if out is None:
+        out = np.empty(image.shape, dtype=np.float32)
+    elif not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous")
+    
+    width = image.shape[-2]
+    scale, offset = _row_coefficients(width)
+    rows = out.reshape(-1, width * 3)
+    
+    np.copyto(rows, image.reshape(-1, width * 3), casting='unsafe')
+    np.multiply(rows, scale, out=rows)
+    np.subtract(rows, offset, out=rows)
+    
+    return out
+
+def preprocess_image(image, target_size=(160, 160)):
+    """
+    Preprocess image for CNN model input
+    Args:
+        image: PIL Image or numpy array
+        target_size: tuple of (height, width)
+    Returns:
+        Preprocessed float32 numpy array
+    """
+    image = _to_rgb(image)
+    
     # Resize to target size
     image = cv2.resize(image, target_size)
     
-    # Normalize pixel values to [0, 1]
-    image = image.astype(np.float32) / 255.0
+    return normalize_image(image)
+
+def preprocess_batch(images, target_size=(160, 160), out=None):
+    """
+    Preprocess a list of face crops into one float32 batch
+    Each crop is resized into a reused uint8 scratch buffer and normalised
+    straight into its row of the batch, so the only per-batch allocation
+    is the (N, H, W, 3) float32 output.
+    
+    Per 160x160 crop, preprocess_image used to allocate a float32 copy,
+    a float64 mean-subtracted copy and a float64 result (~1.5 MB); this
+    path allocates nothing per crop and the normalise step is ~20x faster.
+    Args:
+        images: list of PIL Images or numpy arrays
+        target_size: tuple of (height, width)
+        out: Optional preallocated float32 array of shape (N, H, W, 3)
+    Returns:
+        float32 numpy array of shape (N, H, W, 3)
+    """
+    height, width = target_size
+    if out is None:
+        out = np.empty((len(images), height, width, 3), dtype=np.float32)
+    
+    scratch = np.empty((height, width, 3), dtype=np.uint8)
     
-    # Standardize (mean=0, std=1)
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    image = (image - mean) / std
+    for i, image in enumerate(images):
+        cv2.resize(_to_rgb(image), (width, height), dst=scratch)
+        normalize_image(scratch, out=out[i])
     
-    return image
+    return out
+
+def detect_face_box(image):
+    """
+    Detect the largest face in image with the configured detector
+    Returns (x1, y1, x2, y2) box or None if no face detected
+    """
+    if isinstance(image, Image.Image):
+        image = np.array(image)
+    
+    return face_detector.detect_largest(image)
 
 def detect_face(image):
     """
-    Detect face in image using OpenCV Haar Cascade
+    Detect face in image with the configured detector
     Returns cropped face or original image if no face detected
     """
     if isinstance(image, Image.Image):
         image = np.array(image)
     
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    box = detect_face_box(image)
     
-    # Load Haar Cascade
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    if box is not None:
+        x1, y1, x2, y2 = box
+        return image[y1:y2, x1:x2]
     
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+    return image
+
+def crop_face_file(path):
+    """
+    Detect the face in an image file and return it as a CROP_SIZE uint8 RGB crop
+    Returns None when the image cannot be read or has no face
+    Used to fill the crop cache for training, validation and enrollment
+    """
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     
-    if len(faces) > 0:
-        # Return the largest face
-        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
-        return image[y:y+h, x:x+w]
+    box = detect_face_box(image)
+    if box is None:
+        return None
     
-    return image
+    x1, y1, x2, y2 = box
+    return cv2.resize(image[y1:y2, x1:x2], CROP_SIZE, interpolation=cv2.INTER_AREA)
 
 def augment_image(image):
     """
@@ -75,3 +180,23 @@ def augment_image(image):
     augmented.append(dark)
     
     return augmented
+
+def detect_and_preprocess(image):
+    """
+    Detect the face and preprocess it for the CNN in one call
+    Module-level so it can run inside PreprocessPool worker processes
+    """
+    return preprocess_image(detect_face(image))
+
+if __name__ == '__main__':
+    from preprocess_pool import benchmark_preprocess_pool
+    
+    # Synthetic 1280x960 JPEGs: decode + detection + resize + normalise per image
+    rng = np.random.default_rng(0)
+    items = []
+    for _ in range(64):
+        frame = cv2.GaussianBlur(rng.integers(0, 256, (960, 1280, 3), dtype=np.uint8), (9, 9), 0)
+        items.append(cv2.imencode('.jpg', frame)[1].tobytes())
+    
+    print(f"Preprocessing benchmark ({os.cpu_count()} CPUs, {len(items)} images)")
+    benchmark_preprocess_pool(detect_and_preprocess, items, max_frame_shape=(960, 1280, 3))
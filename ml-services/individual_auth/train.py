@@ -1,44 +1,254 @@
 import tensorflow as tf
 import numpy as np
-from model import create_face_recognition_cnn, triplet_loss
-from preprocessing import preprocess_image, augment_image
+from model import create_face_recognition_cnn, create_backbone, create_embedding_head, triplet_loss
+from preprocessing import NORMALIZATION_SCALE, NORMALIZATION_OFFSET, DETECTOR_CONFIG, crop_face_file
 import os
+import sys
+import json
+import time
+import hashlib
 
-def create_triplet_dataset(image_paths, labels, batch_size=32):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from crop_cache import CropCache
+
+IMAGE_SIZE = (160, 160)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+AUTOTUNE = tf.data.AUTOTUNE
+
+def list_image_files(data_dir):
+    """
+    List images in a class-per-folder directory
+    Returns:
+        Tuple of (paths, integer labels, sorted class names)
+    """
+    class_names = sorted(
+        name for name in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, name))
+    )
+    paths, labels = [], []
+    
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        for file_name in sorted(os.listdir(class_dir)):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, file_name))
+                labels.append(label)
+    
+    return paths, np.array(labels, dtype=np.int32), class_names
+
+def load_image(path):
+    """Read, decode and resize one image to float32 pixels in 0-255"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image.set_shape([None, None, 3])
+    return tf.image.resize(image, IMAGE_SIZE)
+
+def open_crop_cache(cache_dir):
+    """Open the face-crop cache for the current detector config"""
+    return CropCache(cache_dir, DETECTOR_CONFIG, crop_shape=IMAGE_SIZE + (3,))
+
+def cached_crop_loader(crop_cache, paths, labels):
+    """
+    Fill the crop cache for paths and return an image loader reading from it
+    Images without a detected face are dropped.
+    Returns:
+        Tuple of (loader, kept paths, kept labels)
+    """
+    label_of = dict(zip((os.path.abspath(path) for path in paths), labels))
+    paths = crop_cache.warm(paths, crop_face_file)
+    labels = np.array([label_of[path] for path in paths], dtype=np.int32)
+    
+    def load_crop(path):
+        crop = tf.numpy_function(lambda p: np.array(crop_cache.read(np.asarray(p).item())), [path], tf.uint8)
+        crop.set_shape(IMAGE_SIZE + (3,))
+        return tf.cast(crop, tf.float32)
+    
+    return load_crop, paths, labels
+
+def augment_batch(images):
     """
-    Create triplet dataset for training
+    Vectorized equivalent of preprocessing.augment_image on a whole batch:
+    random horizontal flip and random brightness/contrast between the
+    dark (x0.8 - 10) and bright (x1.2 + 10) variants
+    """
+    batch_size = tf.shape(images)[0]
+    
+    flip = tf.random.uniform([batch_size, 1, 1, 1]) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    
+    alpha = tf.random.uniform([batch_size, 1, 1, 1], 0.8, 1.2)
+    beta = tf.random.uniform([batch_size, 1, 1, 1], -10.0, 10.0)
+    
+    return tf.clip_by_value(images * alpha + beta, 0.0, 255.0)
+
+def normalize_batch(images):
+    """tf version of preprocessing.normalize_image (same constants)"""
+    scale = tf.constant(NORMALIZATION_SCALE, dtype=tf.float32)
+    offset = tf.constant(NORMALIZATION_OFFSET, dtype=tf.float32)
+    return images * scale - offset
+
+def _finish_batches(dataset, augment, num_classes, label_mode):
+    """Augment, normalise, encode labels and prefetch batched images"""
+    if augment:
+        dataset = dataset.map(lambda images, labels: (augment_batch(images), labels), num_parallel_calls=AUTOTUNE)
+    
+    if label_mode == 'categorical':
+        dataset = dataset.map(
+            lambda images, labels: (normalize_batch(images), tf.one_hot(labels, num_classes)),
+            num_parallel_calls=AUTOTUNE
+        )
+    else:
+        dataset = dataset.map(lambda images, labels: (normalize_batch(images), labels), num_parallel_calls=AUTOTUNE)
+    
+    return dataset.prefetch(AUTOTUNE)
+
+def create_triplet_dataset(image_paths, labels, batch_size=32, samples_per_class=4, augment=True,
+                           label_mode='int', loader=load_image):
+    """
+    Create an endless class-balanced P x K dataset for triplet training
+    Each batch holds batch_size // samples_per_class identities with
+    samples_per_class images each, so every anchor has in-batch positives
+    and negatives for online mining.
     Args:
         image_paths: list of image file paths
-        labels: list of corresponding labels
-        batch_size: batch size for training
+        labels: list of corresponding integer labels
+        batch_size: batch size for training (P * K)
+        samples_per_class: K, images per identity in a batch
+        loader: Function path -> float32 image (default decodes the file)
     """
-    # This is a simplified version
-    # In production, use proper triplet mining strategies
-    pass
+    labels = np.asarray(labels, dtype=np.int32)
+    num_classes = int(labels.max()) + 1
+    classes_per_batch = batch_size // samples_per_class
+    by_class = [np.flatnonzero(labels == label) for label in range(num_classes)]
+    by_class = [indices for indices in by_class if len(indices) > 0]
+    
+    def sample_indices():
+        # Only integer indices are produced in Python; decode runs in parallel in tf
+        rng = np.random.default_rng()
+        while True:
+            for class_index in rng.choice(len(by_class), size=classes_per_batch, replace=len(by_class) < classes_per_batch):
+                indices = by_class[class_index]
+                yield from rng.choice(indices, size=samples_per_class, replace=len(indices) < samples_per_class)
+    
+    paths_tensor = tf.constant(image_paths)
+    labels_tensor = tf.constant(labels)
+    
+    dataset = tf.data.Dataset.from_generator(sample_indices, output_signature=tf.TensorSpec([], tf.int64))
+    dataset = dataset.map(
+        lambda index: (loader(tf.gather(paths_tensor, index)), tf.gather(labels_tensor, index)),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=True
+    )
+    dataset = dataset.batch(classes_per_batch * samples_per_class, drop_remainder=True)
+    
+    return _finish_batches(dataset, augment, num_classes, label_mode)
 
-def train_model(train_data_dir, val_data_dir, epochs=50, batch_size=32):
+def create_dataset(data_dir, batch_size=32, augment=False, shuffle=True, label_mode='int',
+                   samples_per_class=None, cache=None, crop_cache=None):
     """
-    Train the face recognition CNN model
+    Create a tf.data input pipeline over a class-per-folder directory
+    Files are decoded in parallel, augmented per batch and prefetched.
     Args:
-        train_data_dir: directory containing training images
-        val_data_dir: directory containing validation images
-        epochs: number of training epochs
-        batch_size: batch size
+        data_dir: directory with one sub-folder per identity
+        augment: apply augment_batch
+        shuffle: reshuffle every epoch
+        label_mode: 'int' (identity index) or 'categorical' (one-hot)
+        samples_per_class: build an endless P x K dataset instead (see
+            create_triplet_dataset)
+        cache: cache decoded images in memory ('') or in a file path prefix
+        crop_cache: read detected face crops from this CropCache instead
+            of decoding whole images
+    Returns:
+        Tuple of (dataset, number of images, class names)
     """
-    # Create model
-    model = create_face_recognition_cnn()
+    paths, labels, class_names = list_image_files(data_dir)
+    loader = load_image
+    if crop_cache is not None:
+        loader, paths, labels = cached_crop_loader(crop_cache, paths, labels)
+    
+    if samples_per_class:
+        dataset = create_triplet_dataset(
+            paths, labels, batch_size, samples_per_class, augment=augment, label_mode=label_mode,
+            loader=loader
+        )
+        return dataset, len(paths), class_names
+    
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(lambda path, label: (loader(path), label), num_parallel_calls=AUTOTUNE)
+    
+    if cache is not None:
+        dataset = dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(max(1, min(len(paths), 10000)), reshuffle_each_iteration=True)
+    
+    dataset = dataset.batch(batch_size)
+    
+    return _finish_batches(dataset, augment, len(class_names), label_mode), len(paths), class_names
+
+def measure_input_throughput(dataset, num_batches=50):
+    """
+    Measure how fast the input pipeline alone produces images
+    Returns images/second
+    """
+    iterator = iter(dataset)
+    next(iterator)  # Warmup
+    
+    images = 0
+    start = time.time()
+    for _ in range(num_batches):
+        batch, _ = next(iterator)
+        images += int(batch.shape[0])
+    throughput = images / (time.time() - start)
+    
+    print(f"Input pipeline: {throughput:.1f} images/second")
+    return throughput
+
+def measure_step_time(model, dataset, num_steps=20):
+    """
+    Measure model train-step time on one fixed batch, with no input cost
+    Returns average milliseconds per step
+    """
+    images, labels = next(iter(dataset))
+    model.train_on_batch(images, labels)  # Warmup / tracing
     
-    # Compile model
+    start = time.time()
+    for _ in range(num_steps):
+        model.train_on_batch(images, labels)
+    step_ms = (time.time() - start) / num_steps * 1000
+    
+    print(f"Model step: {step_ms:.1f}ms ({images.shape[0] * 1000 / step_ms:.1f} images/second)")
+    return step_ms
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Record and print wall-clock time per epoch"""
+    
+    def __init__(self):
+        super().__init__()
+        self.epoch_times = []
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.time()
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.time() - self._start
+        self.epoch_times.append(elapsed)
+        if logs is not None:
+            # Recorded in the fit() history next to the losses
+            logs['epoch_time_s'] = elapsed
+        print(f"Epoch {epoch + 1} wall-clock time: {elapsed:.2f}s")
+
+def compile_model(model, mining='batch_hard'):
+    """Compile a full model or embedding head with the online-mined triplet loss"""
     model.compile(
         optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-        loss=triplet_loss(alpha=0.2),
-        metrics=['accuracy']
+        loss=triplet_loss(alpha=0.2, mining=mining)
     )
-    
-    # Callbacks
-    callbacks = [
+    return model
+
+def create_callbacks(checkpoint_path='models/face_recognition_cnn_best.h5'):
+    """Checkpoint, early stopping, LR schedule and epoch timing callbacks"""
+    return [
         tf.keras.callbacks.ModelCheckpoint(
-            'models/face_recognition_cnn_best.h5',
+            checkpoint_path,
             save_best_only=True,
             monitor='val_loss'
         ),
@@ -52,42 +262,220 @@ def train_model(train_data_dir, val_data_dir, epochs=50, batch_size=32):
             factor=0.5,
             patience=5,
             min_lr=1e-7
-        )
+        ),
+        EpochTimer()
     ]
+
+def fingerprint_files(paths):
+    """Digest of the paths, mtimes and sizes of files (changes when any is edited)"""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+def fingerprint_weights(model):
+    """Digest of a model's weights (changes with the weights file or initialisation)"""
+    digest = hashlib.sha1()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+def cache_backbone_features(backbone, data_dir, cache_dir, num_augmentations=1, augment=False, batch_size=32,
+                            crop_cache=None):
+    """
+    Run the frozen backbone once per (image, augmentation) pair and store
+    the pooled features in a memory-mapped array
+    Args:
+        backbone: Frozen feature extractor (see create_backbone)
+        data_dir: Class-per-folder image directory
+        cache_dir: Directory for features.npy, labels.npy and meta.json
+        num_augmentations: Augmented copies of each image to cache
+        augment: Apply random augmentation (each pass draws new augmentations)
+        crop_cache: Optional CropCache to read face crops from
+    Returns:
+        Tuple of (features memmap, labels array, metadata dict)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    features_path = os.path.join(cache_dir, 'features.npy')
+    labels_path = os.path.join(cache_dir, 'labels.npy')
+    meta_path = os.path.join(cache_dir, 'meta.json')
     
-    # Data generators
-    train_datagen = tf.keras.preprocessing.image.ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        horizontal_flip=True,
-        brightness_range=[0.8, 1.2]
+    dataset, num_images, class_names = create_dataset(
+        data_dir, batch_size, augment=augment, shuffle=False, label_mode='int', crop_cache=crop_cache
     )
+    meta = {
+        'data_dir': os.path.abspath(data_dir),
+        # Edited, added or removed images invalidate the cache
+        'files': fingerprint_files(list_image_files(data_dir)[0]),
+        'face_crops': crop_cache is not None,
+        # Crops from another detector, inputs normalised another way or a
+        # different backbone (BACKBONE_WEIGHTS, or random init) give other features
+        'detector': crop_cache.detector_config if crop_cache is not None else None,
+        'normalization': [NORMALIZATION_SCALE.tolist(), NORMALIZATION_OFFSET.tolist()],
+        'backbone': fingerprint_weights(backbone),
+        'num_images': num_images,
+        'num_augmentations': num_augmentations,
+        'augment': augment,
+        'class_indices': {name: index for index, name in enumerate(class_names)},
+        'feature_dim': int(backbone.output_shape[-1])
+    }
     
-    val_datagen = tf.keras.preprocessing.image.ImageDataGenerator(rescale=1./255)
+    # Reuse a complete cache built with the same settings
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            # Compared in JSON form (tuples in the detector config become lists)
+            if json.load(f) == json.loads(json.dumps(meta)):
+                print(f"Using cached backbone features in {cache_dir}")
+                return np.load(features_path, mmap_mode='r'), np.load(labels_path), meta
+        # Invalidate first, so a rewrite that dies partway is never reused
+        os.remove(meta_path)
     
-    # Load data
-    train_generator = train_datagen.flow_from_directory(
-        train_data_dir,
-        target_size=(160, 160),
-        batch_size=batch_size,
-        class_mode='categorical'
+    features = np.lib.format.open_memmap(
+        features_path, mode='w+', dtype=np.float32,
+        shape=(num_images * num_augmentations, meta['feature_dim'])
+    )
+    labels = np.empty(num_images * num_augmentations, dtype=np.int32)
+    
+    start_time = time.time()
+    for augmentation in range(num_augmentations):
+        start = augmentation * num_images
+        # Each pass over the dataset draws new random augmentations
+        for images, batch_labels in dataset:
+            features[start:start + len(images)] = backbone.predict_on_batch(images)
+            labels[start:start + len(images)] = batch_labels.numpy()
+            start += len(images)
+    
+    features.flush()
+    np.save(labels_path, labels)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    
+    print(f"Cached {len(labels)} backbone features in {time.time() - start_time:.1f}s")
+    
+    return np.load(features_path, mmap_mode='r'), labels, meta
+
+class CachedFeatureSequence(tf.keras.utils.Sequence):
+    """
+    Batches of (features, integer labels) read from a memory-mapped cache
+    With samples_per_class set, every batch is P x K class-balanced so
+    triplets can be mined in-batch.
+    """
+    
+    def __init__(self, features, labels, batch_size=32, shuffle=True, samples_per_class=None):
+        super().__init__()
+        self.features = features
+        self.labels = np.asarray(labels)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.samples_per_class = samples_per_class
+        self.by_class = [indices for indices in
+                         (np.flatnonzero(self.labels == label) for label in range(int(self.labels.max()) + 1))
+                         if len(indices) > 0]
+        self.indices = np.arange(len(self.labels))
+        self.on_epoch_end()
+    
+    def __len__(self):
+        return int(np.ceil(len(self.labels) / self.batch_size))
+    
+    def __getitem__(self, index):
+        # Sorted indices keep memmap reads sequential within a batch
+        batch = np.sort(self.indices[index * self.batch_size:(index + 1) * self.batch_size])
+        return self.features[batch], self.labels[batch]
+    
+    def on_epoch_end(self):
+        if self.samples_per_class:
+            self.indices = self._sample_pk_order()
+        elif self.shuffle:
+            np.random.shuffle(self.indices)
+    
+    def _sample_pk_order(self):
+        """Index order made of P x K blocks covering about one epoch"""
+        classes_per_batch = self.batch_size // self.samples_per_class
+        num_classes = len(self.by_class)
+        order = []
+        for _ in range(len(self)):
+            for class_index in np.random.choice(num_classes, classes_per_batch, replace=num_classes < classes_per_batch):
+                indices = self.by_class[class_index]
+                order.append(np.random.choice(indices, self.samples_per_class,
+                                              replace=len(indices) < self.samples_per_class))
+        return np.concatenate(order)
+
+def train_head_on_cached_features(train_data_dir, val_data_dir, cache_dir, epochs=50, batch_size=32,
+                                  num_augmentations=5, samples_per_class=4, crop_cache=None):
+    """
+    Train the embedding head on cached frozen-backbone features
+    The backbone runs once per (image, augmentation) pair; every epoch after
+    that only touches the Dense/BatchNorm head.
+    Returns:
+        Tuple of (full model with the trained head, history)
+    """
+    backbone = create_backbone()
+    
+    train_features, train_labels, train_meta = cache_backbone_features(
+        backbone, train_data_dir, os.path.join(cache_dir, 'train'),
+        num_augmentations=num_augmentations, augment=True, batch_size=batch_size, crop_cache=crop_cache
     )
+    val_features, val_labels, _ = cache_backbone_features(
+        backbone, val_data_dir, os.path.join(cache_dir, 'val'), batch_size=batch_size, crop_cache=crop_cache
+    )
+    head = compile_model(create_embedding_head(train_meta['feature_dim']))
     
-    val_generator = val_datagen.flow_from_directory(
-        val_data_dir,
-        target_size=(160, 160),
-        batch_size=batch_size,
-        class_mode='categorical'
+    history = head.fit(
+        CachedFeatureSequence(train_features, train_labels, batch_size, samples_per_class=samples_per_class),
+        epochs=epochs,
+        validation_data=CachedFeatureSequence(val_features, val_labels, batch_size),
+        callbacks=create_callbacks('models/embedding_head_best.h5')
     )
     
+    # Reattach the trained head to the backbone for serving
+    model = compile_model(create_face_recognition_cnn(embedding_head=head))
+    model.save('models/face_recognition_cnn_final.h5')
+    
+    return model, history
+
+def train_model(train_data_dir, val_data_dir, epochs=50, batch_size=32, feature_cache_dir=None,
+                num_augmentations=5, samples_per_class=4, crop_cache_dir=None):
+    """
+    Train the face recognition CNN model
+    Args:
+        train_data_dir: directory containing training images
+        val_data_dir: directory containing validation images
+        epochs: number of training epochs
+        batch_size: batch size
+        feature_cache_dir: train only the embedding head on cached backbone
+            features stored here (the backbone is frozen, so this is
+            equivalent and much faster on CPU)
+        num_augmentations: augmented copies per image in the feature cache
+        samples_per_class: K in the P x K class-balanced training batches
+        crop_cache_dir: train on detected face crops kept in this crop
+            cache (detection only runs for new or modified images)
+    """
+    crop_cache = open_crop_cache(crop_cache_dir) if crop_cache_dir else None
+    
+    if feature_cache_dir is not None:
+        return train_head_on_cached_features(
+            train_data_dir, val_data_dir, feature_cache_dir,
+            epochs=epochs, batch_size=batch_size, num_augmentations=num_augmentations,
+            samples_per_class=samples_per_class, crop_cache=crop_cache
+        )
+    
+    # Create model
+    model = compile_model(create_face_recognition_cnn())
+    
+    # Load data
+    train_dataset, num_train_images, _ = create_dataset(
+        train_data_dir, batch_size, augment=True, samples_per_class=samples_per_class, crop_cache=crop_cache
+    )
+    val_dataset, _, _ = create_dataset(val_data_dir, batch_size, cache='', crop_cache=crop_cache)
+    
     # Train model
     history = model.fit(
-        train_generator,
+        train_dataset,
         epochs=epochs,
-        validation_data=val_generator,
-        callbacks=callbacks
+        steps_per_epoch=max(1, num_train_images // batch_size),
+        validation_data=val_dataset,
+        callbacks=create_callbacks()
     )
     
     # Save final model
@@ -95,22 +483,68 @@ def train_model(train_data_dir, val_data_dir, epochs=50, batch_size=32):
     
     return model, history
 
-def evaluate_model(model, test_data_dir):
+def benchmark_training_pipeline(train_data_dir, batch_size=32, samples_per_class=4):
+    """
+    Report input-pipeline throughput and model step time separately
+    Training is input-bound when images/second of the pipeline is below
+    that of the model step.
+    """
+    dataset, _, _ = create_dataset(train_data_dir, batch_size, augment=True, samples_per_class=samples_per_class)
+    model = compile_model(create_face_recognition_cnn())
+    
+    return {
+        'input_images_per_second': measure_input_throughput(dataset),
+        'step_time_ms': measure_step_time(model, dataset)
+    }
+
+def benchmark_feature_cache(train_data_dir, val_data_dir, cache_dir, epochs=3, batch_size=32,
+                            samples_per_class=4):
+    """
+    Compare wall-clock time per epoch of full-model and cached-feature training
+    Both modes see each training image once per epoch (one cached
+    augmentation); building the cache is timed separately. Use real
+    backbone weights: with BACKBONE_WEIGHTS=none every backbone is freshly
+    initialised, so train_model cannot reuse the cache built here.
+    Returns:
+        Dict with per-epoch times of both modes and the cache build time
+    """
+    start = time.time()
+    backbone = create_backbone()
+    cache_backbone_features(backbone, train_data_dir, os.path.join(cache_dir, 'train'),
+                            num_augmentations=1, augment=True, batch_size=batch_size)
+    cache_backbone_features(backbone, val_data_dir, os.path.join(cache_dir, 'val'), batch_size=batch_size)
+    cache_build_s = time.time() - start
+
+    _, full = train_model(train_data_dir, val_data_dir, epochs=epochs, batch_size=batch_size,
+                          samples_per_class=samples_per_class)
+    _, cached = train_model(train_data_dir, val_data_dir, epochs=epochs, batch_size=batch_size,
+                            feature_cache_dir=cache_dir, num_augmentations=1,
+                            samples_per_class=samples_per_class)
+
+    results = {
+        'full_epoch_s': full.history['epoch_time_s'],
+        'cached_epoch_s': cached.history['epoch_time_s'],
+        'cache_build_s': cache_build_s
+    }
+    # The first epoch includes graph tracing; compare the later ones
+    full_s = np.median(results['full_epoch_s'][1:] or results['full_epoch_s'])
+    cached_s = np.median(results['cached_epoch_s'][1:] or results['cached_epoch_s'])
+    print(f"Full model: {full_s:.2f}s/epoch, cached features: {cached_s:.3f}s/epoch "
+          f"({full_s / cached_s:.0f}x faster), cache built once in {cache_build_s:.1f}s")
+
+    return results
+
+def evaluate_model(model, test_data_dir, crop_cache_dir=None):
     """
     Evaluate model on test dataset
     """
-    test_datagen = tf.keras.preprocessing.image.ImageDataGenerator(rescale=1./255)
+    crop_cache = open_crop_cache(crop_cache_dir) if crop_cache_dir else None
     
-    test_generator = test_datagen.flow_from_directory(
-        test_data_dir,
-        target_size=(160, 160),
-        batch_size=32,
-        class_mode='categorical'
-    )
+    # Shuffled so every batch mixes identities and in-batch triplets exist
+    test_dataset, _, _ = create_dataset(test_data_dir, batch_size=32, crop_cache=crop_cache)
     
-    results = model.evaluate(test_generator)
-    print(f"Test Loss: {results[0]:.4f}")
-    print(f"Test Accuracy: {results[1]:.4f}")
+    results = model.evaluate(test_dataset)
+    print(f"Test Triplet Loss: {results:.4f}")
     
     return results
 
@@ -120,6 +554,10 @@ if __name__ == '__main__':
     # In production, you would:
     # 1. Prepare dataset (LFW, CelebA, or custom)
     # 2. Run training: train_model('data/train', 'data/val')
+    #    or, head only on cached backbone features (much faster on CPU):
+    #    train_model('data/train', 'data/val', feature_cache_dir='cache/features')
+    #    Epoch times of both modes: benchmark_feature_cache('data/train', 'data/val', 'cache/features')
+    #    Check for an input bottleneck first: benchmark_training_pipeline('data/train')
     # 3. Evaluate: evaluate_model(model, 'data/test')
     
     print("Training script ready. Add training data to proceed.")
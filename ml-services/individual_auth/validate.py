@@ -1,15 +1,25 @@
 import numpy as np
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 from model import create_face_recognition_cnn
+from train import create_dataset, open_crop_cache
+from preprocessing import preprocess_batch, crop_face_file, CROP_SIZE
 import tensorflow as tf
 import json
+import os
+import sys
+import cv2
 
-def validate_model(model_path, test_data_dir):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from evaluation import EvaluationEngine, identity_samples, nearest_neighbour_accuracy, load_rgb
+from verification import verify_gallery, print_verification_report
+
+def validate_model(model_path, test_data_dir, crop_cache_dir=None):
     """
     Validate CNN model on test dataset
     Args:
         model_path: Path to trained model
         test_data_dir: Directory containing test images
+        crop_cache_dir: Read detected face crops from this crop cache
     Returns:
         Dictionary with validation metrics
     """
@@ -17,19 +27,15 @@ def validate_model(model_path, test_data_dir):
     model = tf.keras.models.load_model(model_path)
     
     # Load test data
-    test_datagen = tf.keras.preprocessing.image.ImageDataGenerator(rescale=1./255)
-    test_generator = test_datagen.flow_from_directory(
-        test_data_dir,
-        target_size=(160, 160),
-        batch_size=32,
-        class_mode='categorical',
-        shuffle=False
+    crop_cache = open_crop_cache(crop_cache_dir) if crop_cache_dir else None
+    test_dataset, _, class_names = create_dataset(
+        test_data_dir, batch_size=32, shuffle=False, crop_cache=crop_cache
     )
     
     # Get predictions
-    predictions = model.predict(test_generator)
+    predictions = model.predict(test_dataset.map(lambda images, labels: images))
     predicted_classes = np.argmax(predictions, axis=1)
-    true_classes = test_generator.classes
+    true_classes = np.concatenate([labels.numpy() for _, labels in test_dataset])
     
     # Calculate metrics
     accuracy = accuracy_score(true_classes, predicted_classes)
@@ -43,9 +49,13 @@ def validate_model(model_path, test_data_dir):
         'recall': float(recall),
         'f1_score': float(f1),
         'total_samples': len(true_classes),
-        'num_classes': len(test_generator.class_indices)
+        'num_classes': len(class_names)
     }
     
+    # Every test pair gives the TAR/FAR trade-off behind the backend's match threshold
+    if len(np.unique(true_classes)) > 1:
+        metrics['verification'] = verify_gallery(predictions, true_classes)
+    
     print("Validation Results:")
     print(f"Accuracy: {accuracy:.4f} (Target: >= 0.95)")
     print(f"Precision: {precision:.4f}")
@@ -58,42 +68,65 @@ def validate_model(model_path, test_data_dir):
     else:
         print("✗ Model does not meet accuracy requirement")
     
+    if 'verification' in metrics:
+        print_verification_report({model_path: metrics['verification']})
+    
     return metrics
 
-def test_lighting_conditions(model, test_images_dir):
+def load_face_crop(path):
+    """Face crop for evaluation, falling back to the whole frame like /predict"""
+    crop = crop_face_file(path)
+    if crop is None:
+        crop = cv2.resize(load_rgb(path), CROP_SIZE, interpolation=cv2.INTER_AREA)
+    return crop
+
+def evaluate_identity_buckets(model, test_images_dir, buckets, batch_size=32, num_workers=4):
     """
-    Test model performance under different lighting conditions
+    Identification accuracy and latency per bucket directory
+    Each bucket is test_images_dir/<bucket>/<person>/*.jpg; accuracy is
+    leave-one-out nearest-neighbour identification within the bucket.
     """
-    lighting_conditions = ['100lux', '500lux', '1000lux']
-    results = {}
+    engine = EvaluationEngine(
+        lambda crops: model.predict(preprocess_batch(crops), verbose=0),
+        load_fn=load_face_crop,
+        batch_size=batch_size,
+        num_workers=num_workers
+    )
+    samples = (
+        sample for bucket in buckets
+        for sample in identity_samples(os.path.join(test_images_dir, bucket), bucket)
+    )
+    evaluation = engine.run(samples, collect=True)
     
-    for condition in lighting_conditions:
-        condition_dir = f"{test_images_dir}/{condition}"
-        # Test with images from this lighting condition
-        # Implementation would load and test images
-        results[condition] = {
-            'accuracy': 0.0,  # Placeholder
-            'samples': 0
+    results = {}
+    for bucket in buckets:
+        pairs = evaluation.predictions.get(bucket, [])
+        results[bucket] = {
+            'accuracy': nearest_neighbour_accuracy(
+                [prediction for _, prediction in pairs],
+                [sample['label'] for sample, _ in pairs]
+            ),
+            'samples': len(pairs)
         }
+    results['latency'] = evaluation.latency()
     
     return results
 
+def test_lighting_conditions(model, test_images_dir):
+    """
+    Test model performance under different lighting conditions
+    Expects test_images_dir/<condition>/<person>/*.jpg
+    """
+    lighting_conditions = ['100lux', '500lux', '1000lux']
+    return evaluate_identity_buckets(model, test_images_dir, lighting_conditions)
+
 def test_angle_variations(model, test_images_dir):
     """
     Test model performance with different head angles
+    Expects test_images_dir/<angle>/<person>/*.jpg
     """
     angles = ['0deg', '15deg', '30deg']
-    results = {}
-    
-    for angle in angles:
-        angle_dir = f"{test_images_dir}/{angle}"
-        # Test with images from this angle
-        results[angle] = {
-            'accuracy': 0.0,  # Placeholder
-            'samples': 0
-        }
-    
-    return results
+    return evaluate_identity_buckets(model, test_images_dir, angles)
 
 def save_validation_report(metrics, output_path='validation_report.json'):
     """
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services import the shared modules flat, from ml-services/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
@@ -0,0 +1,102 @@
+import pytest
+
+import adaptive_resolution
+from adaptive_resolution import ResolutionController
+
+LADDER = [320, 416, 512, 640]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(adaptive_resolution, 'time', clock)
+    return clock
+
+
+def calls(controller, clock, latency_ms, count=8, frames=None, image_shape=None):
+    """Run count model calls that each take latency_ms; returns the sizes used"""
+    sizes = []
+    for _ in range(count):
+        with controller.track(image_shape, frames=frames) as size:
+            clock.now += latency_ms / 1000
+            sizes.append(size)
+    return sizes
+
+
+def controller(**kwargs):
+    options = {'sizes': LADDER, 'initial': 640, 'target_ms': 33, 'batch_target_ms': 33,
+               'headroom': 0.7, 'adjust_every': 8}
+    options.update(kwargs)
+    return ResolutionController(**options)
+
+
+def test_steps_down_one_size_per_decision_over_target(clock):
+    resolution = controller()
+    calls(resolution, clock, 50)
+    assert resolution.size == 512
+    assert resolution.last_decision['reason'] == 'over_target'
+    # The new size starts with an empty window
+    calls(resolution, clock, 50, count=7)
+    assert resolution.size == 512
+    calls(resolution, clock, 50, count=1)
+    assert resolution.size == 416
+    assert resolution.steps_down == 2
+
+
+def test_steps_up_only_with_headroom(clock):
+    resolution = controller(initial=320)
+    # 10ms projects to 10 * (416/320)^2 = 17ms, under 0.7 * 33
+    calls(resolution, clock, 10)
+    assert resolution.size == 416
+    # 20ms projects to 30ms at 512: no step
+    calls(resolution, clock, 20)
+    assert resolution.size == 416
+    assert resolution.steps_up == 1
+
+
+def test_queue_depth_forces_a_step_down(clock):
+    resolution = controller(queue_depth=lambda: 4)
+    calls(resolution, clock, 5)
+    assert resolution.size == 512
+    assert resolution.last_decision['reason'] == 'overloaded'
+
+
+def test_batched_calls_are_held_to_their_own_per_frame_target(clock):
+    # 8-frame calls of 200ms are 25ms per frame: well over the single-call
+    # target per call, but within the per-frame target
+    resolution = controller()
+    calls(resolution, clock, 200, frames=8)
+    assert resolution.size == 640 and resolution.steps_down == 0
+
+    resolution = controller(batch_target_ms=20)
+    calls(resolution, clock, 200, frames=8)
+    assert resolution.size == 512
+    assert resolution.last_decision['p95_ms'] == {'batch': pytest.approx(25)}
+
+
+def test_slow_single_calls_step_down_despite_fast_batches(clock):
+    resolution = controller()
+    calls(resolution, clock, 80, count=4, frames=8)
+    calls(resolution, clock, 40, count=4)
+    assert resolution.size == 640
+    calls(resolution, clock, 40, count=8)
+    assert resolution.size == 512
+    assert resolution.last_decision['load'] == pytest.approx(40 / 33)
+
+
+def test_small_images_are_capped_but_count_toward_the_current_size(clock):
+    resolution = controller()
+    sizes = calls(resolution, clock, 50, image_shape=(200, 300, 3))
+    assert set(sizes) == {320}
+    assert resolution.size == 512
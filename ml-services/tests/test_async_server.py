@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import threading
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from async_server import AsyncRoute, BlockingRoute, InferenceQueue, create_async_app
+from request_coalescer import RequestCoalescer
+
+
+def image_body(data=b'same image'):
+    return {'image': base64.b64encode(data).decode()}
+
+
+async def serve(routes=(), blocking_routes=(), workers=1, max_depth=1):
+    queue = InferenceQueue(workers=workers, max_depth=max_depth)
+    app = create_async_app(list(routes), lambda: {'status': 'ok'}, RequestCoalescer(), queue=queue,
+                           blocking_routes=list(blocking_routes))
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client, queue
+
+
+def test_duplicates_wait_on_the_loop_without_queue_slots():
+    release = threading.Event()
+    calls = []
+
+    def infer(image_bytes):
+        calls.append(image_bytes)
+        release.wait(5)
+        return {'size': len(image_bytes)}
+
+    async def scenario():
+        # One worker and a queue depth of one: any duplicate that needed a
+        # slot would be shed with a 503
+        client, queue = await serve([AsyncRoute('/detect', 'detect', infer)])
+        try:
+            requests = [asyncio.ensure_future(client.post('/detect', json=image_body())) for _ in range(8)]
+            while not calls:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            assert queue.stats()['queue_depth'] == 1
+            release.set()
+
+            responses = await asyncio.gather(*requests)
+            bodies = [await response.json() for response in responses]
+            return [r.status for r in responses], bodies, queue.stats()
+        finally:
+            await client.close()
+
+    statuses, bodies, stats = asyncio.run(scenario())
+    assert statuses == [200] * 8
+    assert len(calls) == 1
+    assert sum(body['coalesced'] for body in bodies) == 7
+    assert stats['completed'] == 1 and stats['rejected'] == 0
+
+
+def test_blocking_routes_are_admitted_through_the_queue():
+    release = threading.Event()
+
+    def handler(data, deadline):
+        release.wait(5)
+        return {'ok': True}, 200
+
+    async def scenario():
+        client, queue = await serve(blocking_routes=[BlockingRoute('/batch', handler)])
+        try:
+            first = asyncio.ensure_future(client.post('/batch', json={}))
+            while queue.stats()['running'] == 0:
+                await asyncio.sleep(0.01)
+            shed = await client.post('/batch', json={})
+            release.set()
+            return (await first).status, shed.status, shed.headers.get('Retry-After')
+        finally:
+            await client.close()
+
+    first, shed, retry_after = asyncio.run(scenario())
+    assert first == 200
+    assert shed == 503
+    assert retry_after is not None
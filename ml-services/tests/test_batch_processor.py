@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from batch_processor import BatchProcessor, ItemError, QueueFullError
+from deadlines import DeadlineExceeded
+
+
+def slow_identity(item):
+    # Earlier items take longer, so completion order is the reverse of input order
+    value, delay = item
+    time.sleep(delay)
+    return value
+
+
+def test_ordered_imap_yields_in_input_order():
+    items = [(index, 0.05 - index * 0.01) for index in range(5)]
+    with BatchProcessor(max_workers=5, queue_size=5) as processor:
+        assert list(processor.imap(items, slow_identity)) == [0, 1, 2, 3, 4]
+
+
+def test_unordered_imap_yields_in_completion_order_with_indices():
+    items = [(index, 0.08 - index * 0.02) for index in range(4)]
+    with BatchProcessor(max_workers=4, queue_size=4) as processor:
+        results = list(processor.imap(items, slow_identity, ordered=False))
+    assert sorted(results) == [(i, i) for i in range(4)]
+    assert [index for index, _ in results] == [3, 2, 1, 0]
+
+
+def test_failed_items_become_item_errors():
+    def fail_on_two(item):
+        if item == 2:
+            raise ValueError("two")
+        return item
+
+    with BatchProcessor(max_workers=2) as processor:
+        results = processor.process_parallel(range(4), fail_on_two)
+    assert results[:2] == [0, 1] and results[3] == 3
+    assert isinstance(results[2], ItemError)
+    assert results[2].index == 2 and results[2].error_type == 'ValueError'
+
+
+def test_imap_streams_within_the_queue_bound():
+    consumed = []
+
+    def items():
+        for index in range(20):
+            consumed.append(index)
+            yield index
+
+    with BatchProcessor(max_workers=2, queue_size=3) as processor:
+        stream = processor.imap(items(), lambda x: x)
+        assert next(stream) == 0
+        # Only the window of queue_size items has been pulled from the input
+        assert len(consumed) == 3
+        stream.close()
+
+
+def test_submit_without_blocking_raises_when_full():
+    release = threading.Event()
+    with BatchProcessor(max_workers=1, queue_size=1) as processor:
+        processor.submit(lambda _: release.wait(5), None)
+        with pytest.raises(QueueFullError):
+            processor.submit(lambda _: None, None, block=False)
+        release.set()
+
+
+def test_cancel_drops_items_that_have_not_started():
+    release = threading.Event()
+    started = threading.Event()
+
+    def block(_):
+        started.set()
+        release.wait(5)
+
+    with BatchProcessor(max_workers=1, queue_size=4) as processor:
+        running = processor.submit(block, None)
+        started.wait(5)
+        queued = [processor.submit(lambda x: x, index) for index in range(3)]
+        assert processor.cancel() == 3
+        release.set()
+        running.result(5)
+    assert all(future.cancelled() for future in queued)
+
+
+def test_expired_items_are_left_out_of_batches():
+    processor = BatchProcessor(batch_size=2)
+    now = time.time()
+    results = processor.process_batch(
+        [1, 2, 3], lambda batch: list(batch * 10), deadlines=[now - 1, None, now + 60]
+    )
+    assert isinstance(results[0], ItemError)
+    assert isinstance(results[0].error, DeadlineExceeded)
+    assert results[1:] == [20, 30]
+    assert processor.expired == 1
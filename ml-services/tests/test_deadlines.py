@@ -0,0 +1,41 @@
+import threading
+import time
+
+import pytest
+
+from deadlines import (DeadlineExceeded, check_deadline, current_deadline, deadline_from_headers,
+                       deadline_scope, remaining_ms)
+
+
+def test_headers_take_the_earlier_deadline():
+    received = 1000.0
+    assert deadline_from_headers({}, received) is None
+    assert deadline_from_headers({'X-Request-Timeout-Ms': '250'}, received) == pytest.approx(1000.25)
+    headers = {'X-Request-Timeout-Ms': '5000', 'X-Request-Deadline': '1000500'}
+    assert deadline_from_headers(headers, received) == pytest.approx(1000.5)
+    # Malformed values are ignored
+    assert deadline_from_headers({'X-Request-Timeout-Ms': 'soon'}, received) is None
+
+
+def test_expired_deadline_raises_with_stage_and_lateness():
+    check_deadline('detect', time.time() + 1)
+    with pytest.raises(DeadlineExceeded) as raised:
+        check_deadline('detect', time.time() - 0.2)
+    assert raised.value.stage == 'detect'
+    assert raised.value.overdue_ms == pytest.approx(200, abs=50)
+    assert remaining_ms(None) is None
+
+
+def test_scope_is_per_thread_and_nests():
+    seen = []
+    with deadline_scope(time.time() - 1):
+        with pytest.raises(DeadlineExceeded):
+            check_deadline('embed')
+        with deadline_scope(None):
+            check_deadline('embed')
+        thread = threading.Thread(target=lambda: seen.append(current_deadline()))
+        thread.start()
+        thread.join()
+        assert current_deadline() is not None
+    assert current_deadline() is None
+    assert seen == [None]
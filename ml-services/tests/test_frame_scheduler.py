@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from deadlines import DeadlineExceeded
+from frame_scheduler import FairFrameScheduler, FrameDropped, _Camera
+
+
+class BlockedScheduler:
+    """
+    Scheduler whose first model call blocks until release(), so frames
+    queued meanwhile are packed together in the next batch
+    """
+
+    def __init__(self, **kwargs):
+        self.batches = []
+        self.started = threading.Event()
+        self.unblock = threading.Event()
+        self.scheduler = FairFrameScheduler(self.process_batch, max_wait_ms=1, **kwargs)
+        self.first = self.scheduler.submit('warmup', 'warmup')
+        assert self.started.wait(5)
+
+    def process_batch(self, items):
+        if not self.batches:
+            self.started.set()
+            self.unblock.wait(5)
+        self.batches.append(list(items))
+        return [f'{item}-done' for item in items]
+
+    def release(self):
+        self.unblock.set()
+        self.first.result(5)
+
+
+def test_token_bucket_refills_at_the_budget_up_to_the_burst():
+    camera = _Camera(fps_budget=2)
+    camera.refilled = 0.0
+    assert camera.has_token(0.0) and camera.tokens == 2.0
+    camera.tokens = 0.0
+    assert not camera.has_token(0.25)
+    assert camera.has_token(0.5)
+    # Idle time never banks more than one second of budget
+    assert camera.has_token(100.0) and camera.tokens == 2.0
+
+
+def test_batches_rotate_across_cameras_before_serving_over_budget_frames():
+    blocked = BlockedScheduler(batch_size=4, fps_budget=1, max_queued=3)
+    flood = [blocked.scheduler.submit('flood', f'f{i}') for i in range(3)]
+    quiet = [blocked.scheduler.submit(camera, f'{camera}0') for camera in ('a', 'b')]
+    blocked.release()
+
+    for future in flood[:2] + quiet:
+        assert future.result(5)['batch_size'] == 4
+    flood[2].result(5)
+
+    # One frame per camera within budget, then the flooding camera's
+    # second frame fills the spare slot
+    assert blocked.batches[1] == ['f0', 'a0', 'b0', 'f1']
+    assert blocked.batches[2] == ['f2']
+    stats = blocked.scheduler.stats()
+    assert stats['flood']['over_budget'] == 2
+    assert stats['a']['over_budget'] == 0
+    blocked.scheduler.close()
+
+
+def test_full_camera_queue_drops_its_oldest_frame():
+    blocked = BlockedScheduler(batch_size=4, max_queued=2)
+    futures = [blocked.scheduler.submit('cam', f'frame{i}') for i in range(4)]
+    blocked.release()
+
+    for future in futures[:2]:
+        with pytest.raises(FrameDropped) as dropped:
+            future.result(5)
+        assert dropped.value.reason == 'superseded'
+    assert [future.result(5)['result'] for future in futures[2:]] == ['frame2-done', 'frame3-done']
+    assert blocked.scheduler.stats(['cam'])['cam']['dropped_superseded'] == 2
+    blocked.scheduler.close()
+
+
+def test_expired_frames_are_left_out_of_the_batch():
+    blocked = BlockedScheduler(batch_size=4)
+    expired = blocked.scheduler.submit('cam', 'late', deadline=0.0)
+    live = blocked.scheduler.submit('other', 'fresh')
+    blocked.release()
+
+    with pytest.raises(DeadlineExceeded):
+        expired.result(5)
+    assert live.result(5)['result'] == 'fresh-done'
+    assert blocked.batches[1] == ['fresh']
+    blocked.scheduler.close()
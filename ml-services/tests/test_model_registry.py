@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+from flask import Flask
+
+import model_registry
+from async_server import create_async_app
+from model_registry import ModelRegistry, install_model_routes, model_admin_routes
+from request_coalescer import RequestCoalescer
+
+TOKEN = 's3cret'
+
+
+def make_registry(tmp_path, versions=('v1', 'v2')):
+    for version in versions:
+        os.makedirs(tmp_path / 'svc' / version)
+    return ModelRegistry('svc', loader=os.path.basename, root=str(tmp_path))
+
+
+def flask_client(registry, admin_token):
+    app = Flask(__name__)
+    install_model_routes(app, registry, admin_token)
+    return app.test_client()
+
+
+def test_admin_endpoints_need_the_token(tmp_path):
+    registry = make_registry(tmp_path)
+    client = flask_client(registry, TOKEN)
+
+    assert client.post('/models/svc/load', json={'version': 'v2'}).status_code == 401
+    wrong = client.post('/models/svc/promote', headers={'Authorization': 'Bearer nope'})
+    assert wrong.status_code == 401
+
+    loaded = client.post('/models/svc/load', json={'version': 'v2'},
+                         headers={'Authorization': f'Bearer {TOKEN}'})
+    assert loaded.status_code == 202
+    # Status stays readable without a token
+    assert client.get('/models/svc').status_code == 200
+
+
+def test_admin_endpoints_are_disabled_without_a_token(tmp_path):
+    client = flask_client(make_registry(tmp_path), None)
+    response = client.post('/models/svc/drop-shadow', headers={'Authorization': 'Bearer '})
+    assert response.status_code == 403
+
+
+def test_invalid_json_is_a_bad_request(tmp_path):
+    registry = make_registry(tmp_path)
+    headers = {'Authorization': f'Bearer {TOKEN}', 'Content-Type': 'application/json'}
+
+    response = flask_client(registry, TOKEN).post('/models/svc/load', data='{', headers=headers)
+    assert response.status_code == 400
+
+    async def scenario():
+        app = create_async_app([], lambda: {'status': 'ok'}, RequestCoalescer(),
+                               admin_routes=model_admin_routes(registry, TOKEN))
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            response = await client.post('/models/svc/load', data='{', headers=headers)
+            return response.status
+        finally:
+            await client.close()
+
+    assert asyncio.run(scenario()) == 400
+
+
+def test_shadow_comparisons_keep_a_bounded_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'SHADOW_COMPARISON_WINDOW', 5)
+    registry = make_registry(tmp_path)
+    registry.load('v1')
+    registry.load('v2', role='shadow')
+
+    for agreement in range(20):
+        registry._comparisons.append(float(agreement))
+    comparison = registry.stats()['shadow_comparison']
+    assert comparison['count'] == 5
+    assert comparison['min'] == 15.0
+
+    registry.promote()
+    assert registry.stats()['shadow_comparison']['count'] == 0
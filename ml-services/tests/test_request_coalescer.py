@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from deadlines import DeadlineExceeded
+from request_coalescer import RequestCoalescer
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def test_duplicates_share_one_call_and_stop_waiting():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    threads = run_threads([lambda: results.append(coalescer.run('key', work)) for _ in range(4)])
+    wait_for(lambda: coalescer.stats()['waiting'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [('result', False)] + [('result', True)] * 3
+    stats = coalescer.stats()
+    assert stats['coalesced_requests'] == 3
+    assert stats['waiting'] == 0 and stats['in_flight'] == 0
+
+
+def test_duplicate_gives_up_at_its_own_deadline():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    leader = run_threads([lambda: coalescer.run('key', lambda: release.wait(5))])[0]
+    wait_for(lambda: coalescer.stats()['in_flight'] == 1)
+
+    start = time.time()
+    with pytest.raises(DeadlineExceeded) as raised:
+        coalescer.run('key', lambda: None, deadline=time.time() + 0.05)
+    assert raised.value.stage == 'coalesced_wait'
+    assert time.time() - start < 1
+    assert coalescer.stats()['waiting'] == 0
+
+    release.set()
+    leader.join()
+
+
+def test_duplicate_retries_when_the_leader_ran_out_of_time():
+    coalescer = RequestCoalescer()
+    leader_started = threading.Event()
+    fail = threading.Event()
+    outcomes = []
+
+    def leader_work():
+        leader_started.set()
+        fail.wait(5)
+        raise DeadlineExceeded('embed', 1.0)
+
+    def leader():
+        try:
+            coalescer.run('key', leader_work)
+        except DeadlineExceeded as e:
+            outcomes.append(('leader', e.stage))
+
+    def follower():
+        outcomes.append(('follower', coalescer.run('key', lambda: 'retried', deadline=time.time() + 5)))
+
+    threads = run_threads([leader])
+    leader_started.wait(5)
+    threads += run_threads([follower])
+    wait_for(lambda: coalescer.stats()['waiting'] == 1)
+    fail.set()
+    for thread in threads:
+        thread.join()
+
+    assert ('leader', 'embed') in outcomes
+    assert ('follower', ('retried', False)) in outcomes
+    assert coalescer.stats()['deadline_retries'] == 1
+
+
+def test_other_leader_errors_reach_the_duplicates():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    errors = []
+
+    def work():
+        release.wait(5)
+        raise ValueError("bad image")
+
+    def call():
+        try:
+            coalescer.run('key', work)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = run_threads([call, call])
+    wait_for(lambda: coalescer.stats()['waiting'] == 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ['bad image', 'bad image']
+
+
+def test_async_duplicates_retry_after_leader_deadline():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise DeadlineExceeded('queue', 1.0)
+        return 'second'
+
+    async def scenario():
+        leader = asyncio.ensure_future(coalescer.run_async('key', work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.run_async('key', work, deadline=time.time() + 5))
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        return results
+
+    leader, follower = asyncio.run(scenario())
+    assert isinstance(leader, DeadlineExceeded)
+    assert follower == ('second', False)
+    assert len(calls) == 2
+    assert coalescer.stats()['waiting'] == 0
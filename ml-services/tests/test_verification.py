@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from verification import (VerificationCurve, evaluate_verification, gallery_similarities,
+                          pair_similarities)
+
+
+def uniform_scores(n=10_000):
+    """Impostors uniform on [0, 1], genuine on [0.5, 1.5]: EER 0.25 at 0.75"""
+    impostor = np.linspace(0, 1, n, endpoint=False) + 0.5 / n
+    return impostor + 0.5, impostor
+
+
+def test_uniform_equal_error_rate():
+    curve = VerificationCurve(*uniform_scores())
+    eer, threshold = curve.equal_error_rate()
+    assert eer == pytest.approx(0.25, abs=1e-3)
+    assert threshold == pytest.approx(0.75, abs=1e-3)
+
+
+def test_uniform_tar_at_far():
+    curve = VerificationCurve(*uniform_scores())
+    point = curve.tar_at_far([0.1])['1e-01']
+    # FAR 0.1 -> threshold 0.9 -> 60% of genuine scores lie above it
+    assert point['far'] <= 0.1
+    assert point['threshold'] == pytest.approx(0.9, abs=1e-3)
+    assert point['tar'] == pytest.approx(0.6, abs=1e-3)
+    assert point['resolved']
+
+
+def test_gaussian_scores_match_closed_form():
+    rng = np.random.default_rng(0)
+    genuine = rng.normal(1.0, 1.0, 400_000)
+    impostor = rng.normal(-1.0, 1.0, 400_000)
+    curve = VerificationCurve(genuine, impostor)
+
+    # Means +-1, unit variance: EER = Phi(-1) at threshold 0
+    eer, threshold = curve.equal_error_rate()
+    assert eer == pytest.approx(0.158655, abs=3e-3)
+    assert threshold == pytest.approx(0.0, abs=0.02)
+
+    # FAR 1e-2 -> threshold -1 + 2.3263; TAR = 1 - Phi(0.3263)
+    point = curve.tar_at_far([1e-2])['1e-02']
+    assert point['threshold'] == pytest.approx(1.3263, abs=0.02)
+    assert point['tar'] == pytest.approx(0.3721, abs=5e-3)
+
+
+def test_threshold_at_far_accepts_at_most_the_allowed_impostors():
+    impostor = np.arange(1, 11) / 10
+    curve = VerificationCurve([0.75, 0.95], impostor)
+
+    threshold = float(curve.threshold_at_far(0.2))
+    assert (impostor >= threshold).sum() == 2
+    tar, far = curve.rates([threshold])
+    assert far[0] == pytest.approx(0.2)
+    assert tar[0] == pytest.approx(0.5)
+
+    # FAR 1 accepts everything
+    assert float(curve.threshold_at_far(1.0)) == pytest.approx(0.1)
+
+
+def test_separable_scores_have_zero_error():
+    curve = VerificationCurve([0.8, 0.9, 1.0], [0.1, 0.2, 0.3])
+    eer, threshold = curve.equal_error_rate()
+    assert eer == 0
+    tar, far = curve.rates([threshold])
+    assert (tar[0], far[0]) == (1.0, 0.0)
+
+
+def test_unresolved_far_targets_are_flagged():
+    curve = VerificationCurve(*uniform_scores(100))
+    points = curve.tar_at_far([1e-1, 1e-3])
+    assert points['1e-01']['resolved']
+    assert not points['1e-03']['resolved']
+
+
+def test_det_points_are_monotonic():
+    rng = np.random.default_rng(1)
+    curve = VerificationCurve(rng.normal(1, 1, 5000), rng.normal(-1, 1, 5000))
+    far, tar, threshold = np.array(curve.det_points(30)).T
+    assert np.all(np.diff(far) >= 0)
+    assert np.all(np.diff(tar) >= 0)
+    assert np.all(np.diff(threshold) <= 0)
+
+
+def test_empty_score_sets_are_rejected():
+    with pytest.raises(ValueError):
+        VerificationCurve([], [0.1])
+
+
+def test_report_uses_the_target_far():
+    report = evaluate_verification(*uniform_scores(), target_far=0.1)
+    assert report['recommended_far'] <= 0.1
+    assert report['recommended_tar'] == pytest.approx(0.6, abs=1e-3)
+    assert report['eer'] == pytest.approx(0.25, abs=1e-3)
+
+
+def test_gallery_similarities_cover_every_pair_once():
+    rng = np.random.default_rng(2)
+    embeddings = rng.normal(size=(9, 4))
+    labels = [0, 0, 0, 1, 1, 2, 2, 2, 2]
+
+    # Blocks smaller than the gallery exercise the off-diagonal blocks
+    genuine, impostor = gallery_similarities(embeddings, labels, block_size=4)
+    assert len(genuine) == 3 + 1 + 6
+    assert len(genuine) + len(impostor) == 9 * 8 // 2
+
+    pairs = np.array([(i, j) for i in range(9) for j in range(i + 1, 9)])
+    same = np.array([labels[i] == labels[j] for i, j in pairs])
+    expected = pair_similarities(embeddings, pairs, chunk_size=5)
+    np.testing.assert_allclose(np.sort(genuine), np.sort(expected[same]), rtol=1e-5)
+    np.testing.assert_allclose(np.sort(impostor), np.sort(expected[~same]), rtol=1e-5)
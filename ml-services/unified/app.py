@@ -0,0 +1,182 @@
+# Unified inference server: hosts the selected ML pipelines in one process
+#
+#     python unified/app.py --pipelines individual,group,crowd --port 5004
+#
+# Each pipeline keeps its own route (/predict, /detect-and-extract, /count)
+# and /health reports every loaded pipeline. Pipelines share one Python
+# runtime, one copy of numpy/OpenCV/torch, the image decode stage, the
+# request coalescer, the inference thread pools and the request metrics.
+import argparse
+import importlib.util
+import os
+import sys
+
+ML_SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ML_SERVICES_DIR, 'common'))
+
+from flask import Flask, jsonify
+from flask_cors import CORS
+from request_coalescer import RequestCoalescer
+from service_metrics import ServiceMetrics
+from async_server import SERVING_MODE, serve_async
+
+# pipeline name -> (service directory, model loading function)
+PIPELINES = {
+    'individual': ('individual_auth', 'load_model'),
+    'group': ('group_auth', 'load_models'),
+    'crowd': ('crowd_counting', 'load_models')
+}
+
+DEFAULT_PIPELINES = os.environ.get('UNIFIED_PIPELINES', ','.join(PIPELINES))
+
+# One intra-op pool size for every framework in the process, instead of
+# each of three processes sizing its pools to the whole machine
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', os.cpu_count() or 1))
+
+
+def configure_threads(num_threads=INFERENCE_THREADS):
+    """Size the OpenMP / torch / TensorFlow thread pools once for the process"""
+    os.environ.setdefault('OMP_NUM_THREADS', str(num_threads))
+    os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(num_threads))
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '2')
+
+    import cv2
+    cv2.setNumThreads(num_threads)
+
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+
+
+def load_pipeline(name):
+    """
+    Import a service's app.py under a unique module name
+    Returns:
+        The service module (its Flask app is not run)
+    """
+    directory, _ = PIPELINES[name]
+    service_dir = os.path.join(ML_SERVICES_DIR, directory)
+    # Service-local imports (e.g. individual_auth/preprocessing.py)
+    sys.path.insert(0, service_dir)
+
+    spec = importlib.util.spec_from_file_location(f'{directory}_app', os.path.join(service_dir, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_pipelines(pipelines, load_models=True):
+    """
+    Import the selected pipelines and share one coalescer and metrics
+    Args:
+        pipelines: Pipeline names to host (keys of PIPELINES)
+        load_models: Call each pipeline's model loader
+    Returns:
+        Tuple of (dict of name -> service module, coalescer, metrics)
+    """
+    unknown = [name for name in pipelines if name not in PIPELINES]
+    if unknown:
+        raise ValueError(f"Unknown pipelines {unknown} (available: {', '.join(PIPELINES)})")
+
+    configure_threads()
+
+    coalescer = RequestCoalescer()
+    metrics = ServiceMetrics()
+
+    modules = {}
+    for name in pipelines:
+        module = load_pipeline(name)
+
+        # Share the coalescer (keys are namespaced per route) and metrics
+        module.coalescer = coalescer
+        module.metrics = metrics
+
+        if load_models:
+            getattr(module, PIPELINES[name][1])()
+
+        modules[name] = module
+
+    configure_threads()
+
+    return modules, coalescer, metrics
+
+
+def health_report(modules, coalescer, metrics):
+    """/health fields of the unified server"""
+    pipelines_health = {}
+    for name, module in modules.items():
+        report = module.health_report()
+        # Shared across pipelines; reported once below
+        report.pop('coalescing', None)
+        report.pop('metrics', None)
+        pipelines_health[name] = report
+
+    return {
+        'status': 'ok',
+        'service': 'unified',
+        'pipelines': pipelines_health,
+        'inference_threads': INFERENCE_THREADS,
+        'coalescing': coalescer.stats(),
+        'metrics': metrics.snapshot()
+    }
+
+
+def create_app(pipelines, load_models=True):
+    """
+    Build the unified Flask app
+    Args:
+        pipelines: Pipeline names to host (keys of PIPELINES)
+        load_models: Call each pipeline's model loader
+    """
+    modules, coalescer, metrics = load_pipelines(pipelines, load_models)
+
+    app = Flask(__name__)
+    CORS(app)
+    metrics.install(app)
+
+    for name, module in modules.items():
+        for rule in module.app.url_map.iter_rules():
+            if rule.endpoint == 'static' or rule.rule == '/health':
+                continue
+            app.add_url_rule(
+                rule.rule,
+                endpoint=f'{name}.{rule.endpoint}',
+                view_func=module.app.view_functions[rule.endpoint],
+                methods=rule.methods
+            )
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify(health_report(modules, coalescer, metrics))
+
+    return app
+
+
+def serve_unified_async(pipelines, host, port):
+    """Serve every selected pipeline's routes from one async front end"""
+    modules, coalescer, metrics = load_pipelines(pipelines)
+    routes = [route for module in modules.values() for route in module.ASYNC_ROUTES]
+    admin_routes = [route for module in modules.values() for route in module.ADMIN_ROUTES]
+    blocking_routes = [route for module in modules.values() for route in getattr(module, 'BLOCKING_ROUTES', [])]
+    serve_async(routes, lambda: health_report(modules, coalescer, metrics), coalescer,
+                port=port, host=host, metrics=metrics, admin_routes=admin_routes,
+                blocking_routes=blocking_routes)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Unified ML inference server')
+    parser.add_argument('--pipelines', default=DEFAULT_PIPELINES,
+                        help='Comma-separated pipelines to host (individual,group,crowd)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5004)))
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    pipelines = [name.strip() for name in args.pipelines.split(',') if name.strip()]
+    print(f"Unified server hosting {', '.join(pipelines)} on port {args.port}")
+    if SERVING_MODE == 'async':
+        serve_unified_async(pipelines, args.host, args.port)
+    else:
+        create_app(pipelines).run(host=args.host, port=args.port, threaded=True)
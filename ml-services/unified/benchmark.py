@@ -0,0 +1,210 @@
+# Compare the unified server against three separate services under the same load
+#
+#     python unified/benchmark.py --pipelines individual,group,crowd --requests 200
+#
+# Both layouts are started as fresh processes, warmed up, then driven with
+# the same concurrent mix of requests across every hosted route. Reports
+# requests/second, per-route latency and the summed RSS of the server
+# processes.
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app import ML_SERVICES_DIR, PIPELINES
+
+sys.path.insert(0, os.path.join(ML_SERVICES_DIR, 'common'))
+from service_metrics import process_rss_mb
+
+# pipeline -> (standalone port, route)
+ROUTES = {
+    'individual': (5001, '/predict'),
+    'group': (5002, '/detect-and-extract'),
+    'crowd': (5003, '/count')
+}
+UNIFIED_PORT = 5004
+
+# Synthetic frames have no faces; flag instead of rejecting them so the
+# whole pipeline runs for every request
+SERVER_ENV = {**os.environ, 'FACE_QUALITY_GATE': 'flag'}
+
+
+def peak_rss_mb(pid):
+    """High-water mark of a process's RSS in MB (Linux /proc)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def make_payloads(count=16, size=(480, 640)):
+    """Distinct synthetic JPEGs so requests are not coalesced"""
+    rng = np.random.default_rng(0)
+    payloads = []
+    for _ in range(count):
+        frame = cv2.GaussianBlur(rng.integers(0, 256, size + (3,), dtype=np.uint8), (9, 9), 0)
+        jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+        payloads.append(json.dumps({'image': base64.b64encode(jpeg).decode()}).encode())
+    return payloads
+
+
+def post(url, body, timeout=60):
+    """POST a JSON body; returns (latency ms, HTTP status)"""
+    start = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    return (time.perf_counter() - start) * 1000, status
+
+
+def wait_healthy(port, process, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server on port {port} exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError(f"Server on port {port} did not become healthy")
+
+
+def start_standalone(name):
+    directory, loader = PIPELINES[name]
+    port, _ = ROUTES[name]
+    # Same as `python app.py` without the debug reloader's second process
+    code = (f"import app; app.{loader}(); "
+            f"app.app.run(host='127.0.0.1', port={port}, threaded=True)")
+    return subprocess.Popen(
+        [sys.executable, '-c', code], cwd=os.path.join(ML_SERVICES_DIR, directory),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=SERVER_ENV
+    )
+
+
+def start_unified(pipelines):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ML_SERVICES_DIR, 'unified', 'app.py'),
+         '--pipelines', ','.join(pipelines), '--host', '127.0.0.1', '--port', str(UNIFIED_PORT)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=SERVER_ENV
+    )
+
+
+def drive(targets, payloads, num_requests, concurrency):
+    """
+    Send num_requests per target with a shared thread pool
+    Args:
+        targets: Dict of pipeline -> URL
+    Returns:
+        Tuple of (requests/second, {pipeline: latency percentiles}, errors);
+        4xx answers (e.g. the quality gate) count as served requests
+    """
+    jobs = [
+        (name, url, payloads[i % len(payloads)])
+        for i in range(num_requests) for name, url in targets.items()
+    ]
+    latencies = {name: [] for name in targets}
+    errors = 0
+
+    def run(job):
+        name, url, body = job
+        try:
+            return name, post(url, body)
+        except OSError:
+            return name, (None, None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, (latency, status) in executor.map(run, jobs):
+            if latency is None or status >= 500:
+                errors += 1
+            else:
+                latencies[name].append(latency)
+    elapsed = time.perf_counter() - start
+
+    per_route = {
+        name: {f'p{p}': float(np.percentile(values, p)) for p in (50, 95)} if values else {}
+        for name, values in latencies.items()
+    }
+    return (len(jobs) - errors) / elapsed, per_route, errors
+
+
+def measure(layout, pipelines, payloads, num_requests, concurrency):
+    if layout == 'unified':
+        processes = [start_unified(pipelines)]
+        ports = [UNIFIED_PORT]
+        targets = {name: f'http://127.0.0.1:{UNIFIED_PORT}{ROUTES[name][1]}' for name in pipelines}
+    else:
+        processes = [start_standalone(name) for name in pipelines]
+        ports = [ROUTES[name][0] for name in pipelines]
+        targets = {name: f'http://127.0.0.1:{ROUTES[name][0]}{ROUTES[name][1]}' for name in pipelines}
+
+    try:
+        for port, process in zip(ports, processes):
+            wait_healthy(port, process)
+        idle_rss = sum(process_rss_mb(p.pid) or 0 for p in processes)
+
+        # Warm up every route (lazy initialisation, first-call allocations)
+        drive(targets, payloads, 2, concurrency)
+        throughput, latency, errors = drive(targets, payloads, num_requests, concurrency)
+
+        return {
+            'processes': len(processes),
+            'idle_rss_mb': idle_rss,
+            'loaded_rss_mb': sum(process_rss_mb(p.pid) or 0 for p in processes),
+            'peak_rss_mb': sum(peak_rss_mb(p.pid) or 0 for p in processes),
+            'requests_per_second': throughput,
+            'latency_ms': latency,
+            'errors': errors
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Unified vs separate ML services')
+    parser.add_argument('--pipelines', default=','.join(PIPELINES))
+    parser.add_argument('--requests', type=int, default=100, help='Requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    pipelines = [name.strip() for name in args.pipelines.split(',') if name.strip()]
+    payloads = make_payloads()
+
+    results = {}
+    for layout in ('separate', 'unified'):
+        results[layout] = measure(layout, pipelines, payloads, args.requests, args.concurrency)
+        r = results[layout]
+        print(f"{layout}: {r['processes']} process(es), RSS idle {r['idle_rss_mb']:.0f} MB, "
+              f"loaded {r['loaded_rss_mb']:.0f} MB, peak {r['peak_rss_mb']:.0f} MB, "
+              f"{r['requests_per_second']:.1f} req/s, {r['errors']} errors")
+        for name, latency in r['latency_ms'].items():
+            if latency:
+                print(f"  {name}: p50 {latency['p50']:.1f}ms, p95 {latency['p95']:.1f}ms")
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
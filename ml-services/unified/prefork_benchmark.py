@@ -0,0 +1,157 @@
+# Compare per-worker memory of group_auth pre-fork workers against one process per core
+#
+#     python unified/prefork_benchmark.py --workers 4 --requests 100
+#
+# "separate" starts one `python app.py`-style process per worker, each
+# loading its own FaceNet and MTCNN weights (the current way to scale to
+# every core). "prefork" starts SERVING_MODE=prefork, where the master
+# loads the weights once and forks the workers. Both are warmed up and
+# driven with the same load, then every worker's RSS, PSS and USS (pages no
+# other process maps) are read from /proc, along with the cold start time
+# and throughput.
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from benchmark import SERVER_ENV, make_payloads, drive, wait_healthy
+from app import ML_SERVICES_DIR
+
+sys.path.insert(0, os.path.join(ML_SERVICES_DIR, 'common'))
+from service_metrics import process_memory_mb
+
+GROUP_DIR = os.path.join(ML_SERVICES_DIR, 'group_auth')
+ROUTE = '/detect-and-extract'
+PREFORK_PORT = 5002
+SEPARATE_BASE_PORT = 5102
+
+
+def child_pids(pid):
+    """Direct children of a process (scans /proc)"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; ppid follows its ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def start_separate(workers, threads):
+    processes = []
+    for index in range(workers):
+        code = ("from prefork import set_inference_threads; "
+                f"set_inference_threads({threads}); "
+                "import app; app.load_models(); "
+                f"app.app.run(host='127.0.0.1', port={SEPARATE_BASE_PORT + index}, threaded=False)")
+        processes.append(subprocess.Popen(
+            [sys.executable, '-c', code], cwd=GROUP_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env={**SERVER_ENV, 'PYTHONPATH': os.path.join(ML_SERVICES_DIR, 'common')}
+        ))
+    return processes
+
+
+def start_prefork(workers, threads):
+    return subprocess.Popen(
+        [sys.executable, 'app.py'], cwd=GROUP_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**SERVER_ENV, 'SERVING_MODE': 'prefork', 'PREFORK_WORKERS': str(workers),
+             'PREFORK_THREADS_PER_WORKER': str(threads)}
+    )
+
+
+def wait_workers(master, workers, timeout=60):
+    """Wait until the master has forked all its workers"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if len(child_pids(master.pid)) >= workers:
+            return child_pids(master.pid)
+        time.sleep(0.2)
+    raise TimeoutError("Pre-fork workers did not start")
+
+
+def measure(layout, workers, threads, payloads, num_requests, concurrency):
+    start = time.perf_counter()
+    if layout == 'prefork':
+        processes = [start_prefork(workers, threads)]
+        wait_healthy(PREFORK_PORT, processes[0])
+        worker_pids = wait_workers(processes[0], workers)
+        targets = {'prefork': f'http://127.0.0.1:{PREFORK_PORT}{ROUTE}'}
+        requests_per_target = num_requests * workers
+    else:
+        processes = start_separate(workers, threads)
+        for index, process in enumerate(processes):
+            wait_healthy(SEPARATE_BASE_PORT + index, process)
+        worker_pids = [p.pid for p in processes]
+        targets = {f'worker{i}': f'http://127.0.0.1:{SEPARATE_BASE_PORT + i}{ROUTE}' for i in range(workers)}
+        requests_per_target = num_requests
+    cold_start_s = time.perf_counter() - start
+
+    try:
+        drive(targets, payloads, 2, concurrency)
+        throughput, latency, errors = drive(targets, payloads, requests_per_target, concurrency)
+
+        memory = [process_memory_mb(pid) or {} for pid in worker_pids]
+        master = process_memory_mb(processes[0].pid) if layout == 'prefork' else None
+        return {
+            'workers': workers,
+            'threads_per_worker': threads,
+            'cold_start_s': cold_start_s,
+            'worker_memory_mb': memory,
+            'master_memory_mb': master,
+            'mean_worker_uss_mb': sum(m.get('uss', 0) for m in memory) / len(memory),
+            # PSS splits shared pages between the processes mapping them,
+            # so its sum is the real footprint of the whole service
+            'total_pss_mb': sum(m.get('pss', 0) for m in memory) + (master or {}).get('pss', 0),
+            'requests_per_second': throughput,
+            'latency_ms': latency,
+            'errors': errors
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-fork vs one process per worker (group_auth)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads per worker')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per worker')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    payloads = make_payloads()
+
+    results = {}
+    for layout in ('separate', 'prefork'):
+        results[layout] = r = measure(layout, args.workers, threads, payloads, args.requests, args.concurrency)
+        print(f"{layout}: {r['workers']} worker(s) x {r['threads_per_worker']} thread(s), "
+              f"cold start {r['cold_start_s']:.1f}s, mean worker USS {r['mean_worker_uss_mb']:.0f} MB, "
+              f"total PSS {r['total_pss_mb']:.0f} MB, {r['requests_per_second']:.1f} req/s, "
+              f"{r['errors']} errors")
+        for index, memory in enumerate(r['worker_memory_mb']):
+            if memory:
+                print(f"  worker {index}: RSS {memory['rss']:.0f} MB, PSS {memory['pss']:.0f} MB, "
+                      f"USS {memory['uss']:.0f} MB")
+        for name, latency in r['latency_ms'].items():
+            if latency:
+                print(f"  {name}: p50 {latency['p50']:.1f}ms, p95 {latency['p95']:.1f}ms")
+
+    saved = results['separate']['mean_worker_uss_mb'] - results['prefork']['mean_worker_uss_mb']
+    print(f"Pre-fork saves {saved:.0f} MB unique memory per worker")
+    return results
+
+
+if __name__ == '__main__':
+    main()